@@ -0,0 +1,51 @@
+# accounts/management/commands/onboard_accounts.py
+"""
+Bulk-create user accounts with trial API keys from a CSV (see accounts.onboarding).
+
+    python manage.py onboard_accounts agency.csv --quota 10 --out keys.csv
+
+The input needs an `email` column; an optional `password` column sets passwords (otherwise
+accounts get an unusable password and use the reset flow). --out writes email,user_id,api_key
+for the created accounts — the raw keys are not shown anywhere else.
+"""
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import onboarding
+
+
+class Command(BaseCommand):
+    help = "Bulk-create users and trial API keys from a CSV of emails (and optional passwords)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_path")
+        parser.add_argument("--quota", type=int, default=onboarding.DEFAULT_TRIAL_QUOTA)
+        parser.add_argument("--batch-size", type=int, default=onboarding.BATCH_SIZE)
+        parser.add_argument("--out", help="write email,user_id,api_key of created accounts here")
+
+    def handle(self, *args, csv_path, quota, batch_size, out, **opts):
+        if quota < 1:
+            raise CommandError("--quota must be a positive integer")
+        with open(csv_path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            if "email" not in (reader.fieldnames or []):
+                raise CommandError("CSV needs an 'email' column")
+            rows = list(reader)
+
+        t0 = time.perf_counter()
+        result = onboarding.onboard(rows, quota=quota, batch_size=batch_size)
+        elapsed = time.perf_counter() - t0
+
+        if out:
+            with open(out, "w", newline="", encoding="utf-8") as f:
+                w = csv.writer(f)
+                w.writerow(("email", "user_id", "api_key"))
+                w.writerows(result.created)
+        for email, reason in result.skipped[:20]:
+            self.stderr.write(f"skipped {email or '<blank>'}: {reason}")
+        if len(result.skipped) > 20:
+            self.stderr.write(f"... and {len(result.skipped) - 20} more skipped")
+        self.stdout.write(f"created {len(result.created)} account(s), skipped {len(result.skipped)} "
+                          f"in {elapsed:.2f}s ({len(result.created) / max(elapsed, 1e-9):,.0f}/s)")
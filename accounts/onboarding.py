@@ -0,0 +1,149 @@
+# accounts/onboarding.py
+"""
+Bulk account onboarding (agency sub-accounts): users + trial keys in batched inserts.
+
+Creating users one by one fires accounts.signals.create_trial_key per row (an exists()
+query plus an on_commit insert each). Here every BATCH_SIZE accounts are one transaction:
+
+    1. drop rows whose email is malformed, repeated or already registered (case-insensitive,
+       like RegisterSerializer) and rows whose password is not a string or fails
+       validate_password;
+    2. hash passwords on a thread pool (PBKDF2 releases the GIL) — rows without a password
+       get an unusable one and set it through the password-reset flow;
+    3. User.objects.bulk_create — no post_save, so the per-row signal never runs and each
+       user gets exactly the one trial key created in step 4;
+    4. ApiKey.objects.bulk_create with the owner set (ApiKey.save isn't called either);
+    5. after commit, keystate.created_many warms the auth cache for the new keys.
+
+`onboard(rows)` returns an OnboardResult with the raw keys of the created accounts
+(shown once, like issue_trial_key_for_user). Batches commit independently: a batch that
+fails is rolled back and its rows are reported in `skipped`, the others still succeed, and
+registered emails are skipped, so re-running an import is safe.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from billing import keystate
+from billing.models import ApiKey
+from billing.utils import _sha256_hex, make_api_key
+from .serializers import user_has_username_field
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+BATCH_SIZE = 500
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+DEFAULT_TRIAL_QUOTA = getattr(settings, "FREE_TRIAL_QUOTA", 5)   # same default as accounts.signals
+
+
+class OnboardResult(NamedTuple):
+    created: list    # [(email, user_id, raw_key)]
+    skipped: list    # [(email, reason)]
+
+
+def _normalize(rows, result):
+    """Valid, unique, lower-cased (email, password) pairs in input order."""
+    seen, out = set(), []
+    for row in rows:
+        email = str(row.get("email") or "").strip().lower()
+        try:
+            validate_email(email)
+        except ValidationError:
+            result.skipped.append((email, "invalid email"))
+            continue
+        if email in seen:
+            result.skipped.append((email, "duplicate in input"))
+            continue
+        password = row.get("password") or None
+        if password is not None:
+            if not isinstance(password, str):
+                result.skipped.append((email, "password must be a string"))
+                continue
+            try:
+                validate_password(password)
+            except ValidationError as e:
+                result.skipped.append((email, "weak password: " + " ".join(e.messages)))
+                continue
+        seen.add(email)
+        out.append((email, password))
+    return out
+
+
+def _hash_all(passwords, pool):
+    todo = [(i, p) for i, p in enumerate(passwords) if p]
+    hashed = [make_password(None)] * len(passwords)   # unusable ("!...") unless a password was given
+    for (i, _), h in zip(todo, pool.map(make_password, [p for _, p in todo])):
+        hashed[i] = h
+    return hashed
+
+
+def _onboard_batch(batch, quota, pool, result):
+    emails = [e for e, _ in batch]
+    # emails are already lower-cased; compare against lower(existing) like email__iexact does
+    taken = set(User.objects.annotate(e=Lower("email")).filter(e__in=emails).values_list("e", flat=True))
+    if user_has_username_field():
+        taken |= set(User.objects.annotate(u=Lower("username")).filter(u__in=emails).values_list("u", flat=True))
+    batch = [(e, p) for e, p in batch if e not in taken]
+    result.skipped.extend((e, "already registered") for e in emails if e in taken)
+    if not batch:
+        return []
+
+    hashed = _hash_all([p for _, p in batch], pool)
+    users = []
+    for (email, _), pw in zip(batch, hashed):
+        u = User(email=email, password=pw)
+        if user_has_username_field():
+            u.username = email
+        users.append(u)
+
+    with transaction.atomic():
+        User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+        ids = dict(User.objects.filter(email__in=[e for e, _ in batch]).values_list("email", "pk"))
+        raw, keys = {}, []
+        for email, _ in batch:
+            uid = ids[email]
+            plain, prefix, suffix = make_api_key()
+            raw[email] = plain
+            keys.append(ApiKey(
+                user_id=uid, owner_id=uid, key_prefix=prefix, plain_suffix=suffix,
+                key_hash=_sha256_hex(plain), tenant_id=str(uid), plan="trial", status="active",
+                trial_quota=int(quota), used_requests=0,
+            ))
+        ApiKey.objects.bulk_create(keys, batch_size=BATCH_SIZE)
+    result.created.extend((email, ids[email], raw[email]) for email, _ in batch)
+
+    # re-read so the cache records carry primary keys on every backend
+    rows = list(ApiKey.objects.filter(key_hash__in=[k.key_hash for k in keys]))
+    keystate.created_many(rows)
+    return rows
+
+
+def onboard(rows, *, quota: int = DEFAULT_TRIAL_QUOTA, batch_size: int = BATCH_SIZE) -> OnboardResult:
+    """Create accounts + trial keys for rows of {"email", "password"?} (see module docstring)."""
+    if int(quota) < 1:
+        raise ValueError("quota must be a positive integer")
+    result = OnboardResult([], [])
+    todo = _normalize(rows, result)
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        for i in range(0, len(todo), batch_size):
+            batch = todo[i:i + batch_size]
+            try:
+                _onboard_batch(batch, quota, pool, result)
+            except Exception as e:
+                logger.exception("onboarding: batch of %d failed; rolled back", len(batch))
+                done = {c[0] for c in result.created} | {s[0] for s in result.skipped}
+                result.skipped.extend((email, f"batch failed: {type(e).__name__}")
+                                      for email, _ in batch if email not in done)
+    logger.info("onboarding: created=%d skipped=%d quota=%d", len(result.created), len(result.skipped), quota)
+    return result
@@ -6,6 +6,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 
+from billing import keystate
 from billing.models import ApiKey
 from billing.utils import issue_trial_key_for_user
 
@@ -45,3 +46,25 @@ def create_trial_key(sender, instance: User, created: bool, **kwargs):
 
     # Ensure we run only after the user insert is committed
     transaction.on_commit(_issue)
+
+
+@receiver(post_save, sender=User)
+def adopt_customer_keys(sender, instance: User, created: bool, update_fields=None, **kwargs):
+    """
+    Keys issued for a Stripe customer before it was linked to this user (owner=NULL) become
+    the user's once stripe_customer_id is saved, so the dashboard and usage export see them.
+    """
+    if not getattr(instance, "stripe_customer_id", None):
+        return
+    if update_fields is not None and "stripe_customer_id" not in update_fields:
+        return   # e.g. last_login updates
+
+    def _adopt():
+        try:
+            n = keystate.adopt(instance)
+            if n:
+                logger.info("Adopted %d unowned key(s) for user %s", n, instance.id)
+        except Exception:
+            logger.exception("Failed to adopt keys for user %s", instance.id)
+
+    transaction.on_commit(_adopt)
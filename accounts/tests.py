@@ -1,3 +1,34 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from . import views
+
+User = get_user_model()
+
+
+class BulkOnboardTests(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_superuser("admin", "admin@example.com", "x"))
+
+    def post(self, payload):
+        return self.api.post("/users/bulk", payload, format="json")
+
+    def test_quota_out_of_range_is_rejected(self):
+        for quota in (0, -1, "abc", True, 2 ** 31):
+            resp = self.post({"accounts": [{"email": "a@example.com"}], "quota": quota})
+            self.assertEqual(resp.status_code, 400, quota)
+        self.assertFalse(User.objects.filter(email="a@example.com").exists())
+
+    def test_creates_accounts_with_quota(self):
+        resp = self.post({"accounts": [{"email": "A@example.com"}, {"email": "b@example.com"}], "quota": 3})
+        self.assertEqual(resp.status_code, 201)
+        created = resp.json()["created"]
+        self.assertEqual([c["email"] for c in created], ["a@example.com", "b@example.com"])
+        user = User.objects.get(email="a@example.com")
+        self.assertEqual(list(user.api_keys.values_list("trial_quota", flat=True)), [3])
+
+    def test_password_rows_are_capped(self):
+        rows = [{"email": f"u{i}@example.com", "password": "x"} for i in range(views.BULK_ONBOARD_MAX_PASSWORDS + 1)]
+        self.assertEqual(self.post({"accounts": rows}).status_code, 400)
@@ -6,19 +6,29 @@ from django.views.generic import CreateView
 from django.contrib.auth.views import LoginView
 
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from billing.models import ApiKey
+from billing import dashboard as dash
 from .serializers import RegisterSerializer
+from . import onboarding
 from .forms import SignUpForm, NiceLoginForm, ProfileForm, DashboardPasswordChangeForm
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.conf import settings
+import time
 
 User = get_user_model()
 
+_JWT_SESSION_KEY = "dashboard_jwt"
+_JWT_MIN_TTL = getattr(settings, "DASHBOARD_JWT_MIN_TTL", 60)
+BULK_ONBOARD_MAX = 10_000
+# passwords are hashed in the request (~0.5s each); bigger imports with passwords go through
+# `manage.py onboard_accounts`, or omit passwords and let users set them via password reset
+BULK_ONBOARD_MAX_PASSWORDS = getattr(settings, "BULK_ONBOARD_MAX_PASSWORDS", 10)
+QUOTA_MAX = 2_147_483_647   # ApiKey.trial_quota is a PositiveIntegerField
+
 # ---------------------------
 # Public pages
 # ---------------------------
@@ -52,6 +62,41 @@ def register(request):
     s.save()
     return Response({"ok": True})
 
+@api_view(["POST"])
+@permission_classes([IsAdminUser])
+def bulk_onboard(request):
+    """
+    Staff only. POST {"accounts": [{"email": ..., "password": ...?}, ...], "quota": 10?}
+    Creates users + trial keys in batches (accounts.onboarding); raw keys are returned once.
+    At most BULK_ONBOARD_MAX_PASSWORDS rows may carry a password.
+    """
+    rows = (request.data or {}).get("accounts")
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        return Response({"ok": False, "error": "accounts must be a list of objects"}, status=400)
+    if len(rows) > BULK_ONBOARD_MAX:
+        return Response({"ok": False, "error": f"at most {BULK_ONBOARD_MAX} accounts per request"}, status=400)
+    if sum(1 for r in rows if r.get("password")) > BULK_ONBOARD_MAX_PASSWORDS:
+        return Response({"ok": False, "error": f"at most {BULK_ONBOARD_MAX_PASSWORDS} accounts with a password "
+                                               "per request; use manage.py onboard_accounts"}, status=400)
+    quota = (request.data or {}).get("quota")
+    if quota is None:
+        quota = onboarding.DEFAULT_TRIAL_QUOTA
+    elif isinstance(quota, bool) or not isinstance(quota, (int, str)):
+        return Response({"ok": False, "error": "quota must be an integer"}, status=400)
+    try:
+        quota = int(quota)
+    except ValueError:
+        return Response({"ok": False, "error": "quota must be an integer"}, status=400)
+    if not 1 <= quota <= QUOTA_MAX:
+        return Response({"ok": False, "error": "quota must be a positive integer"}, status=400)
+
+    result = onboarding.onboard(rows, quota=quota)
+    return Response({
+        "ok": True,
+        "created": [{"email": e, "user_id": uid, "api_key": key} for e, uid, key in result.created],
+        "skipped": [{"email": e, "reason": why} for e, why in result.skipped],
+    }, status=201 if result.created else 200)
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def me(request):
@@ -62,6 +107,19 @@ def me(request):
         "stripe_customer_id": getattr(u, "stripe_customer_id", None)
     })
 
+def _dashboard_access_token(request):
+    """
+    Access token for the dashboard's JS, kept in the session and only re-minted when it
+    has less than DASHBOARD_JWT_MIN_TTL seconds left (or belongs to another user).
+    """
+    cached = request.session.get(_JWT_SESSION_KEY)
+    now = int(time.time())
+    if cached and cached.get("uid") == request.user.pk and cached.get("exp", 0) - now > _JWT_MIN_TTL:
+        return cached["token"]
+    token = RefreshToken.for_user(request.user).access_token
+    request.session[_JWT_SESSION_KEY] = {"uid": request.user.pk, "token": str(token), "exp": int(token["exp"])}
+    return str(token)
+
 @login_required
 def dashboard(request):
     user = request.user
@@ -87,46 +145,16 @@ def dashboard(request):
                 messages.success(request, "Password changed.")
                 return redirect("dashboard")
 
-    # ----- Short-lived JWT for your JS calls -----
-    access = str(RefreshToken.for_user(user).access_token)
-
-    # ----- API key lookup (matches your billing view logic) -----
-    uid_str = str(user.id)
-    cust_id = getattr(user, "stripe_customer_id", None)
-
-    q = Q(user=user) | Q(tenant_id=uid_str)
-    if cust_id:
-        q |= Q(customer_id=cust_id) | Q(tenant_id=cust_id)
-
-    key_row = (
-        ApiKey.objects
-        .filter(q, status="active", revoked_at__isnull=True)
-        .order_by("-created_at")
-        .first()
-    )
-
-    # Full key only if you actually store a plain suffix
-    full_key = None
-    latest_key_prefix = None
-    if key_row:
-        latest_key_prefix = key_row.key_prefix
-        suffix = getattr(key_row, "plain_suffix", None)
-        if suffix:                           # only build if suffix exists
-            full_key = f"{key_row.key_prefix or ''}{suffix}"
-
-    # ----- Trial usage & plan status -----
-    trial_used = None
-    trial_quota = None
-    is_trial = False
-    is_subscribed = False
-    if key_row:
-        if key_row.plan == "trial":
-            is_trial = True
-            # used_requests increments with each API call
-            trial_used = key_row.used_requests or 0
-            trial_quota = key_row.trial_quota or 0
-        else:
-            is_subscribed = True
+    # ----- Short-lived JWT for your JS calls (reused until near expiry) -----
+    access = _dashboard_access_token(request)
+
+    # ----- API key + trial/plan KPIs (cached per user, see billing.dashboard) -----
+    kpis = dash.kpis(user)
+    full_key = dash.full_key(kpis)   # Full key only if you actually store a plain suffix
+    key_row = kpis["key"]
+    latest_key_prefix = key_row["key_prefix"] if key_row else None
+    is_trial, is_subscribed = kpis["is_trial"], kpis["is_subscribed"]
+    trial_used, trial_quota = kpis["trial_used"], kpis["trial_quota"]
 
     # ----- Context for your template -----
     return render(request, "dashboard.html", {
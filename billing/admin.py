@@ -1,7 +1,8 @@
 # billing/admin.py
 from django.contrib import admin, messages
 from django.utils import timezone
-from .models import ApiKey
+from .models import ApiKey, HourlyKeyUsage, WebhookEvent
+from . import export, keystate
 
 @admin.register(ApiKey)
 class ApiKeyAdmin(admin.ModelAdmin):
@@ -43,12 +44,17 @@ class ApiKeyAdmin(admin.ModelAdmin):
         }),
     )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)   # ApiKey.save bumps token_version on a plan change
+        keystate.publish([obj.pk])  # plan/status/quota edits take effect on the next request
+
     # BULK ACTIONS
     actions = ["set_trial_10", "flip_to_pro", "revoke_keys", "reset_trial_usage"]
 
     @admin.action(description="Set selected keys to TRIAL (10 requests) and activate")
     def set_trial_10(self, request, queryset):
-        updated = queryset.update(
+        updated = keystate.apply(
+            queryset,
             plan="trial",
             status="active",
             revoked_at=None,
@@ -58,7 +64,8 @@ class ApiKeyAdmin(admin.ModelAdmin):
 
     @admin.action(description="Flip selected keys to PRO (paid) and activate")
     def flip_to_pro(self, request, queryset):
-        updated = queryset.update(
+        updated = keystate.apply(
+            queryset,
             plan="pro",
             status="active",
             revoked_at=None,
@@ -69,11 +76,53 @@ class ApiKeyAdmin(admin.ModelAdmin):
     @admin.action(description="Revoke selected keys")
     def revoke_keys(self, request, queryset):
         now = timezone.now()
-        updated = queryset.exclude(status="revoked").update(status="revoked", revoked_at=now)
+        updated = keystate.apply(queryset.exclude(status="revoked"), status="revoked", revoked_at=now)
         messages.warning(request, f"{updated} key(s) revoked.")
 
     @admin.action(description="Reset trial usage (used_requests=0) for selected keys")
     def reset_trial_usage(self, request, queryset):
         qs = queryset.filter(plan="trial")
-        updated = qs.update(used_requests=0, last_used_at=None)
+        updated = keystate.reset_usage(qs)   # live quota counters too, not just the DB copy
         messages.success(request, f"Reset usage for {updated} trial key(s).")
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    """Stripe webhook inbox (billing.webhooks). Failed = dead-lettered after max attempts."""
+    list_display = ("id", "event_id", "kind", "customer_id", "status", "attempts", "received_at", "processed_at")
+    list_filter = ("status", "kind")
+    search_fields = ("event_id", "customer_id")
+    ordering = ("-received_at",)
+    readonly_fields = [f.name for f in WebhookEvent._meta.fields]
+    actions = ["retry_events"]
+
+    @admin.action(description="Retry selected events now")
+    def retry_events(self, request, queryset):
+        updated = queryset.exclude(status="done").update(
+            status="pending", attempts=0, locked_at=None, next_attempt_at=timezone.now(),
+        )
+        messages.success(request, f"{updated} event(s) queued for retry.")
+
+
+@admin.register(HourlyKeyUsage)
+class HourlyKeyUsageAdmin(admin.ModelAdmin):
+    """Hourly per-key/endpoint request totals (billing.requestlog rollups). Read-only."""
+    list_display = ("hour", "key_id", "tenant_id", "endpoint", "requests", "client_errors", "errors",
+                    "avg_latency_ms", "latency_ms_max", "llm_calls", "prompt_tokens", "completion_tokens")
+    list_filter = ("endpoint",)
+    search_fields = ("tenant_id", "=key_id")
+    ordering = ("-hour", "-requests")
+    date_hierarchy = "hour"
+    actions = ["export_csv", "export_ndjson"]
+
+    def has_add_permission(self, request): return False
+    def has_change_permission(self, request, obj=None): return False
+
+    # "Select all N" + action streams the whole filtered changelist
+    @admin.action(description="Export selected as CSV")
+    def export_csv(self, request, queryset):
+        return export.response(request, queryset, "csv", filename=f"usage-{timezone.now():%Y%m%d}")
+
+    @admin.action(description="Export selected as NDJSON")
+    def export_ndjson(self, request, queryset):
+        return export.response(request, queryset, "ndjson", filename=f"usage-{timezone.now():%Y%m%d}")
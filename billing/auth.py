@@ -1,44 +1,12 @@
 from rest_framework.authentication import BaseAuthentication
-from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.exceptions import AuthenticationFailed, Throttled
 from django.conf import settings
-from django.core.cache import cache
-from django.utils import timezone
 
-from .utils import verify_token_in_db
-from .models import ApiKey
+from . import authguard, quota, signed, usage
+from .utils import _sha256_hex
 
-STATE_TTL   = 600
-FLUSH_EVERY = 10
 PAID_PLANS  = {"pro", "business", "enterprise"}  # <-- add more plan names here as needed
 
-def _state_key(key_hash: str) -> str:
-    return f"auth:state:{key_hash}"
-
-def _count_key(key_hash: str) -> str:
-    return f"auth:count:{key_hash}"
-
-def _load_state_from_row(row: ApiKey) -> dict:
-    if not row or not row.is_active:
-        return {"status": "none", "trial_quota": 0}
-    if row.plan == "trial":
-        return {"status": "trial", "trial_quota": int(row.trial_quota or 0)}
-    return {"status": "subscribed", "trial_quota": None}
-
-def _get_state(row: ApiKey) -> dict:
-    if not getattr(row, "key_hash", None):
-        return _load_state_from_row(row)
-    sk = _state_key(row.key_hash)
-    state = cache.get(sk)
-    if state:
-        return state
-    state = _load_state_from_row(row)
-    cache.set(sk, state, STATE_TTL)
-    return state
-
-def _invalidate_state(row: ApiKey):
-    if getattr(row, "key_hash", None):
-        cache.delete(_state_key(row.key_hash))
-
 class ApiKeyAuthentication(BaseAuthentication):
     def authenticate(self, request):
         if not request.path.startswith("/v1/"):
@@ -50,74 +18,45 @@ class ApiKeyAuthentication(BaseAuthentication):
 
         token = auth.split(" ", 1)[1].strip()
 
-        row = verify_token_in_db(token)
-
         test_key = getattr(settings, "TEST_KEY", None)
-        if not row and token == test_key:
+        if test_key and token == test_key:
             return (None, {"tenant_id": "dev", "plan": "demo"})
 
-        if not row:
+        # Stateless signed token (paid keys): HMAC + in-memory revocation map, no I/O
+        if signed.is_signed(token):
+            claims = signed.verify(token)
+            if claims is None:
+                raise AuthenticationFailed("Invalid or revoked API token")
+            usage.record(claims["key_id"])
+            return (None, claims)
+
+        key_hash = _sha256_hex(token)
+        # L1/L2 key cache, then negative cache + lockouts; the DB is only hit for unknown tokens
+        try:
+            rec = authguard.lookup(token, authguard.client_ip(request))
+        except authguard.LockedOut as e:
+            raise Throttled(wait=e.retry_after, detail="Too many invalid API keys; try again later.")
+
+        if not rec:
             raise AuthenticationFailed("Invalid API key")
 
-        if not row.is_active:
+        if rec["status"] != "active":
             raise AuthenticationFailed("Key revoked")
 
         # Paid? allow immediately.
-        if row.plan and (row.plan in PAID_PLANS or row.plan != "trial"):
-            return (None, {"tenant_id": row.tenant_id, "plan": row.plan})
+        if rec["plan"] and (rec["plan"] in PAID_PLANS or rec["plan"] != "trial"):
+            usage.record(rec["id"])   # write-behind; no DB write on the request path
+            return (None, {"tenant_id": rec["tenant_id"], "plan": rec["plan"], "key_id": rec["id"]})
 
         # Trial: enforce quota
-        state = _get_state(row)
-
-        # Optional: hygiene if cache stale while DB says paid
-        if row.plan != "trial" and state.get("status") != "subscribed":
-            _invalidate_state(row)
-            return (None, {"tenant_id": row.tenant_id, "plan": row.plan})
-
-        if state["status"] != "trial":
-            raise AuthenticationFailed("Access denied")
-
-        quota = int(state["trial_quota"] or 0)
-        if quota <= 0:
-            raise AuthenticationFailed("Trial quota exhausted")
-
-        # Fast path via cache/Redis
-        used_now = None
-        try:
-            ck = _count_key(row.key_hash)
-            used_now = cache.incr(ck)
-            cache.touch(ck, 30 * 24 * 3600)
-        except Exception:
-            used_now = None
-
-        if used_now is not None:
-            if used_now <= quota:
-                if used_now % FLUSH_EVERY == 0:
-                    ApiKey.objects.filter(pk=row.pk, status="active").update(
-                        used_requests=used_now, last_used_at=timezone.now()
-                    )
-                return (None, {"tenant_id": row.tenant_id, "plan": "trial", "used": used_now, "quota": quota})
-
-            ApiKey.objects.filter(pk=row.pk).update(
-                status="revoked", revoked_at=timezone.now(), used_requests=used_now
-            )
-            _invalidate_state(row)
+        if int(rec["quota"] or 0) <= 0:
             raise AuthenticationFailed("Trial quota exhausted")
 
-        # DB fallback with row lock
-        updated = ApiKey.objects.select_for_update().filter(pk=row.pk, status="active").first()
-        if not updated or updated.plan != "trial":
-            raise AuthenticationFailed("Access denied")
-
-        if updated.used_requests >= quota:
-            updated.status = "revoked"
-            updated.revoked_at = timezone.now()
-            updated.save(update_fields=["status", "revoked_at"])
-            _invalidate_state(updated)
+        # Atomic check-and-increment (Redis Lua / DB conditional UPDATE, see billing.quota)
+        res = quota.consume_trial(rec, key_hash)
+        if not res.allowed:
             raise AuthenticationFailed("Trial quota exhausted")
-
-        updated.used_requests += 1
-        updated.last_used_at = timezone.now()
-        updated.save(update_fields=["used_requests", "last_used_at"])
-
-        return (None, {"tenant_id": updated.tenant_id, "plan": "trial", "used": updated.used_requests, "quota": quota})
+        # DRF throttles run after authentication: ApiKeyRateThrottle refunds this if it rejects
+        request._request.trial_charge = (rec["id"], key_hash)
+        return (None, {"tenant_id": rec["tenant_id"], "plan": "trial", "key_id": rec["id"],
+                       "used": res.used, "quota": res.limit})
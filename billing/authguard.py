@@ -0,0 +1,119 @@
+# billing/authguard.py
+"""
+Shed invalid-key traffic before it reaches the database.
+
+- Negative cache: sha256 of a token the DB just rejected is remembered for NEG_TTL, so
+  a plugin retrying a dead key (or a scanner replaying one) costs one cache read.
+- Failure counters per client IP and per 16-char key prefix. Past the threshold each
+  further failure doubles a lockout (LOCK_BASE .. LOCK_MAX seconds); locked traffic is
+  refused with Retry-After.
+
+An IP lock is checked before the DB. A prefix lock is only checked after the token has
+missed (DB or negative cache): the prefix is public (/billing/verify/ echoes it), so it
+must never refuse the valid key that carries it, cached or not. It turns further
+suffix guesses into 429s instead of 401s.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import metrics
+from . import keycache
+from .utils import PREFIX_LEN, _sha256_hex, get_active_key_by_hash
+
+logger = logging.getLogger(__name__)
+
+NEG_TTL          = getattr(settings, "AUTH_NEGATIVE_TTL", 300)
+FAIL_WINDOW      = getattr(settings, "AUTH_FAIL_WINDOW", 600)
+IP_THRESHOLD     = getattr(settings, "AUTH_FAIL_IP_THRESHOLD", 20)
+PREFIX_THRESHOLD = getattr(settings, "AUTH_FAIL_PREFIX_THRESHOLD", 5)
+LOCK_BASE        = getattr(settings, "AUTH_LOCK_BASE_SECONDS", 30)
+LOCK_MAX         = getattr(settings, "AUTH_LOCK_MAX_SECONDS", 3600)
+
+
+class LockedOut(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"locked out for {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _fail_key(scope, ident): return f"auth:fail:{scope}:{ident}"
+def _lock_key(scope, ident): return f"auth:lock:{scope}:{ident}"
+
+
+def client_ip(request) -> str:
+    # rightmost X-Forwarded-For hop is the one our proxy appended (clients can't forge it)
+    xff = request.META.get("HTTP_X_FORWARDED_FOR", "")
+    if xff:
+        return xff.split(",")[-1].strip()
+    return request.META.get("REMOTE_ADDR", "") or "unknown"
+
+
+def _scopes(ip, token):
+    return (("ip", ip, IP_THRESHOLD), ("prefix", _sha256_hex(token[:PREFIX_LEN])[:16], PREFIX_THRESHOLD))
+
+
+def _check_locks(ip, token, only=None):
+    now = time.time()
+    try:
+        locks = cache.get_many([_lock_key(s, i) for s, i, _ in _scopes(ip, token) if only in (None, s)])
+    except Exception:
+        return
+    if locks:
+        until = max(locks.values())
+        if until > now:
+            metrics.incr("auth.locked")
+            raise LockedOut(max(1, int(until - now + 0.999)))
+
+
+def _record_failure(ip, token, key_hash):
+    metrics.incr("auth.failed")
+    try:
+        cache.set(keycache.neg_key(key_hash), 1, NEG_TTL)
+        for scope, ident, threshold in _scopes(ip, token):
+            fk = _fail_key(scope, ident)
+            cache.add(fk, 0, FAIL_WINDOW)
+            fails = cache.incr(fk)
+            if fails < threshold:
+                continue
+            lock_s = min(LOCK_MAX, LOCK_BASE * 2 ** (fails - threshold))
+            cache.set(_lock_key(scope, ident), time.time() + lock_s, lock_s)
+            cache.touch(fk, max(FAIL_WINDOW, LOCK_MAX))   # keep escalating while attempts continue
+            if fails == threshold:
+                logger.warning("authguard: locking %s=%s for %ss after %d failures", scope, ident, lock_s, fails)
+    except Exception:
+        logger.debug("authguard: could not record failure", exc_info=True)
+
+
+def lookup(token: str, ip: str):
+    """
+    Key record for a raw token (see billing.keycache), or None if invalid.
+    Raises LockedOut when the IP is locked (before the DB) or when an invalid token's
+    prefix is locked; known-bad tokens never reach the DB.
+    """
+    token = (token or "").strip()
+    if len(token) < PREFIX_LEN:
+        _check_locks(ip, token)
+        _record_failure(ip, token, _sha256_hex(token))
+        return None
+    key_hash = _sha256_hex(token)
+
+    def _load(h):
+        _check_locks(ip, token, only="ip")
+        try:
+            known_bad = cache.get(keycache.neg_key(h))
+        except Exception:
+            known_bad = None
+        if known_bad:
+            metrics.incr("auth.negative_hit")
+        else:
+            row = get_active_key_by_hash(h)
+            if row is not None:
+                return row
+        _record_failure(ip, token, h)
+        _check_locks(ip, token)
+        return None
+
+    return keycache.get(key_hash, _load)
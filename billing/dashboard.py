@@ -0,0 +1,87 @@
+# billing/dashboard.py
+"""
+Data behind accounts.views.dashboard: the user's current key and plan/usage KPIs.
+
+`kpis(user)` is one range read on apikey_owner_idx (ApiKey.owner, kept by ApiKey.save)
+instead of an OR across user / tenant_id / customer_id, and its result is cached per
+user (dash:kpi:<user_id>) for KPI_TTL seconds. The entry is deleted whenever one of the
+user's keys changes (billing.keystate.publish / created) or its usage is flushed
+(billing.usage), so the TTL only bounds staleness for counters written elsewhere
+(e.g. the DB quota backend). The plaintext key suffix is never put in the cache:
+`full_key(kpis)` reads it by primary key when the page needs it.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ApiKey
+
+logger = logging.getLogger(__name__)
+
+KPI_TTL = getattr(settings, "DASHBOARD_KPI_TTL", 120)
+
+
+def _key(user_id): return f"dash:kpi:{user_id}"
+
+
+def _load(user) -> dict:
+    row = (
+        ApiKey.objects
+        .filter(owner=user, status="active", revoked_at__isnull=True)
+        .order_by("-created_at")
+        .only("pk", "plan", "key_prefix", "created_at", "trial_quota", "used_requests", "plain_suffix")
+        .first()
+    )
+    if row is None:
+        return {"key": None, "is_trial": False, "is_subscribed": False, "trial_used": None, "trial_quota": None}
+    is_trial = row.plan == "trial"
+    return {
+        "key": {"id": row.pk, "plan": row.plan, "key_prefix": row.key_prefix, "created_at": row.created_at,
+                "has_suffix": bool(row.plain_suffix)},
+        "is_trial": is_trial,
+        "is_subscribed": not is_trial,
+        "trial_used": (row.used_requests or 0) if is_trial else None,
+        "trial_quota": (row.trial_quota or 0) if is_trial else None,
+    }
+
+
+def kpis(user) -> dict:
+    """Cached KPI block for the dashboard (see module docstring for invalidation)."""
+    try:
+        data = cache.get(_key(user.pk))
+    except Exception:
+        data = None
+    if data is None:
+        data = _load(user)
+        try:
+            cache.set(_key(user.pk), data, KPI_TTL)
+        except Exception:
+            logger.debug("dashboard: KPI cache set failed user_id=%s", user.pk, exc_info=True)
+    return data
+
+
+def full_key(data: dict):
+    """prefix + plaintext suffix of the dashboard key, when one is stored (one PK read)."""
+    key = data.get("key")
+    if not key or not key["has_suffix"]:
+        return None
+    suffix = ApiKey.objects.filter(pk=key["id"]).values_list("plain_suffix", flat=True).first()
+    return f"{key['key_prefix'] or ''}{suffix}" if suffix else None
+
+
+def invalidate_users(user_ids) -> None:
+    keys = [_key(uid) for uid in set(user_ids) if uid]
+    if not keys:
+        return
+    try:
+        cache.delete_many(keys)
+    except Exception:
+        logger.warning("dashboard: KPI invalidation failed for %d user(s)", len(keys), exc_info=True)
+
+
+def invalidate_keys(key_ids) -> None:
+    """Drop the KPI blocks of whoever owns these ApiKey ids."""
+    key_ids = list(key_ids)
+    if key_ids:
+        invalidate_users(ApiKey.objects.filter(pk__in=key_ids).values_list("owner_id", flat=True))
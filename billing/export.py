@@ -0,0 +1,109 @@
+# billing/export.py
+"""
+Streaming usage export (HourlyKeyUsage rows, see billing.requestlog) as CSV or NDJSON.
+
+Rows are read with .values_list().iterator(chunk_size=CHUNK_SIZE) — a cursor fetched in
+chunks, no result cache — and encoded one line at a time by generators fed straight into
+a StreamingHttpResponse, so a worker holds one chunk in memory however long the export is.
+Under ASGI the body must be an async iterator (Django would otherwise list() a sync one),
+so there the generator is advanced CHUNK_SIZE lines per sync_to_async hop.
+
+Used by the dashboard download (billing.views.usage_export: the user's own keys; staff
+may pass tenant / key) and the HourlyKeyUsage admin export actions.
+"""
+import csv
+import json
+from datetime import datetime, time as dt_time
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ApiKey
+
+CHUNK_SIZE = 2000
+FIELDS = ("hour", "key_id", "tenant_id", "endpoint", "requests", "client_errors", "errors",
+          "latency_ms_sum", "latency_ms_max", "llm_calls", "prompt_tokens", "cached_tokens",
+          "completion_tokens")
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class _Echo:
+    """File-like object for csv.writer that hands the encoded line back instead of buffering it."""
+    def write(self, value):
+        return value
+
+
+def _rows(qs):
+    return qs.order_by("hour", "key_id", "endpoint").values_list(*FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def iter_csv(qs):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for row in _rows(qs):
+        yield writer.writerow((row[0].isoformat(), *row[1:]))
+
+
+def iter_ndjson(qs):
+    for row in _rows(qs):
+        rec = dict(zip(FIELDS, row))
+        rec["hour"] = rec["hour"].isoformat()
+        yield json.dumps(rec, separators=(",", ":")) + "\n"
+
+
+def _next_block(lines):
+    return "".join(islice(lines, CHUNK_SIZE))
+
+
+async def _aiter(lines):
+    # thread_sensitive (default): every hop runs on the thread that owns the DB cursor
+    while block := await sync_to_async(_next_block)(lines):
+        yield block
+
+
+def response(request, qs, fmt="csv", filename="usage"):
+    """StreamingHttpResponse for qs (HourlyKeyUsage) in `fmt` ("csv" or "ndjson")."""
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    body = iter_csv(qs) if fmt == "csv" else iter_ndjson(qs)
+    if isinstance(request, ASGIRequest):
+        body = _aiter(body)
+    resp = StreamingHttpResponse(body, content_type=FORMATS[fmt])
+    resp["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    resp["Cache-Control"] = "no-store"
+    return resp
+
+
+def owned_key_ids(user):
+    """Ids of every key (incl. revoked) owned by this user (ApiKey.owner)."""
+    return list(ApiKey.objects.filter(owner=user).values_list("pk", flat=True))
+
+
+def _bound(raw, end=False):
+    """ISO date or datetime -> aware datetime (a bare date means the whole day)."""
+    if not raw:
+        return None
+    value = parse_datetime(raw)
+    if value is None:
+        day = parse_date(raw)
+        if day is None:
+            raise ValueError(f"bad date: {raw!r}")
+        value = datetime.combine(day, dt_time.max if end else dt_time.min)
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def filtered(qs, since=None, until=None):
+    """Restrict to hours in [since, until] (ISO strings); raises ValueError on bad input."""
+    since, until = _bound(since), _bound(until, end=True)
+    if since:
+        qs = qs.filter(hour__gte=since)
+    if until:
+        qs = qs.filter(hour__lte=until)
+    return qs
@@ -0,0 +1,52 @@
+# billing/keycache.py
+"""
+Cache of authenticated API keys: sha256(token) -> minimal key record.
+
+    L1  per-process LRU      } core.cache.TieredCache("auth:key")
+    L2  shared Django cache  }
+    DB  billing.utils.get_active_key_by_hash
+
+Key mutations go through billing.keystate, which writes new records through and bumps
+the namespace version: this process sees the change at once, every other worker's L1
+within VERSION_CHECK seconds. Hot keys need zero DB queries. Only valid keys are cached.
+
+A record holds only columns that change through keystate (plan, status, quota), never
+used_requests — the usage flusher and the DB quota backend move that behind the cache, and
+billing.quota reads it itself when a counter has to be seeded — so the TTLs can be hours.
+"""
+import logging
+
+from core.cache import TieredCache
+
+logger = logging.getLogger(__name__)
+
+L1_SIZE = 10_000
+L1_TTL  = 600
+L2_TTL  = 6 * 3600   # safe to keep long: every column cached here is written through (billing.keystate)
+VERSION_CHECK = 1.0
+
+tier = TieredCache("auth:key", l1_ttl=L1_TTL, l1_size=L1_SIZE, l2_ttl=L2_TTL, version_check=VERSION_CHECK)
+
+
+def neg_key(key_hash): return f"auth:neg:{key_hash}"   # billing.authguard's negative cache
+
+
+def record_for_row(row) -> dict:
+    return {
+        "id": row.pk,
+        "plan": row.plan,
+        "status": row.status,
+        "tenant_id": row.tenant_id,
+        "quota": int(row.trial_quota or 0) if row.plan == "trial" else None,
+    }
+
+
+def get(key_hash: str, loader):
+    """
+    Record for an active key, or None. `loader(key_hash)` returns the ApiKey row (or None)
+    and is only called on an L1+L2 miss.
+    """
+    def _load(h):
+        row = loader(h)
+        return record_for_row(row) if row is not None else None
+    return tier.get(key_hash, _load)
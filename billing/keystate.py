@@ -0,0 +1,117 @@
+# billing/keystate.py
+"""
+The one place ApiKey rows change state (issue, revoke, plan flip, quota/usage reset).
+
+Every mutation updates the DB, then publishes the result:
+  - write-through: the new record for each still-active key goes straight into the
+    auth key cache (L2 + this process's L1), so the next request is a cache hit;
+    revoked keys are deleted from it;
+  - invalidation: one version bump of the "auth:key" namespace makes every worker drop
+    its L1 copies (core.cache.TieredCache), the negative cache entries are cleared, and
+    the owners' dashboard KPI blocks (billing.dashboard) are dropped.
+
+Publishing is deferred with transaction.on_commit (immediate outside a transaction), so
+a rolled-back change never reaches the cache.
+"""
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import dashboard, keycache, signed
+from .models import ApiKey
+
+logger = logging.getLogger(__name__)
+
+
+def publish(ids):
+    """Write the current state of these ApiKey rows through to the cache and invalidate L1s (on commit)."""
+    ids = list(ids)
+    if ids:
+        transaction.on_commit(lambda: _publish(ids))
+
+
+def _publish(ids):
+    rows = ApiKey.objects.filter(pk__in=ids).only(
+        "pk", "key_hash", "plan", "status", "revoked_at", "tenant_id", "trial_quota", "token_version",
+        "owner_id",
+    )
+    hashes, owners = [], set()
+    for row in rows:
+        signed.note(row)
+        owners.add(row.owner_id)
+        if not row.key_hash:
+            continue
+        hashes.append(row.key_hash)
+        if row.is_active:
+            keycache.tier.set(row.key_hash, keycache.record_for_row(row))
+        else:
+            keycache.tier.delete(row.key_hash, bump=False)
+    try:
+        cache.delete_many([keycache.neg_key(h) for h in hashes])
+    except Exception:
+        logger.warning("keystate: negative-cache invalidation failed for %d key(s)", len(hashes), exc_info=True)
+    keycache.tier.bump()
+    dashboard.invalidate_users(owners)
+
+
+def apply(qs, **fields) -> int:
+    """qs.update(**fields) and publish every row it matched. Returns rows updated."""
+    ids = list(qs.values_list("pk", flat=True))
+    if not ids:
+        return 0
+    if "plan" in fields:
+        fields["token_version"] = F("token_version") + 1   # retire signed tokens carrying the old plan
+    updated = ApiKey.objects.filter(pk__in=ids).update(**fields)
+    publish(ids)
+    return updated
+
+
+def created(row: ApiKey):
+    """A freshly issued key: warm the auth cache (on commit) so its first request skips the DB."""
+    created_many([row])
+
+
+def created_many(rows):
+    """created() for a bulk insert: one cache round trip for all the new keys."""
+    rows = [r for r in rows if r.key_hash]
+
+    def _warm():
+        keycache.tier.set_many({r.key_hash: keycache.record_for_row(r) for r in rows})
+        dashboard.invalidate_users(r.owner_id for r in rows)
+    transaction.on_commit(_warm)
+
+
+def adopt(user) -> int:
+    """
+    Give `user` the unowned keys that resolve to them (ApiKey.resolve_owner_id) — e.g. a
+    customer-only key issued by a webhook before the user's stripe_customer_id was linked.
+    """
+    q = Q(tenant_id=str(user.pk))
+    cust = getattr(user, "stripe_customer_id", None)
+    if cust:
+        q |= Q(customer_id=cust) | Q(tenant_id=cust)
+    return apply(ApiKey.objects.filter(q, owner__isnull=True), owner_id=user.pk)
+
+
+def revoke(qs) -> int:
+    return apply(qs.filter(status="active"), status="revoked", revoked_at=timezone.now())
+
+
+def reset_usage(qs) -> int:
+    """Zero usage in the DB and in the live quota counters."""
+    from .quota import get_backend   # quota revokes through this module
+    hashes = list(qs.values_list("key_hash", flat=True))
+    updated = apply(qs, used_requests=0, last_used_at=None)
+
+    def _reset():   # after the DB row: a counter re-seeded from it must see 0
+        backend = get_backend()
+        for key_hash in hashes:
+            try:
+                backend.reset(key_hash)
+            except Exception:
+                logger.warning("keystate: could not reset quota counter", exc_info=True)
+    transaction.on_commit(_reset)
+    return updated
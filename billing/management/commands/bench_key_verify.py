@@ -0,0 +1,88 @@
+# billing/management/commands/bench_key_verify.py
+"""
+Benchmark API-key verification latency against a large ApiKey table.
+
+    python manage.py bench_key_verify --keys 1000000 --lookups 2000
+
+Seeds synthetic keys (tenant_id="bench"), then times verify_token_in_db for hits and
+misses and, for comparison, the old prefix-scan + plaintext loop. Seeded rows are
+deleted afterwards unless --keep is given (re-runs reuse them).
+"""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from billing.models import ApiKey
+from billing.utils import PREFIX_LEN, _sha256_hex, make_api_key, verify_token_in_db
+
+BENCH_TENANT = "bench"
+
+
+def _legacy_verify(token):
+    """Pre-0005 lookup: every active row sharing the 16-char prefix, compared in Python."""
+    qs = ApiKey.objects.filter(key_prefix=token[:PREFIX_LEN], status="active", revoked_at__isnull=True)
+    for row in qs:
+        if token == (row.key_prefix or "") + (row.plain_suffix or ""):
+            return row
+    return None
+
+
+def _summary(samples_ms):
+    s = sorted(samples_ms)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))]
+    return (f"n={len(s)} mean={statistics.fmean(s):.3f}ms p50={pick(0.50):.3f}ms "
+            f"p95={pick(0.95):.3f}ms p99={pick(0.99):.3f}ms max={s[-1]:.3f}ms")
+
+
+class Command(BaseCommand):
+    help = "Seed N API keys and measure verify_token_in_db latency (hashed lookup vs legacy prefix scan)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keys", type=int, default=1_000_000)
+        parser.add_argument("--lookups", type=int, default=2000)
+        parser.add_argument("--batch", type=int, default=5000)
+        parser.add_argument("--keep", action="store_true", help="keep seeded rows for later runs")
+
+    def handle(self, *args, keys, lookups, batch, keep, **opts):
+        tokens = self._seed(keys, batch)
+        sample = random.sample(tokens, min(lookups, len(tokens)))
+        misses = [make_api_key()[0] for _ in range(len(sample))]
+
+        for label, fn in (("hashed", verify_token_in_db), ("legacy", _legacy_verify)):
+            for kind, toks in (("hit", sample), ("miss", misses)):
+                timings = []
+                for t in toks:
+                    started = time.perf_counter()
+                    fn(t)
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(f"{label:<7}{kind:<5} {_summary(timings)}")
+
+        if not keep:
+            deleted, _ = ApiKey.objects.filter(tenant_id=BENCH_TENANT).delete()
+            self.stdout.write(f"removed {deleted} bench rows")
+
+    def _seed(self, total, batch):
+        # plaintext tokens are only known for rows seeded in this run; reuse what we can
+        existing = ApiKey.objects.filter(tenant_id=BENCH_TENANT).count()
+        if existing >= total:
+            self.stdout.write(f"reusing {existing} bench rows")
+            return [r.key_prefix + r.plain_suffix for r in
+                    ApiKey.objects.filter(tenant_id=BENCH_TENANT).only("key_prefix", "plain_suffix")[:100_000]]
+
+        tokens, started = [], time.perf_counter()
+        remaining = total - existing
+        while remaining > 0:
+            rows = []
+            for _ in range(min(batch, remaining)):
+                plain, prefix, suffix = make_api_key()
+                tokens.append(plain)
+                rows.append(ApiKey(key_prefix=prefix, plain_suffix=suffix, key_hash=_sha256_hex(plain),
+                                   tenant_id=BENCH_TENANT, plan="pro", status="active"))
+            with transaction.atomic():
+                ApiKey.objects.bulk_create(rows, batch_size=batch)
+            remaining -= len(rows)
+        self.stdout.write(f"seeded {total - existing} keys in {time.perf_counter() - started:.1f}s")
+        return tokens
@@ -0,0 +1,82 @@
+# billing/management/commands/bench_quota.py
+"""
+Benchmark billing.quota consume() throughput under contention.
+
+    python manage.py bench_quota --backend redis --procs 8 --calls 5000 --limit 10000
+
+Every worker (a forked process; threads for the in-process memory backend) hammers one
+counter with consume(key, 1, limit=L) and the run reports consume/s plus the granted and
+stored totals. The db backend seeds one ApiKey row (tenant_id="bench"), deleted afterwards.
+Exact enforcement itself is covered by billing.tests.QuotaContentionTests.
+"""
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from billing import quota
+from billing.models import ApiKey
+
+
+def _hammer(args):
+    backend_name, key, calls, limit = args
+    backend = quota.get_backend(backend_name)
+    granted = errors = 0
+    started = time.perf_counter()
+    for _ in range(calls):
+        try:
+            granted += backend.consume(key, 1, limit).allowed
+        except Exception:
+            errors += 1
+    connections.close_all()
+    return granted, errors, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = "Report billing.quota consume() throughput with N workers racing one counter."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backend", choices=["redis", "db", "memory"], default=None)
+        parser.add_argument("--procs", type=int, default=8)
+        parser.add_argument("--calls", type=int, default=2000, help="consume() calls per worker")
+        parser.add_argument("--limit", type=int, default=None, help="default: half of all calls")
+
+    def handle(self, *args, backend, procs, calls, limit, **opts):
+        backend = quota.get_backend(backend)
+        total = procs * calls
+        limit = limit if limit is not None else total // 2
+        key = f"quota-check-{uuid.uuid4().hex}"
+        row = None
+        if backend.name == "db":
+            row = ApiKey.objects.create(key_prefix="quota-check", key_hash=key, tenant_id="bench",
+                                        plan="trial", trial_quota=limit)
+        backend.reset(key)
+
+        jobs = [(backend.name, key, calls, limit)] * procs
+        started = time.perf_counter()
+        try:
+            if backend.name == "memory":
+                with ThreadPoolExecutor(procs) as pool:
+                    results = list(pool.map(_hammer, jobs))
+            else:
+                connections.close_all()   # children must not share the parent's DB socket
+                with multiprocessing.get_context("fork").Pool(procs) as pool:
+                    results = pool.map(_hammer, jobs)
+            wall = time.perf_counter() - started
+            stored = backend.consume(key, 0, limit).used
+        finally:
+            backend.reset(key)
+            if row is not None:
+                row.delete()
+
+        granted = sum(r[0] for r in results)
+        errors = sum(r[1] for r in results)
+        self.stdout.write(
+            f"backend={backend.name} workers={procs} calls={total} limit={limit} "
+            f"granted={granted} stored={stored} errors={errors}"
+        )
+        self.stdout.write(f"throughput: {total / wall:,.0f} consume/s over {wall:.2f}s "
+                          f"(slowest worker {max(r[2] for r in results):.2f}s)")
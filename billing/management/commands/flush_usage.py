@@ -0,0 +1,27 @@
+# billing/management/commands/flush_usage.py
+"""
+Drain buffered usage deltas into ApiKey rows (same as the billing.tasks.flush_usage beat task).
+
+    python manage.py flush_usage            # once
+    python manage.py flush_usage --loop 30  # every 30s (when not running Celery beat)
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from billing import usage
+
+
+class Command(BaseCommand):
+    help = "Write buffered ApiKey usage (used_requests / last_used_at) to the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", type=float, default=0, help="repeat every N seconds")
+
+    def handle(self, *args, loop, **opts):
+        while True:
+            written = usage.flush()
+            self.stdout.write(f"flushed usage for {written} key(s)")
+            if not loop:
+                return
+            time.sleep(loop)
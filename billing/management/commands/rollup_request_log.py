@@ -0,0 +1,25 @@
+# billing/management/commands/rollup_request_log.py
+"""
+Refresh HourlyKeyUsage from raw RequestEvent rows and prune old events
+(same as the billing.tasks.rollup_request_log beat task).
+
+    python manage.py rollup_request_log                # last 3 hours
+    python manage.py rollup_request_log --hours 168    # backfill a week
+"""
+from django.core.management.base import BaseCommand
+
+from billing import requestlog
+
+
+class Command(BaseCommand):
+    help = "Aggregate the API request log into hourly per-key rows and prune old raw events."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=requestlog.ROLLUP_HOURS)
+        parser.add_argument("--no-prune", action="store_true")
+
+    def handle(self, *args, hours, no_prune, **opts):
+        rows = requestlog.rollup(hours)
+        self.stdout.write(f"rolled up {rows} hour/key/endpoint row(s)")
+        if not no_prune:
+            self.stdout.write(f"pruned {requestlog.prune()} raw event(s)")
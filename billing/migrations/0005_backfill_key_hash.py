@@ -0,0 +1,57 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:30
+
+import hashlib
+import re
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+_sha256_re = re.compile(r"^[0-9a-f]{64}$")
+
+
+def backfill_key_hash(apps, schema_editor):
+    """
+    Make key_hash = sha256(key_prefix + suffix) on every row, so verification can be a
+    single indexed lookup. Rows are walked by primary key in batches (no full-table load).
+
+    - Rows with plain_suffix: recompute the hash and fix it if missing/stale.
+    - Legacy rows issued via utils_keys stored the raw suffix in key_hash (no plain_suffix):
+      move it to plain_suffix and store the real hash.
+    """
+    ApiKey = apps.get_model("billing", "ApiKey")
+    last_pk = 0
+    while True:
+        rows = list(
+            ApiKey.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only("pk", "key_prefix", "plain_suffix", "key_hash")[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1].pk
+        changed = []
+        for row in rows:
+            suffix = row.plain_suffix
+            if not suffix and row.key_hash and not _sha256_re.match(row.key_hash):
+                suffix = row.key_hash
+            if not suffix:
+                continue
+            digest = hashlib.sha256(f"{row.key_prefix or ''}{suffix}".encode("utf-8")).hexdigest()
+            if row.key_hash != digest or row.plain_suffix != suffix:
+                row.key_hash, row.plain_suffix = digest, suffix
+                changed.append(row)
+        if changed:
+            ApiKey.objects.bulk_update(changed, ["key_hash", "plain_suffix"])
+
+
+class Migration(migrations.Migration):
+
+    atomic = False  # commit per batch; the backfill is idempotent and safe to re-run
+
+    dependencies = [
+        ('billing', '0004_apikey_last_used_at_apikey_trial_quota_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_key_hash, migrations.RunPython.noop),
+    ]
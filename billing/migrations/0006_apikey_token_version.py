@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0005_backfill_key_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apikey',
+            name='token_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
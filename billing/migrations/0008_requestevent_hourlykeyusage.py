@@ -0,0 +1,56 @@
+# Generated by Django 5.2.6 on 2026-10-19 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0007_webhookevent_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ts', models.DateTimeField()),
+                ('key_id', models.IntegerField(default=0)),
+                ('tenant_id', models.CharField(blank=True, default='', max_length=64)),
+                ('endpoint', models.CharField(max_length=128)),
+                ('method', models.CharField(max_length=8)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('latency_ms', models.PositiveIntegerField(default=0)),
+                ('llm_calls', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('cached_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ts'], name='reqevent_ts_idx'), models.Index(fields=['key_id', 'ts'], name='reqevent_key_ts_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyKeyUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('key_id', models.IntegerField(default=0)),
+                ('tenant_id', models.CharField(blank=True, default='', max_length=64)),
+                ('endpoint', models.CharField(max_length=128)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('client_errors', models.PositiveIntegerField(default=0)),
+                ('errors', models.PositiveIntegerField(default=0)),
+                ('latency_ms_sum', models.BigIntegerField(default=0)),
+                ('latency_ms_max', models.PositiveIntegerField(default=0)),
+                ('llm_calls', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('cached_tokens', models.BigIntegerField(default=0)),
+                ('completion_tokens', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key_id', 'hour'], name='hourly_key_hour_idx'), models.Index(fields=['tenant_id', 'hour'], name='hourly_tenant_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('hour', 'key_id', 'endpoint'), name='hourly_key_usage_uniq')],
+            },
+        ),
+    ]
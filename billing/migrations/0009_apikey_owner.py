@@ -0,0 +1,68 @@
+# Generated by Django 5.2.6 on 2026-10-19 16:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_owner(apps, schema_editor):
+    """
+    owner = user, else the user whose id is tenant_id, else the user whose Stripe customer
+    id is customer_id (or tenant_id) — the same OR the dashboard used to run per render.
+    Walked by primary key in batches, two user lookups per batch.
+    """
+    ApiKey = apps.get_model("billing", "ApiKey")
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    last_pk = 0
+    while True:
+        rows = list(
+            ApiKey.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only("pk", "user_id", "tenant_id", "customer_id", "owner_id")[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_pk = rows[-1].pk
+        pending = [r for r in rows if r.owner_id is None]
+        tenant_ids = {int(r.tenant_id) for r in pending if not r.user_id and (r.tenant_id or "").isdigit()}
+        customers = {c for r in pending if not r.user_id for c in (r.customer_id, r.tenant_id) if c}
+        known = set(User.objects.filter(pk__in=tenant_ids).values_list("pk", flat=True))
+        by_customer = dict(User.objects.filter(stripe_customer_id__in=customers)
+                           .values_list("stripe_customer_id", "pk"))
+        changed = []
+        for row in pending:
+            owner = row.user_id
+            if owner is None and (row.tenant_id or "").isdigit() and int(row.tenant_id) in known:
+                owner = int(row.tenant_id)
+            if owner is None:
+                owner = by_customer.get(row.customer_id) or by_customer.get(row.tenant_id)
+            if owner is not None:
+                row.owner_id = owner
+                changed.append(row)
+        if changed:
+            ApiKey.objects.bulk_update(changed, ["owner"])
+
+
+class Migration(migrations.Migration):
+
+    atomic = False  # commit per batch; the backfill is idempotent and safe to re-run
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('billing', '0008_requestevent_hourlykeyusage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apikey',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='owned_api_keys', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='apikey',
+            index=models.Index(fields=['owner', 'status', 'created_at'], name='apikey_owner_idx'),
+        ),
+        migrations.RunPython(backfill_owner, migrations.RunPython.noop),
+    ]
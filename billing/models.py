@@ -62,9 +62,23 @@ class ApiKey(models.Model):
     last_used_at = models.DateTimeField(null=True, blank=True)
     # ------------------------------------------------
 
+    # Bumped on plan changes; signed tokens (billing.signed) minted under an older version stop verifying
+    token_version = models.PositiveIntegerField(default=1)
+
+    # Denormalized owner: `user`, else the user matching tenant_id / customer_id, re-resolved by save()
+    # when those change, so the dashboard and exports need one index range instead of an OR across columns
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True, blank=True,
+        on_delete=models.SET_NULL,
+        related_name="owned_api_keys",
+        db_index=False,   # covered by apikey_owner_idx
+    )
+
     class Meta:
         ordering = ["-created_at"]
         indexes = [
+            models.Index(fields=["owner", "status", "created_at"], name="apikey_owner_idx"),
             models.Index(fields=["user", "status"]),
             models.Index(fields=["customer_id"]),
             models.Index(fields=["key_prefix"]),
@@ -74,6 +88,54 @@ class ApiKey(models.Model):
     def __str__(self):
         return f"{self.key_prefix} ({self.plan}/{self.status})"
 
+    # columns whose as-loaded value save() compares against (see from_db)
+    _TRACKED = ("plan", "user_id", "tenant_id", "customer_id")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        obj = super().from_db(db, field_names, values)
+        obj._loaded = {f: obj.__dict__[f] for f in cls._TRACKED if f in obj.__dict__}
+        return obj
+
+    def _changed(self, attname) -> bool:
+        loaded = getattr(self, "_loaded", {})
+        return attname in loaded and loaded[attname] != getattr(self, attname)
+
+    def save(self, *args, **kwargs):
+        extra = []
+        if self.user_id or self.owner_id is None or any(
+                self._changed(f) for f in ("user_id", "tenant_id", "customer_id")):
+            prev, self.owner_id = self.owner_id, self.resolve_owner_id()
+            if self.owner_id != prev:
+                extra.append("owner")
+                if prev is not None:   # the old owner must stop seeing the key on their dashboard
+                    from django.db import transaction
+                    from .dashboard import invalidate_users
+                    transaction.on_commit(lambda: invalidate_users([prev, self.owner_id]))
+        if self._changed("plan"):
+            # retire signed tokens carrying the old plan, like keystate.apply(plan=...)
+            self.token_version = int(self.token_version or 1) + 1
+            extra.append("token_version")
+        if kwargs.get("update_fields") is not None and extra:
+            kwargs["update_fields"] = {*kwargs["update_fields"], *extra}
+        super().save(*args, **kwargs)
+        self._loaded = {f: getattr(self, f) for f in self._TRACKED}
+
+    def resolve_owner_id(self):
+        """User id owning this key: user, else tenant_id as a user id, else a user by Stripe customer."""
+        from django.contrib.auth import get_user_model
+        if self.user_id:
+            return self.user_id
+        User = get_user_model()
+        tenant = str(self.tenant_id or "")
+        if tenant.isdigit() and User.objects.filter(pk=int(tenant)).exists():
+            return int(tenant)
+        for cust in filter(None, (self.customer_id, tenant)):
+            uid = User.objects.filter(stripe_customer_id=cust).values_list("pk", flat=True).first()
+            if uid:
+                return uid
+        return None
+
     # -------- Convenience helpers --------
     @property
     def is_active(self) -> bool:
@@ -90,6 +152,8 @@ class ApiKey(models.Model):
         self.revoked_at = when or timezone.now()
         if save:
             self.save(update_fields=["status", "revoked_at"])
+            from .keystate import publish
+            publish([self.pk])
 
     def consume_one_trial_request(self) -> int:
         """
@@ -108,11 +172,91 @@ class ApiKey(models.Model):
 
 class WebhookEvent(models.Model):
     """
-    Optional: store processed webhook ids to ensure idempotency.
+    Stripe webhook inbox. The view stores each verified event once (event_id is unique,
+    so Stripe retries become no-ops) and returns; billing.webhooks drains the inbox in
+    batches, in `created` order per customer, retrying failures with backoff.
     """
+    STATUS_CHOICES = (
+        ("pending", "pending"),
+        ("processing", "processing"),
+        ("done", "done"),
+        ("failed", "failed"),     # gave up after MAX_ATTEMPTS; see last_error
+    )
+
     event_id = models.CharField(max_length=255, unique=True)
     kind = models.CharField(max_length=64)
     received_at = models.DateTimeField(auto_now_add=True)
 
+    customer_id = models.CharField(max_length=128, blank=True, default="")
+    created = models.BigIntegerField(default=0)          # Stripe's event.created (unix seconds)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created"], name="webhook_status_created_idx"),
+            models.Index(fields=["customer_id", "created"], name="webhook_customer_idx"),
+        ]
+
     def __str__(self):
         return f"{self.kind}:{self.event_id}"
+
+
+class RequestEvent(models.Model):
+    """
+    One API call (append-only), written in bulk by billing.requestlog's background flusher.
+    key_id is a plain integer (0 = no API key), not a FK: the log must never block or
+    cascade with key changes. Rolled up into HourlyKeyUsage and pruned after retention.
+    """
+    ts = models.DateTimeField()
+    key_id = models.IntegerField(default=0)
+    tenant_id = models.CharField(max_length=64, blank=True, default="")
+    endpoint = models.CharField(max_length=128)
+    method = models.CharField(max_length=8)
+    status = models.PositiveSmallIntegerField()
+    latency_ms = models.PositiveIntegerField(default=0)
+    llm_calls = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    cached_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["ts"], name="reqevent_ts_idx"),
+            models.Index(fields=["key_id", "ts"], name="reqevent_key_ts_idx"),
+        ]
+
+
+class HourlyKeyUsage(models.Model):
+    """Per hour x key x endpoint totals, (re)computed from RequestEvent by billing.requestlog.rollup."""
+    hour = models.DateTimeField()
+    key_id = models.IntegerField(default=0)
+    tenant_id = models.CharField(max_length=64, blank=True, default="")
+    endpoint = models.CharField(max_length=128)
+    requests = models.PositiveIntegerField(default=0)
+    client_errors = models.PositiveIntegerField(default=0)   # 4xx
+    errors = models.PositiveIntegerField(default=0)          # 5xx
+    latency_ms_sum = models.BigIntegerField(default=0)
+    latency_ms_max = models.PositiveIntegerField(default=0)
+    llm_calls = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.BigIntegerField(default=0)
+    cached_tokens = models.BigIntegerField(default=0)
+    completion_tokens = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["hour", "key_id", "endpoint"], name="hourly_key_usage_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["key_id", "hour"], name="hourly_key_hour_idx"),
+            models.Index(fields=["tenant_id", "hour"], name="hourly_tenant_hour_idx"),
+        ]
+
+    @property
+    def avg_latency_ms(self) -> float:
+        return round(self.latency_ms_sum / self.requests, 1) if self.requests else 0.0
@@ -1,75 +1,209 @@
 # billing/quota.py
-from django.core.cache import cache
-from django.utils import timezone
+"""
+Request-quota engine: one atomic `consume(key, cost, limit=...)` with pluggable backends.
+
+    redis   Lua check-and-increment with a ceiling (one round trip, exact across processes)
+    db      conditional UPDATE ... WHERE used_requests + cost <= limit on ApiKey (key = key_hash)
+    memory  in-process dict under a lock (tests / single-process dev)
+
+A consume never moves a counter past its limit, so concurrent callers can't overshoot.
+A counter that doesn't exist yet (new key, evicted Redis entry) is seeded from a `floor`,
+which may be a callable so the persisted count is only read from the DB on such a miss.
+QUOTA_BACKEND picks the backend ("redis" when REDIS_URL is set, else "db"); if Redis is
+unreachable we fall back to the DB backend for that call.
+"""
+import logging
+import threading
+from typing import NamedTuple
+
+from django.conf import settings
 from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core import metrics, redis_conn
+from . import keystate, usage
 from .models import ApiKey
 
-STATE_TTL   = 600    # 10 minutes
-FLUSH_EVERY = 10     # update DB every 10 trial requests (small since quota=10)
-
-def _state_key(h): return f"auth:state:{h}"
-def _count_key(h): return f"auth:count:{h}"
-
-def _load_state_from_db(key_hash: str):
-    ak = (ApiKey.objects
-          .select_related("user")
-          .only("plan","status","revoked_at","trial_quota","used_requests","last_used_at","user__is_active")
-          .filter(key_hash=key_hash)
-          .first())
-    if not ak or not ak.user or not ak.user.is_active or not ak.is_active:
-        return {"status": "none", "trial_quota": 0}
-    if ak.plan == "trial":
-        return {"status": "trial", "trial_quota": int(ak.trial_quota or 0)}
-    return {"status": "subscribed", "trial_quota": None}
-
-def get_state(key_hash: str):
-    sk = _state_key(key_hash)
-    state = cache.get(sk)
-    if state:
-        return state
-    state = _load_state_from_db(key_hash)
-    cache.set(sk, state, STATE_TTL)
-    return state
-
-def invalidate_state(key_hash: str):
-    cache.delete(_state_key(key_hash))
-
-def try_consume_trial(key_hash: str, hard_quota: int) -> tuple[bool, int]:
+logger = logging.getLogger(__name__)
+
+COUNTER_TTL = 30 * 24 * 3600
+
+
+class Consumed(NamedTuple):
+    allowed: bool
+    used: int        # counter value after this call (unchanged when denied)
+    limit: int
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.limit - self.used)
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, cost, limit, floor=0):
+        with self._lock:
+            if key not in self._counts and floor is None:
+                return None   # missing and unseeded: the caller supplies a floor
+            cur = max(self._counts.get(key, 0), floor or 0)
+            if cur + cost > limit:
+                self._counts[key] = cur
+                return Consumed(False, cur, limit)
+            self._counts[key] = cur + cost
+            return Consumed(True, cur + cost, limit)
+
+    def refund(self, key, cost):
+        with self._lock:
+            if key in self._counts:
+                self._counts[key] = max(0, self._counts[key] - cost)
+
+    def reset(self, key):
+        with self._lock:
+            self._counts.pop(key, None)
+
+
+class RedisBackend:
+    name = "redis"
+
+    # KEYS[1]=counter  ARGV: cost, limit, floor (seed if missing; "" = report the miss), ttl
+    LUA = """
+local cur = tonumber(redis.call('GET', KEYS[1]) or '-1')
+local floor = tonumber(ARGV[3])
+if not floor then
+  if cur < 0 then return {-1, 0} end
+  floor = 0
+end
+if cur < floor then cur = floor end
+local cost, limit = tonumber(ARGV[1]), tonumber(ARGV[2])
+if cur + cost > limit then
+  redis.call('SET', KEYS[1], cur, 'EX', ARGV[4])
+  return {0, cur}
+end
+cur = cur + cost
+redis.call('SET', KEYS[1], cur, 'EX', ARGV[4])
+return {1, cur}
+"""
+    # KEYS[1]=counter  ARGV: cost — never below zero, never creates the counter
+    REFUND_LUA = """
+local cur = tonumber(redis.call('GET', KEYS[1]) or '-1')
+if cur < 0 then return 0 end
+cur = math.max(0, cur - tonumber(ARGV[1]))
+redis.call('SET', KEYS[1], cur, 'KEEPTTL')
+return cur
+"""
+
+    def __init__(self, client):
+        self.client = client
+        self._script = self.client.register_script(self.LUA)
+        self._refund = self.client.register_script(self.REFUND_LUA)
+
+    def consume(self, key, cost, limit, floor=0):
+        ok, used = self._script(keys=[f"quota:{key}"], args=[cost, limit, "" if floor is None else floor, COUNTER_TTL])
+        if int(ok) < 0:
+            return None
+        return Consumed(bool(ok), int(used), limit)
+
+    def refund(self, key, cost):
+        self._refund(keys=[f"quota:{key}"], args=[cost])
+
+    def reset(self, key):
+        self.client.delete(f"quota:{key}")
+
+
+class DBBackend:
+    """Counters are ApiKey.used_requests (never missing, so `floor` is unused); `key` is the key_hash."""
+    name = "db"
+
+    def consume(self, key, cost, limit, floor=0):
+        with transaction.atomic():
+            updated = (ApiKey.objects
+                       .filter(key_hash=key, used_requests__lte=limit - cost)
+                       .update(used_requests=F("used_requests") + cost, last_used_at=timezone.now()))
+            used = ApiKey.objects.filter(key_hash=key).values_list("used_requests", flat=True).first() or 0
+        return Consumed(bool(updated), int(used), limit)
+
+    def refund(self, key, cost):
+        ApiKey.objects.filter(key_hash=key, used_requests__gte=cost).update(used_requests=F("used_requests") - cost)
+
+    def reset(self, key):
+        ApiKey.objects.filter(key_hash=key).update(used_requests=0)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    name = name or getattr(settings, "QUOTA_BACKEND", "") or ("redis" if getattr(settings, "REDIS_URL", "") else "db")
+    with _backends_lock:
+        if name not in _backends:
+            if name == "redis":
+                _backends[name] = RedisBackend(redis_conn.get_client())
+            elif name == "memory":
+                _backends[name] = MemoryBackend()
+            else:
+                _backends[name] = DBBackend()
+        return _backends[name]
+
+
+def consume(key: str, cost: int = 1, *, limit: int, floor=0, backend=None) -> Consumed:
     """
-    Returns (allowed, used_now). Uses Redis INCR if available; else DB row lock.
+    Atomically add `cost` to `key`'s counter unless that would exceed `limit`.
+    `floor` seeds a missing counter (e.g. the persisted used_requests) so a lost Redis key
+    can't hand out the quota twice. Pass a callable to read it only when the counter is missing.
     """
-    if hard_quota <= 0:
-        return (False, 0)
+    be = backend or get_backend()
+    if limit <= 0:
+        return Consumed(False, 0, max(0, limit))
+    lazy = callable(floor)
+    try:
+        res = be.consume(key, int(cost), int(limit), None if lazy else int(floor))
+        if res is None:
+            metrics.incr("quota.counter_seeded")
+            res = be.consume(key, int(cost), int(limit), int(floor()))
+        return res
+    except Exception:
+        if be.name == "db":
+            raise
+        metrics.incr("quota.backend_fallback")
+        logger.warning("quota: %s backend failed, falling back to db", be.name, exc_info=True)
+        return get_backend("db").consume(key, int(cost), int(limit))
+
+
+def consume_trial(rec: dict, key_hash: str) -> Consumed:
+    """
+    Count one request against a trial key (record from billing.keycache) and revoke the
+    key once its quota is spent. The DB backend persists usage itself; otherwise
+    ApiKey.used_requests follows via the write-behind flusher (billing.usage).
+    """
+    be = get_backend()
 
-    # Fast path: Redis counter
+    def persisted():   # only on a counter miss: the cached record doesn't carry usage
+        return ApiKey.objects.filter(pk=rec["id"]).values_list("used_requests", flat=True).first() or 0
+
+    res = consume(key_hash, 1, limit=int(rec.get("quota") or 0), floor=persisted, backend=be)
+    if res.allowed:
+        if be.name != "db":
+            usage.record(rec["id"])
+        return res
+
+    keystate.revoke(ApiKey.objects.filter(pk=rec["id"]))
+    return res
+
+
+def refund_trial(key_id: int, key_hash: str) -> None:
+    """Give back one request consume_trial counted (the request was rejected afterwards). Never raises."""
+    be = get_backend()
     try:
-        used = cache.incr(_count_key(key_hash))
-        cache.touch(_count_key(key_hash), 30*24*3600)
-        if used <= hard_quota:
-            if used % FLUSH_EVERY == 0:
-                ApiKey.objects.filter(key_hash=key_hash, status="active").update(
-                    used_requests=used, last_used_at=timezone.now()
-                )
-            return (True, used)
-        # Exceeded → revoke in DB and invalidate cache
-        ApiKey.objects.filter(key_hash=key_hash).update(
-            status="revoked", revoked_at=timezone.now(), used_requests=used
-        )
-        invalidate_state(key_hash)
-        return (False, used)
+        be.refund(key_hash, 1)
+        if be.name != "db":
+            usage.record(key_id, -1)
+        metrics.incr("quota.refunded")
     except Exception:
-        # Fallback if cache not configured: serialize on DB
-        with transaction.atomic():
-            ak = ApiKey.objects.select_for_update().filter(key_hash=key_hash, status="active").first()
-            if not ak or ak.plan != "trial":
-                return (False, 0)
-            if ak.used_requests >= hard_quota:
-                ak.status = "revoked"
-                ak.revoked_at = timezone.now()
-                ak.save(update_fields=["status","revoked_at"])
-                invalidate_state(key_hash)
-                return (False, ak.used_requests)
-            ak.used_requests += 1
-            ak.last_used_at  = timezone.now()
-            ak.save(update_fields=["used_requests","last_used_at"])
-            return (True, ak.used_requests)
+        logger.warning("quota: refund failed for key id=%s", key_id, exc_info=True)
@@ -0,0 +1,217 @@
+# billing/requestlog.py
+"""
+Per-call API request log: RequestLogMiddleware -> in-process buffer -> RequestEvent rows.
+
+The middleware appends one dict per API call (key id, tenant, endpoint route, status,
+latency, LLM calls + token totals from `request.llm_usage`, set by the content views) to a
+bounded in-memory buffer and returns. It sits above admission control, so shed 503s are
+logged too; for requests no view authenticated, the key comes from the auth cache only. A daemon thread per process drains the buffer with
+bulk_create every FLUSH_EVERY seconds (sooner once BATCH_SIZE events are waiting) and at
+exit, so logging never adds a DB write to the request path. When the buffer is full,
+events are dropped and counted (requestlog.dropped) rather than slowing requests down.
+
+`rollup()` (Celery beat: billing.tasks.rollup_request_log, or `manage.py
+rollup_request_log`) recomputes HourlyKeyUsage for the last ROLLUP_HOURS hours from the
+raw events — recomputing instead of adding keeps it idempotent and picks up late
+flushes — and deletes raw events older than REQUEST_LOG_RETENTION_DAYS.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncHour
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from core import metrics
+from . import keycache, signed
+from .models import HourlyKeyUsage, RequestEvent
+from .utils import _sha256_hex
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE     = 500
+FLUSH_EVERY    = 2.0
+MAX_BUFFER     = 50_000
+ROLLUP_HOURS   = 3
+PRUNE_BATCH    = 5000
+PREFIXES       = tuple(getattr(settings, "REQUEST_LOG_PREFIXES", ("/v1/", "/api/")))
+RETENTION_DAYS = getattr(settings, "REQUEST_LOG_RETENTION_DAYS", 7)
+
+_buffer = []
+_lock = threading.Lock()
+_wake = threading.Event()
+_flusher = None
+_flusher_pid = None
+
+_USAGE_FIELDS = ("prompt_tokens", "cached_tokens", "completion_tokens")
+
+
+# ---- buffer ----
+def log(event: dict) -> None:
+    """Queue one event for the background flusher. Never blocks on the DB, never raises."""
+    with _lock:
+        if len(_buffer) >= MAX_BUFFER:
+            metrics.incr("requestlog.dropped")
+            return
+        _buffer.append(event)
+        full = len(_buffer) >= BATCH_SIZE
+    _ensure_flusher()
+    if full:
+        _wake.set()
+
+
+def flush() -> int:
+    """Write everything buffered in this process; returns rows inserted."""
+    with _lock:
+        batch = _buffer[:]
+        _buffer.clear()
+    if not batch:
+        return 0
+    try:
+        RequestEvent.objects.bulk_create([RequestEvent(**e) for e in batch], batch_size=BATCH_SIZE)
+    except Exception:
+        logger.exception("requestlog: bulk insert of %d event(s) failed", len(batch))
+        with _lock:   # keep them for the next round, within the cap
+            room = max(0, MAX_BUFFER - len(_buffer))
+            _buffer[:0] = batch[:room]
+        metrics.incr("requestlog.dropped", max(0, len(batch) - room))
+        return 0
+    metrics.incr("requestlog.written", len(batch))
+    return len(batch)
+
+
+def _run():
+    while True:
+        _wake.wait(FLUSH_EVERY)
+        _wake.clear()
+        try:
+            flush()
+        finally:
+            close_old_connections()
+
+
+def _ensure_flusher():
+    # started lazily so each forked worker (gunicorn/celery prefork) gets its own thread
+    global _flusher, _flusher_pid
+    if _flusher_pid == os.getpid() and _flusher.is_alive():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid() and _flusher.is_alive():
+            return
+        _flusher = threading.Thread(target=_run, name="requestlog-flusher", daemon=True)
+        _flusher_pid = os.getpid()
+        _flusher.start()
+
+
+atexit.register(flush)
+
+
+# ---- middleware ----
+class RequestLogMiddleware:
+    """Record every request under PREFIXES (API traffic) into the request log."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not request.path.startswith(PREFIXES):
+            return self.get_response(request)
+        t0 = time.monotonic()
+        response = self.get_response(request)
+        try:
+            log(self._event(request, response, int((time.monotonic() - t0) * 1000)))
+        except Exception:
+            logger.debug("requestlog: could not record request", exc_info=True)
+        return response
+
+    @staticmethod
+    def _unauthenticated(request) -> dict:
+        """Key id / tenant of a request no view authenticated (e.g. shed with 503), without I/O to the DB."""
+        header = request.headers.get("Authorization", "")
+        if not header.startswith("Bearer "):
+            return {}
+        token = header[7:].strip()
+        if signed.is_signed(token):
+            return signed.verify(token) or {}
+        rec = keycache.tier.get(_sha256_hex(token))   # cache-only: no loader
+        return {"key_id": rec["id"], "tenant_id": rec["tenant_id"]} if rec else {}
+
+    @classmethod
+    def _event(cls, request, response, latency_ms):
+        auth = getattr(request, "auth", None)
+        auth = auth if isinstance(auth, dict) else cls._unauthenticated(request)
+        match = getattr(request, "resolver_match", None)
+        if match is None:
+            try:
+                match = resolve(request.path_info)
+            except Resolver404:
+                pass
+        usage = getattr(request, "llm_usage", None) or {}
+        return {
+            "ts": timezone.now(),
+            "key_id": int(auth.get("key_id") or 0),
+            "tenant_id": str(auth.get("tenant_id") or "")[:64],
+            "endpoint": ((match.route if match else "") or "<unmatched>")[:128],
+            "method": request.method[:8],
+            "status": response.status_code,
+            "latency_ms": latency_ms,
+            "llm_calls": int(usage.get("calls", 0)),
+            **{f: int(usage.get(f, 0)) for f in _USAGE_FIELDS},
+        }
+
+
+# ---- rollup / retention ----
+def rollup(hours: int = ROLLUP_HOURS) -> int:
+    """Recompute HourlyKeyUsage for the last `hours` hours (incl. the current one); returns rows upserted."""
+    start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+    groups = (
+        RequestEvent.objects.filter(ts__gte=start)
+        .annotate(hour=TruncHour("ts"))
+        .values("hour", "key_id", "endpoint")
+        .annotate(
+            tenant=Max("tenant_id"),
+            n=Count("id"),
+            n_4xx=Count("id", filter=Q(status__gte=400, status__lt=500)),
+            n_5xx=Count("id", filter=Q(status__gte=500)),
+            lat_sum=Sum("latency_ms"),
+            lat_max=Max("latency_ms"),
+            calls=Sum("llm_calls"),
+            **{f"sum_{f}": Sum(f) for f in _USAGE_FIELDS},
+        )
+    )
+    rows = [
+        HourlyKeyUsage(
+            hour=g["hour"], key_id=g["key_id"], endpoint=g["endpoint"], tenant_id=g["tenant"] or "",
+            requests=g["n"], client_errors=g["n_4xx"], errors=g["n_5xx"],
+            latency_ms_sum=g["lat_sum"] or 0, latency_ms_max=g["lat_max"] or 0, llm_calls=g["calls"] or 0,
+            **{f: g[f"sum_{f}"] or 0 for f in _USAGE_FIELDS},
+        )
+        for g in groups
+    ]
+    with transaction.atomic():
+        HourlyKeyUsage.objects.bulk_create(
+            rows, batch_size=BATCH_SIZE, update_conflicts=True,
+            unique_fields=["hour", "key_id", "endpoint"],
+            update_fields=["tenant_id", "requests", "client_errors", "errors", "latency_ms_sum",
+                           "latency_ms_max", "llm_calls", *_USAGE_FIELDS],
+        )
+    metrics.incr("requestlog.rollup_rows", len(rows))
+    return len(rows)
+
+
+def prune(days: int = RETENTION_DAYS) -> int:
+    """Delete raw events older than `days`, PRUNE_BATCH rows per statement; returns rows deleted."""
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = list(RequestEvent.objects.filter(ts__lt=cutoff).order_by("id").values_list("id", flat=True)[:PRUNE_BATCH])
+        if not ids:
+            return deleted
+        deleted += RequestEvent.objects.filter(id__in=ids).delete()[0]
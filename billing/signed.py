@@ -0,0 +1,132 @@
+# billing/signed.py
+"""
+Optional stateless API tokens: cg_sig_<payload>.<mac>
+
+    payload = base64url(json [key_id, plan, tenant_id, token_version, issued_at])
+    mac     = base64url(HMAC-SHA256(API_TOKEN_SECRET, payload))
+
+Verification is pure CPU: check the MAC, the age (TOKEN_MAX_AGE) and an in-process
+revocation map {key_id: minimum valid token_version} (revoked keys map to infinity).
+The map is rebuilt from ApiKey rows at most every SYNC_EVERY seconds and patched at once
+by billing.keystate for changes made in this process, so revocation reaches other
+workers within SYNC_EVERY. A plan change bumps ApiKey.token_version, retiring tokens
+that carry the old plan.
+
+Only paid keys get signed tokens: trial requests must hit the quota counter anyway.
+Holders exchange a raw cg_live_ key for one at POST /billing/token/; raw keys keep
+working through the normal path.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PREFIX  = "cg_sig_"
+TOKEN_MAX_AGE = getattr(settings, "API_TOKEN_MAX_AGE", 30 * 24 * 3600)
+SYNC_EVERY    = getattr(settings, "API_TOKEN_REVOCATION_SYNC", 30)
+
+_revoked = {}          # key_id -> minimum valid token_version (math.inf = revoked)
+_synced = 0.0
+_sync_lock = threading.Lock()
+_secret = None
+
+
+def _key() -> bytes:
+    global _secret
+    if _secret is None:
+        raw = getattr(settings, "API_TOKEN_SECRET", "") or settings.SECRET_KEY
+        # domain-separate from other SECRET_KEY uses
+        _secret = hmac.new(raw.encode("utf-8"), b"billing.signed.v1", hashlib.sha256).digest()
+    return _secret
+
+
+def _b64(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).rstrip(b"=").decode("ascii")
+
+
+def _unb64(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+def is_signed(token: str) -> bool:
+    return bool(token) and token.startswith(TOKEN_PREFIX)
+
+
+def mint(row) -> str:
+    """Signed token for an active, paid ApiKey row."""
+    if not row.is_active or row.plan == "trial":
+        raise ValueError("signed tokens are only issued for active paid keys")
+    payload = _b64(json.dumps([row.pk, row.plan, str(row.tenant_id), int(row.token_version), int(time.time())],
+                              separators=(",", ":")).encode("utf-8"))
+    mac = _b64(hmac.new(_key(), payload.encode("ascii"), hashlib.sha256).digest())
+    return f"{TOKEN_PREFIX}{payload}.{mac}"
+
+
+def verify(token: str):
+    """Claims dict {key_id, plan, tenant_id} for a valid, unrevoked token, else None."""
+    try:
+        payload, mac = token[len(TOKEN_PREFIX):].split(".", 1)
+        expected = hmac.new(_key(), payload.encode("ascii"), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _unb64(mac)):
+            return None
+        key_id, plan, tenant_id, version, issued_at = json.loads(_unb64(payload))
+    except Exception:
+        return None
+    if time.time() - issued_at > TOKEN_MAX_AGE:
+        return None
+    _maybe_sync()
+    if version < _revoked.get(key_id, 0):
+        return None
+    return {"key_id": key_id, "plan": plan, "tenant_id": tenant_id}
+
+
+def note(row):
+    """Apply one row's state to this process's revocation map (called by billing.keystate)."""
+    if not row.is_active:
+        _revoked[row.pk] = math.inf
+    elif int(row.token_version or 1) > 1:
+        _revoked[row.pk] = int(row.token_version)
+    else:
+        _revoked.pop(row.pk, None)   # reactivated without a plan change
+
+
+def sync():
+    """Rebuild the revocation map: keys revoked within TOKEN_MAX_AGE and re-versioned keys."""
+    from .models import ApiKey
+    since = timezone.now() - timedelta(seconds=TOKEN_MAX_AGE)
+    fresh = {}
+    rows = (ApiKey.objects
+            .filter(Q(status="revoked", revoked_at__gte=since) | Q(token_version__gt=1))
+            .values_list("pk", "status", "token_version"))
+    for pk, status, version in rows.iterator(chunk_size=5000):
+        fresh[pk] = math.inf if status == "revoked" else int(version)
+    global _revoked
+    _revoked = fresh
+
+
+def _maybe_sync():
+    global _synced
+    if time.monotonic() - _synced < SYNC_EVERY:
+        return
+    if not _sync_lock.acquire(blocking=False):
+        return   # another thread is syncing; use the current map
+    try:
+        if time.monotonic() - _synced >= SYNC_EVERY:
+            sync()
+            _synced = time.monotonic()
+    except Exception:
+        logger.exception("signed: revocation sync failed; keeping the previous map")
+        _synced = time.monotonic()
+    finally:
+        _sync_lock.release()
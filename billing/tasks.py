@@ -1,36 +1,26 @@
 from celery import shared_task
-from .views import _issue_key_for_user
-from django.contrib.auth import get_user_model
-import json
-from .utils_keys import _issue_key_for_user
-from .utils import make_api_key
 
+from . import requestlog, usage, webhooks
 
-User = get_user_model()
 
-@shared_task
-def process_stripe_event(payload_str):
-    """
-    Task to process Stripe webhook events and issue API keys.
-    """
-    print('Webhook Receieved')
-    event = json.loads(payload_str)
-    evt_type = event.get("type")
-    data = event.get("data", {}).get("object", {})
+@shared_task(ignore_result=True)
+def drain_webhooks():
+    """Process the Stripe webhook inbox (queued by the webhook view; beat retries backoffs)."""
+    handled = webhooks.drain()
+    if handled >= webhooks.BATCH_SIZE:
+        drain_webhooks.delay()   # more waiting: keep going without waiting for beat
+    return handled
 
-    customer_id = data.get("customer")
-    email = (data.get("customer_details") or {}).get("email")
 
-    user = None
-    if customer_id:
-        user = User.objects.filter(stripe_customer_id=customer_id).first()
-    if not user and email:
-        user = User.objects.filter(email=email).first()
+@shared_task(ignore_result=True)
+def flush_usage():
+    """Periodic (Celery beat): write buffered usage deltas to ApiKey rows."""
+    return usage.flush()
 
-    if user and evt_type in {
-        "checkout.session.completed",
-        "invoice.payment_succeeded",
-        "customer.subscription.created",
-        "customer.subscription.updated",
-    }:
-        _issue_key_for_user(make_api_key_func=make_api_key,user=user, customer_id=customer_id, plan="pro")
+
+@shared_task(ignore_result=True)
+def rollup_request_log():
+    """Periodic (Celery beat): refresh hourly per-key usage and prune old raw request events."""
+    rows = requestlog.rollup()
+    requestlog.prune()
+    return rows
@@ -1,3 +1,191 @@
-from django.test import TestCase
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from . import keycache, keystate, requestlog, signed, usage
+from .auth import ApiKeyAuthentication
+from .models import ApiKey
+from .utils import _sha256_hex
+
+User = get_user_model()
+
+
+def make_key(plan="pro", **fields):
+    plain = f"cg_live_test_{uuid.uuid4().hex}"
+    row = ApiKey.objects.create(key_prefix=plain[:16], key_hash=_sha256_hex(plain), tenant_id="t1",
+                                plan=plan, status="active", **fields)
+    return plain, row
+
+
+class SignedTokenTests(TestCase):
+    def setUp(self):
+        signed._revoked.clear()
+
+    def test_plan_change_through_admin_form_retires_tokens(self):
+        _, row = make_key("pro")
+        token = signed.mint(row)
+        self.assertEqual(signed.verify(token)["plan"], "pro")
+
+        admin = User.objects.create_superuser("admin", "admin@example.com", "x")
+        self.client.force_login(admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(reverse("admin:billing_apikey_change", args=[row.pk]), {
+                "user": "", "tenant_id": row.tenant_id, "plan": "trial", "status": "active",
+                "customer_id": "", "trial_quota": "10",
+            })
+        self.assertEqual(resp.status_code, 302)
+
+        row.refresh_from_db()
+        self.assertEqual(row.plan, "trial")
+        self.assertEqual(row.token_version, 2)
+        self.assertIsNone(signed.verify(token))
+
+    def test_save_without_plan_change_keeps_tokens(self):
+        _, row = make_key("pro")
+        token = signed.mint(row)
+        row.customer_id = "cus_1"
+        with self.captureOnCommitCallbacks(execute=True):
+            row.save()
+        row.refresh_from_db()
+        self.assertEqual(row.token_version, 1)
+        self.assertIsNotNone(signed.verify(token))
+
+
+class OwnerTests(TestCase):
+    def test_reassigning_user_moves_owner_and_dashboard(self):
+        from . import dashboard
+        u1 = User.objects.create_user("u1", "u1@example.com", "x")
+        u2 = User.objects.create_user("u2", "u2@example.com", "x")
+        _, row = make_key("pro", user=u1)
+        self.assertEqual(row.owner_id, u1.pk)
+        self.assertEqual(dashboard.kpis(u1)["key"]["id"], row.pk)
+
+        row = ApiKey.objects.get(pk=row.pk)
+        row.user = u2
+        with self.captureOnCommitCallbacks(execute=True):
+            row.save()
+        row.refresh_from_db()
+        self.assertEqual(row.owner_id, u2.pk)
+        self.assertNotEqual((dashboard.kpis(u1)["key"] or {}).get("id"), row.pk)
+        self.assertEqual(dashboard.kpis(u2)["key"]["id"], row.pk)
+
+
+class QuotaContentionTests(TransactionTestCase):
+    """N threads race one counter: exactly `limit` calls are granted and the counter agrees."""
+    WORKERS, CALLS, LIMIT = 8, 50, 120
+
+    def _race(self, backend, key):
+        from . import quota
+        barrier = threading.Barrier(self.WORKERS)
+
+        def hammer(_):
+            barrier.wait()
+            try:
+                return sum(quota.consume(key, 1, limit=self.LIMIT, backend=backend).allowed
+                           for _ in range(self.CALLS))
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.WORKERS) as pool:
+            granted = sum(pool.map(hammer, range(self.WORKERS)))
+        self.assertEqual(granted, self.LIMIT)
+        self.assertEqual(backend.consume(key, 0, self.LIMIT).used, self.LIMIT)
+        self.assertFalse(quota.consume(key, 1, limit=self.LIMIT, backend=backend).allowed)
+
+    def test_memory_backend_is_exact(self):
+        from . import quota
+        self._race(quota.MemoryBackend(), "k-memory")
+
+    def test_db_backend_is_exact(self):
+        from . import quota
+        _, row = make_key("trial", trial_quota=self.LIMIT)
+        self._race(quota.DBBackend(), row.key_hash)
+        row.refresh_from_db()
+        self.assertEqual(row.used_requests, self.LIMIT)
+
+    @skipUnless(settings.REDIS_URL, "REDIS_URL not set")
+    def test_redis_backend_is_exact(self):
+        from core import redis_conn
+        from . import quota
+        backend = quota.RedisBackend(redis_conn.get_client())
+        key = f"test-{uuid.uuid4().hex}"
+        try:
+            self._race(backend, key)
+        finally:
+            backend.reset(key)
+
+
+@override_settings(QUOTA_BACKEND="memory")
+class KeyStateTests(TestCase):
+    """Mutations through billing.keystate change the very next auth result, cache or not."""
+
+    def setUp(self):
+        cache.clear()
+        keycache.tier.bump()
+
+    def tearDown(self):
+        usage.flush()   # write-behind counts belong to this test's DB
+
+    def auth(self, plain):
+        request = Request(APIRequestFactory().get("/v1/generate", HTTP_AUTHORIZATION=f"Bearer {plain}"))
+        return ApiKeyAuthentication().authenticate(request)[1]
+
+    def test_revoke(self):
+        plain, row = make_key("pro")
+        self.assertEqual(self.auth(plain)["plan"], "pro")   # now cached
+        with self.captureOnCommitCallbacks(execute=True):
+            keystate.revoke(ApiKey.objects.filter(pk=row.pk))
+        with self.assertRaises(AuthenticationFailed):
+            self.auth(plain)
+
+    def test_flip_to_pro(self):
+        plain, row = make_key("trial", trial_quota=5)
+        self.assertEqual(self.auth(plain)["plan"], "trial")
+        with self.captureOnCommitCallbacks(execute=True):
+            keystate.apply(ApiKey.objects.filter(pk=row.pk), plan="pro", trial_quota=None)
+        self.assertEqual(self.auth(plain)["plan"], "pro")
+
+    def test_reset_usage(self):
+        plain, row = make_key("trial", trial_quota=2)
+        self.assertEqual(self.auth(plain)["used"], 1)
+        self.assertEqual(self.auth(plain)["used"], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            keystate.reset_usage(ApiKey.objects.filter(pk=row.pk))
+        self.assertEqual(self.auth(plain)["used"], 1)
+
+    def test_counter_miss_seeds_from_db(self):
+        plain, row = make_key("trial", trial_quota=3, used_requests=2)
+        self.assertEqual(self.auth(plain)["used"], 3)
+        with self.assertRaises(AuthenticationFailed):
+            self.auth(plain)
+
+
+class RequestLogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        keycache.tier.bump()
+        requestlog._buffer.clear()
+
+    @override_settings(ADMISSION_WORKER_MAX_INFLIGHT=0)
+    @mock.patch.object(requestlog, "_ensure_flusher")   # keep the event in the buffer
+    def test_shed_requests_are_logged_with_their_key(self, _):
+        plain, row = make_key("pro")
+        keycache.tier.set(row.key_hash, keycache.record_for_row(row))
+        resp = self.client.post("/v1/generate/content", {}, content_type="application/json",
+                                HTTP_AUTHORIZATION=f"Bearer {plain}")
+        self.assertEqual(resp.status_code, 503)
+        (event,) = requestlog._buffer
+        self.assertEqual((event["status"], event["key_id"], event["tenant_id"]), (503, row.pk, row.tenant_id))
+        self.assertNotEqual(event["endpoint"], "<unmatched>")
+        requestlog._buffer.clear()
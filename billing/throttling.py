@@ -0,0 +1,116 @@
+# billing/throttling.py
+"""
+Rate limiting for API-key traffic.
+
+ApiKeyAuthentication returns no Django user, so DRF's stock User/Anon throttles treated
+every /v1/ call as "anon" and limited it per IP. Here API-key requests are limited per key
+(per-plan rates from API_KEY_RATE_LIMITS) with a sliding-window counter: the current and
+previous fixed windows, the previous one weighted by how much of it still overlaps the
+sliding window. That is one get_many + one incr per check, whatever the rate.
+
+The stock throttles still apply to JWT/session/anonymous traffic, but skip API-key
+requests. DRF authenticates (and so charges trial quota) before throttling, so a trial
+request rejected here gets its quota unit refunded (billing.quota.refund_trial). RateLimitHeadersMiddleware copies the outcome into X-RateLimit-* headers.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import throttling
+
+from core import metrics
+from . import quota
+
+DEFAULT_RATES = {"trial": "30/min", "demo": "30/min", "default": "600/min"}
+
+
+def _parse_rate(rate):
+    """'600/min' -> (600, 60) — same format as DEFAULT_THROTTLE_RATES."""
+    num, period = rate.split("/")
+    return int(num), {"s": 1, "m": 60, "h": 3600, "d": 86400}[period[0]]
+
+
+def _api_key_auth(request):
+    auth = getattr(request, "auth", None)
+    return auth if isinstance(auth, dict) and "plan" in auth else None
+
+
+class UserRateThrottle(throttling.UserRateThrottle):
+    def get_cache_key(self, request, view):
+        return None if _api_key_auth(request) else super().get_cache_key(request, view)
+
+
+class AnonRateThrottle(throttling.AnonRateThrottle):
+    def get_cache_key(self, request, view):
+        return None if _api_key_auth(request) else super().get_cache_key(request, view)
+
+
+class ApiKeyRateThrottle(throttling.BaseThrottle):
+    """Per-API-key sliding-window limit; the rate depends on the key's plan."""
+
+    def allow_request(self, request, view):
+        auth = _api_key_auth(request)
+        if auth is None:
+            return True
+        rates = getattr(settings, "API_KEY_RATE_LIMITS", DEFAULT_RATES)
+        rate = rates.get(auth["plan"]) or rates.get("default") or DEFAULT_RATES["default"]
+        limit, window = _parse_rate(rate)
+        ident = f"k{auth['key_id']}" if auth.get("key_id") else f"t{auth.get('tenant_id') or 'anon'}"
+
+        now = time.time()
+        idx = int(now // window)
+        cur_key, prev_key = f"rl:{ident}:{idx}", f"rl:{ident}:{idx - 1}"
+        try:
+            cache.add(cur_key, 0, window * 2)
+            current = cache.incr(cur_key)
+            previous = cache.get(prev_key) or 0
+        except Exception:
+            return True   # never fail closed on a cache outage
+        overlap = 1.0 - (now - idx * window) / window
+        estimate = previous * overlap + current
+
+        allowed = estimate <= limit
+        if not allowed:
+            try:
+                cache.decr(cur_key)   # rejected calls don't count against the window
+            except Exception:
+                pass
+            metrics.incr("ratelimit.rejected")
+            estimate -= 1
+            charge = getattr(request._request, "trial_charge", None)
+            if charge:   # authentication already counted this trial request; it never runs
+                quota.refund_trial(*charge)
+                request._request.trial_charge = None
+        # seconds until enough of the previous window slides out to admit one more call
+        need = estimate + 1 - limit
+        if allowed:
+            self._wait = 0
+        elif previous and need <= previous * overlap:
+            self._wait = need / previous * window
+        else:
+            self._wait = (idx + 1) * window - now
+        request._request.ratelimit = {
+            "limit": limit,
+            "remaining": max(0, int(limit - estimate)),
+            "reset": int((idx + 1) * window - now + 0.999),
+        }
+        return allowed
+
+    def wait(self):
+        return max(1, int(self._wait + 0.999))
+
+
+class RateLimitHeadersMiddleware:
+    """Adds X-RateLimit-Limit/Remaining/Reset for requests ApiKeyRateThrottle looked at."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        info = getattr(request, "ratelimit", None)
+        if info:
+            response["X-RateLimit-Limit"] = str(info["limit"])
+            response["X-RateLimit-Remaining"] = str(info["remaining"])
+            response["X-RateLimit-Reset"] = str(info["reset"])
+        return response
@@ -6,6 +6,8 @@ from .views import (
     my_key,
     # test_webhook,
     verify_key,        # <-- add this if you use the verify endpoint
+    signed_token,
+    usage_export,
 )
 
 app_name = "billing"   # optional but helpful for namespacing
@@ -15,5 +17,7 @@ urlpatterns = [
     path("webhook/", stripe_webhook, name="stripe_webhook"), # payment provider webhook (Stripe)
     path("key/", my_key, name="my_key"),                     # show active key prefix to the logged-in user
     path("verify/", verify_key, name="verify_key"),          # verify a raw API key (public)
+    path("token/", signed_token, name="signed_token"),       # raw paid key -> stateless signed token
+    path("usage/export/", usage_export, name="usage_export"), # streamed CSV/NDJSON usage history
     # path("test/", test_webhook, name="test_webhook"),        # simple test endpoint
 ]
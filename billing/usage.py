@@ -0,0 +1,210 @@
+# billing/usage.py
+"""
+Write-behind usage recording for ApiKey.used_requests / last_used_at (all plans).
+
+Authentication calls `record(key_id)`; nothing is written to the DB on the request path.
+With Redis the delta goes into one hash (one MULTI round trip):
+
+    usage:pending    d:<id> -> requests since last flush
+                     t:<id> -> unix time of the latest request
+                     since  -> unix time of the oldest unflushed request
+
+`flush()` (Celery beat: billing.tasks.flush_usage, or `manage.py flush_usage`) RENAMEs the
+hash to usage:draining:<uuid> (atomic; new requests start a fresh pending hash), applies
+it with batched UPDATE ... CASE statements in one transaction, then deletes it. A crash
+between rename and delete leaves the draining hash in place and the next flush applies
+it first, so deltas are never lost (at worst re-applied once if the crash lands between
+COMMIT and DEL). Flush lag (age of the oldest delta at write time) is reported as the
+usage.flush_lag timing and gauge.
+
+Without Redis, deltas are buffered per process and written by a daemon thread every
+LOCAL_FLUSH_EVERY seconds, and once more at interpreter exit; flush() in that process
+drains the buffer directly.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from core import metrics, redis_conn
+from . import dashboard
+from .models import ApiKey
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY       = "usage:pending"
+DRAINING_PREFIX   = "usage:draining:"
+BATCH_SIZE        = 500
+LOCAL_FLUSH_EVERY = 10.0
+FLUSH_LOCK_KEY    = "usage:flush-lock"
+FLUSH_LOCK_TTL    = 300
+
+_local = {}            # key_id -> [delta, last_ts]  (no-Redis fallback)
+_local_since = None
+_lock = threading.Lock()
+_flusher = None
+_flusher_pid = None
+
+
+def record(key_id: int, n: int = 1) -> None:
+    """Count n requests for ApiKey `key_id`. Never raises."""
+    now = time.time()
+    client = redis_conn.get_client()
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=True)
+            pipe.hincrby(PENDING_KEY, f"d:{key_id}", n)
+            pipe.hset(PENDING_KEY, f"t:{key_id}", now)
+            pipe.hsetnx(PENDING_KEY, "since", now)
+            pipe.execute()
+            return
+        except Exception:
+            metrics.incr("usage.redis_error")
+            logger.debug("usage: redis record failed, buffering locally", exc_info=True)
+    _record_local(key_id, n, now)
+
+
+def _record_local(key_id, n, now):
+    global _local_since
+    with _lock:
+        entry = _local.setdefault(key_id, [0, now])
+        entry[0] += n
+        entry[1] = now
+        if _local_since is None:
+            _local_since = now
+    _ensure_flusher()
+
+
+def _drain_local() -> int:
+    """Write this process's buffered deltas; on failure they are merged back for the next round."""
+    global _local_since
+    with _lock:
+        if not _local:
+            return 0
+        batch, since = dict(_local), _local_since
+        _local.clear()
+        _local_since = None
+    try:
+        return _apply({k: v[0] for k, v in batch.items()}, {k: v[1] for k, v in batch.items()}, since)
+    except Exception:
+        logger.exception("usage: local flush failed; re-buffering %d key(s)", len(batch))
+        with _lock:
+            for k, (d, ts) in batch.items():
+                entry = _local.setdefault(k, [0, ts])
+                entry[0] += d
+                entry[1] = max(entry[1], ts)
+            _local_since = min(_local_since or since, since)
+        return 0
+
+
+def _run_local():
+    while True:
+        time.sleep(LOCAL_FLUSH_EVERY)
+        try:
+            _drain_local()
+        finally:
+            close_old_connections()
+
+
+def _ensure_flusher():
+    # started lazily so each forked worker gets its own thread (same as billing.requestlog)
+    global _flusher, _flusher_pid
+    if _flusher_pid == os.getpid() and _flusher.is_alive():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid() and _flusher.is_alive():
+            return
+        _flusher = threading.Thread(target=_run_local, name="usage-flusher", daemon=True)
+        _flusher_pid = os.getpid()
+        _flusher.start()
+
+
+atexit.register(_drain_local)
+
+
+def _apply(deltas: dict, last_seen: dict, since: float | None) -> int:
+    """Add deltas to used_requests and set last_used_at, BATCH_SIZE keys per UPDATE."""
+    ids = sorted(deltas)
+    with transaction.atomic():
+        for i in range(0, len(ids), BATCH_SIZE):
+            chunk = ids[i:i + BATCH_SIZE]
+            ApiKey.objects.filter(pk__in=chunk).update(
+                used_requests=F("used_requests") + Case(
+                    *[When(pk=k, then=Value(int(deltas[k]))) for k in chunk],
+                    default=Value(0), output_field=IntegerField(),
+                ),
+                last_used_at=Case(
+                    *[When(pk=k, then=Value(datetime.fromtimestamp(last_seen[k], dt_timezone.utc))) for k in chunk],
+                    default=F("last_used_at"),
+                ),
+            )
+    for i in range(0, len(ids), BATCH_SIZE):
+        dashboard.invalidate_keys(ids[i:i + BATCH_SIZE])   # trial usage shown on the dashboard moved
+    if since:
+        lag_ms = max(0.0, (time.time() - since) * 1000)
+        metrics.observe("usage.flush_lag", lag_ms)
+        metrics.gauge("usage.flush_lag_ms", int(lag_ms))
+    metrics.incr("usage.flushed_keys", len(ids))
+    return len(ids)
+
+
+def _parse(raw: dict):
+    deltas, last_seen, since = {}, {}, None
+    for field, value in raw.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        if field == "since":
+            since = float(value)
+        elif field.startswith("d:"):
+            deltas[int(field[2:])] = int(value)
+        elif field.startswith("t:"):
+            last_seen[int(field[2:])] = float(value)
+    now = time.time()
+    for k in deltas:
+        last_seen.setdefault(k, now)
+    return deltas, last_seen, since
+
+
+def _drain_one(client, key) -> int:
+    deltas, last_seen, since = _parse(client.hgetall(key))
+    written = _apply(deltas, last_seen, since) if deltas else 0
+    client.delete(key)
+    return written
+
+
+def flush() -> int:
+    """Write pending deltas to the DB; returns the number of keys updated."""
+    client = redis_conn.get_client()
+    if client is None:
+        return _drain_local()
+
+    # one flusher at a time, or a second one would "recover" the first one's live drain
+    lock = client.lock(FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_TTL, blocking_timeout=0)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        written = 0
+        # 1) leftovers from a flush that died after RENAME
+        for key in client.scan_iter(match=DRAINING_PREFIX + "*", count=100):
+            written += _drain_one(client, key)
+            logger.warning("usage: recovered orphaned drain %s", key)
+        # 2) the current pending hash
+        draining = f"{DRAINING_PREFIX}{uuid.uuid4().hex}"
+        try:
+            client.rename(PENDING_KEY, draining)
+        except Exception as e:
+            if "no such key" in str(e).lower():
+                metrics.gauge("usage.flush_lag_ms", 0)
+                return written
+            raise
+        return written + _drain_one(client, draining)
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
@@ -1,10 +1,11 @@
 # billing/utils.py
+import hmac
 import secrets
 import hashlib
 from typing import Optional
-from django.utils import timezone
 from django.contrib.auth import get_user_model
 from .models import ApiKey
+from . import keystate
 
 User = get_user_model()
 
@@ -67,15 +68,17 @@ def _persist_key(
         used_requests=0,
         last_used_at=None,
     )
+    keystate.created(row)   # warm the auth cache; the first request skips the DB
     return row
 
 
 def verify_token_in_db(token: str) -> Optional[ApiKey]:
     """
-    Verify incoming raw token when DB stores prefix + plaintext suffix.
+    Verify an incoming raw token with a single indexed lookup on key_hash.
     Returns the ApiKey row if valid & active, else None.
 
-    NOTE: We also backfill row.key_hash if missing to support the fast cache path.
+    Every row carries sha256(prefix + suffix) (see migration 0005 for older rows),
+    so there is no per-prefix scan and no plaintext comparison.
     """
     if not token:
         return None
@@ -83,39 +86,31 @@ def verify_token_in_db(token: str) -> Optional[ApiKey]:
     if len(token) < PREFIX_LEN:
         return None
 
-    prefix = token[:PREFIX_LEN]
+    return get_active_key_by_hash(_sha256_hex(token))
 
-    qs = (
+
+def get_active_key_by_hash(digest: str) -> Optional[ApiKey]:
+    """Active ApiKey row whose key_hash is `digest` (one unique-index lookup), else None."""
+    row = (
         ApiKey.objects
-        .filter(key_prefix=prefix, status="active", revoked_at__isnull=True)
-        .order_by("-created_at")
+        .filter(key_hash=digest, status="active", revoked_at__isnull=True)
+        .first()
     )
-
-    for row in qs:
-        expected = (row.key_prefix or "") + (row.plain_suffix or "")
-        if token == expected:
-            # Backfill key_hash if empty (older rows)
-            if not getattr(row, "key_hash", None):
-                row.key_hash = _sha256_hex(token)
-                row.save(update_fields=["key_hash"])
-            return row
-    return None
+    if row is None or not hmac.compare_digest(row.key_hash, digest):
+        return None
+    return row
 
 
 def revoke_all_keys(user: User):
     """Revoke all active keys for a user."""
-    ApiKey.objects.filter(
-        user=user, status="active", revoked_at__isnull=True
-    ).update(status="revoked", revoked_at=timezone.now())
+    keystate.revoke(ApiKey.objects.filter(user=user, status="active", revoked_at__isnull=True))
 
 
 def revoke_all_keys_by_customer(customer_id: str):
     """Revoke all active keys for a given Stripe customer id."""
     if not customer_id:
         return
-    ApiKey.objects.filter(
-        customer_id=customer_id, status="active", revoked_at__isnull=True
-    ).update(status="revoked", revoked_at=timezone.now())
+    keystate.revoke(ApiKey.objects.filter(customer_id=customer_id, status="active", revoked_at__isnull=True))
 
 
 # ----------------------------
@@ -144,9 +139,7 @@ def issue_api_key_for_user(*, user: User, plan="pro", tenant_id=None, customer_i
     Rotate to a PAID key (pro). Revokes any previously active keys for cleanliness.
     Returns the RAW token (show to the user once).
     """
-    ApiKey.objects.filter(
-        user=user, status="active", revoked_at__isnull=True
-    ).update(status="revoked", revoked_at=timezone.now())
+    keystate.revoke(ApiKey.objects.filter(user=user, status="active", revoked_at__isnull=True))
 
     plain, prefix, suffix = make_api_key()
     _persist_key(
@@ -182,7 +175,8 @@ def activate_paid_plan_for_user(
         )
 
     # Flip existing active keys to pro (keeps the same token)
-    ApiKey.objects.filter(user=user, status="active", revoked_at__isnull=True).update(
+    keystate.apply(
+        ApiKey.objects.filter(user=user, status="active", revoked_at__isnull=True),
         plan="pro",
         customer_id=customer_id or "",
         trial_quota=None,
@@ -224,7 +218,8 @@ def activate_paid_plan_for_customer(
         return plain
 
     # Flip existing keys to pro without rotating
-    ApiKey.objects.filter(customer_id=customer_id, status="active", revoked_at__isnull=True).update(
+    keystate.apply(
+        ApiKey.objects.filter(customer_id=customer_id, status="active", revoked_at__isnull=True),
         plan="pro",
         trial_quota=None,
     )
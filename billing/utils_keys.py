@@ -1,27 +1,26 @@
 # billing/utils_keys.py
 from .models import ApiKey
-from django.utils import timezone
+from .utils import _sha256_hex
+from . import keystate
 
 def _issue_key_for_user(make_api_key_func, user=None, customer_id=None, plan="pro"):
     # revoke old keys
     if customer_id:
-        ApiKey.objects.filter(customer_id=customer_id, status="active", revoked_at__isnull=True).update(
-            status="revoked", revoked_at=timezone.now()
-        )
+        keystate.revoke(ApiKey.objects.filter(customer_id=customer_id, status="active", revoked_at__isnull=True))
     elif user:
-        ApiKey.objects.filter(user=user, status="active", revoked_at__isnull=True).update(
-            status="revoked", revoked_at=timezone.now()
-        )
+        keystate.revoke(ApiKey.objects.filter(user=user, status="active", revoked_at__isnull=True))
 
     # create new key
-    plain, prefix, key_hash = make_api_key_func()
-    ApiKey.objects.create(
+    plain, prefix, suffix = make_api_key_func()
+    row = ApiKey.objects.create(
         user=user,
         key_prefix=prefix,
-        key_hash=key_hash,
+        plain_suffix=suffix,
+        key_hash=_sha256_hex(plain),
         tenant_id=str((user.id if user else customer_id or "anon")),
         plan=plan,
         status="active",
         customer_id=customer_id
     )
+    keystate.created(row)
     return plain
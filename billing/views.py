@@ -4,28 +4,28 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
 from django.conf import settings
 from django.utils import timezone
 
+import json
 import logging
 import stripe
 
 from .models import ApiKey  # and WebhookEvent if you decide to log events
-from .utils import verify_token_in_db
-from .utils import activate_paid_plan_for_user  # <-- use this to flip trial -> pro
+from . import signed
+from .authguard import LockedOut, client_ip, lookup
+from .utils import PREFIX_LEN
+from . import export, webhooks
+from .models import HourlyKeyUsage
+from .tasks import drain_webhooks
 
 logger = logging.getLogger(__name__)
 stripe.api_key = settings.STRIPE_SECRET_KEY
 User = get_user_model()
 
-# Event types on which we consider the subscription "active/paid"
-ACTIVE_EVENTS = {
-    "checkout.session.completed",
-    "invoice.paid",
-    "customer.subscription.updated",
-}
-
 # ---------- Public API ----------
 
 @api_view(["POST"])
@@ -35,21 +35,48 @@ def verify_key(request):
     POST: {"key":"<raw api key>"}
     200 -> {"ok": true, "plan": "...", "key_prefix": "..."}
     401 -> {"ok": false}
+    429 -> {"ok": false}  (too many invalid keys from this IP / for this prefix; see Retry-After)
     """
     raw = (request.data or {}).get("key", "")
     raw = (raw or "").strip()
 
-    row = verify_token_in_db(raw)
-    if not row:
+    try:
+        rec = lookup(raw, client_ip(request))   # same negative cache / lockout as /v1/
+    except LockedOut as e:
+        return Response({"ok": False}, status=429, headers={"Retry-After": str(e.retry_after)})
+    if not rec:
         return Response({"ok": False}, status=401)
 
     return Response({
         "ok": True,
-        "plan": row.plan,
-        "key_prefix": row.key_prefix,
+        "plan": rec["plan"],
+        "key_prefix": raw[:PREFIX_LEN],
     })
 
 
+@api_view(["POST"])
+@permission_classes([AllowAny])
+def signed_token(request):
+    """
+    Exchange a raw paid API key for a stateless signed token (see billing.signed).
+    POST: {"key":"<raw api key>"}
+    200 -> {"ok": true, "token": "cg_sig_...", "expires_in": <seconds>}
+    401 -> {"ok": false}
+    403 -> {"ok": false, "error": "..."}   (trial keys keep using the raw key)
+    """
+    raw = ((request.data or {}).get("key", "") or "").strip()
+    try:
+        rec = lookup(raw, client_ip(request))
+    except LockedOut as e:
+        return Response({"ok": False}, status=429, headers={"Retry-After": str(e.retry_after)})
+    if not rec:
+        return Response({"ok": False}, status=401)
+    row = ApiKey.objects.filter(pk=rec["id"]).first()
+    if not row or row.plan == "trial" or not row.is_active:
+        return Response({"ok": False, "error": "signed tokens are available for paid keys only"}, status=403)
+    return Response({"ok": True, "token": signed.mint(row), "expires_in": signed.TOKEN_MAX_AGE})
+
+
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def start_checkout(request):
@@ -100,17 +127,46 @@ def my_key(request):
     return Response({"ok": True, "key_prefix": row.key_prefix, "issued_at": row.created_at.isoformat()})
 
 
+@login_required
+@require_GET
+def usage_export(request):
+    """
+    Download hourly usage history as a streamed file.
+    GET ?fmt=csv|ndjson&since=YYYY-MM-DD&until=YYYY-MM-DD[&key=<id>]
+    Users get their own keys; staff may also pass tenant=<tenant_id> or any key id.
+    """
+    fmt = request.GET.get("fmt", "csv")
+    if fmt not in export.FORMATS:
+        return JsonResponse({"ok": False, "error": "fmt must be csv or ndjson"}, status=400)
+
+    qs = HourlyKeyUsage.objects.all()
+    tenant = request.GET.get("tenant")
+    if not request.user.is_staff:
+        qs = qs.filter(key_id__in=export.owned_key_ids(request.user))
+    elif tenant:
+        qs = qs.filter(tenant_id=tenant)
+    key = request.GET.get("key")
+    if key:
+        if not key.isdigit():
+            return JsonResponse({"ok": False, "error": "key must be a key id"}, status=400)
+        qs = qs.filter(key_id=int(key))
+    try:
+        qs = export.filtered(qs, request.GET.get("since"), request.GET.get("until"))
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+
+    logger.info("export: usage user_id=%s fmt=%s tenant=%s key=%s", request.user.id, fmt, tenant or "", key or "")
+    return export.response(request, qs, fmt, filename=f"usage-{timezone.now():%Y%m%d}")
+
+
 # ---------- Webhooks ----------
 
 @csrf_exempt
 def stripe_webhook(request):
     """
-    Verify Stripe signature and flip the user to a paid plan when appropriate.
-    We handle multiple events to be robust:
-      - checkout.session.completed
-      - invoice.paid
-      - customer.subscription.updated (only if status == 'active')
-    Always ACK quickly with 200 on success to avoid Stripe retries.
+    Verify the Stripe signature, store the event in the inbox and ACK.
+    Processing (user lookup, plan flip, key rotation) happens in billing.webhooks.drain
+    on a worker; Stripe retries of an event already in the inbox are ACKed as duplicates.
     """
     payload = request.body
     sig_header = request.META.get("HTTP_STRIPE_SIGNATURE", "")
@@ -123,39 +179,13 @@ def stripe_webhook(request):
         logger.warning("Stripe webhook verification failed: %s", e)
         return HttpResponse(status=400)
 
-    evt_type = event.get("type")
-    obj = (event.get("data") or {}).get("object") or {}
-
-    if evt_type in ACTIVE_EVENTS:
-        # For subscription.updated, check it's actually active
-        if evt_type == "customer.subscription.updated":
-            if (obj.get("status") or "").lower() != "active":
-                return HttpResponse(status=200)
-
-        customer_id = obj.get("customer")
-
-        # Try to find the user by customer_id (primary)
-        user = None
-        if customer_id:
-            user = User.objects.filter(stripe_customer_id=customer_id).first()
-
-        # Fallback: try by email if present on the object
-        if not user:
-            email = (obj.get("customer_details") or {}).get("email") \
-                    or obj.get("customer_email") \
-                    or obj.get("email")
-            if email:
-                user = User.objects.filter(email__iexact=email).first()
-
-        try:
-            if user:
-                # Flip to paid (rotate key to avoid keeping the trial token alive)
-                activate_paid_plan_for_user(user=user, customer_id=customer_id, rotate_key=True)
-                logger.info("Upgraded to paid: user_id=%s customer=%s evt=%s", user.id, customer_id, evt_type)
-            else:
-                logger.warning("Webhook: no mapped user for customer=%s (evt=%s)", customer_id, evt_type)
-        except Exception as e:
-            # Don't fail the webhook; log and ack to prevent retries loop
-            logger.exception("Webhook processing error: %s", e)
+    # 2) Inbox (unique event_id); a DB error here returns 500 so Stripe retries
+    if not webhooks.record(json.loads(payload)):
+        return HttpResponse(status=200)
 
+    # 3) Nudge a worker; beat drains anyway if the broker is unreachable
+    try:
+        drain_webhooks.delay()
+    except Exception:
+        logger.warning("Webhook: could not enqueue drain for %s; beat will pick it up", event.get("id"))
     return HttpResponse(status=200)
@@ -0,0 +1,178 @@
+# billing/webhooks.py
+"""
+Stripe webhook inbox: record fast, process later.
+
+`record(event)` inserts a WebhookEvent (unique event_id, so a Stripe retry is a no-op)
+and returns. `drain()` — Celery task billing.tasks.drain_webhooks, kicked by the view and
+by beat for retries — processes pending events in batches:
+
+- per customer, strictly in Stripe `created` order: a customer's next event waits until
+  the previous one is done (or dead-lettered), so e.g. a cancel can't overtake the
+  payment before it;
+- a claimed event is `processing` (stale claims older than CLAIM_TIMEOUT are retaken);
+- failures retry with exponential backoff; after MAX_ATTEMPTS the event is `failed`
+  and stays in the table (admin) instead of blocking the customer forever.
+"""
+import logging
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from core import metrics
+from .models import WebhookEvent
+from .utils import activate_paid_plan_for_user
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE    = 100
+MAX_ATTEMPTS  = 8
+BACKOFF_BASE  = 30          # seconds; doubles per attempt
+BACKOFF_MAX   = 3600
+CLAIM_TIMEOUT = timedelta(minutes=5)
+MAX_PAGES     = 20          # due events scanned per drain: MAX_PAGES * batch_size
+
+# Event types on which we consider the subscription "active/paid"
+ACTIVE_EVENTS = {
+    "checkout.session.completed",
+    "invoice.paid",
+    "customer.subscription.updated",
+}
+
+
+def record(event) -> bool:
+    """Store a verified Stripe event. Returns False if it was already in the inbox."""
+    obj = (event.get("data") or {}).get("object") or {}
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(
+                event_id=event["id"],
+                kind=(event.get("type") or "")[:64],
+                customer_id=str(obj.get("customer") or "")[:128],
+                created=int(event.get("created") or 0),
+                payload=event,
+            )
+    except IntegrityError:
+        metrics.incr("webhook.duplicate")
+        return False
+    metrics.incr("webhook.received")
+    return True
+
+
+def handle_event(event):
+    """Apply one Stripe event (raises to trigger a retry)."""
+    evt_type = event.get("type")
+    if evt_type not in ACTIVE_EVENTS:
+        return
+    obj = (event.get("data") or {}).get("object") or {}
+    # For subscription.updated, check it's actually active
+    if evt_type == "customer.subscription.updated" and (obj.get("status") or "").lower() != "active":
+        return
+
+    User = get_user_model()
+    customer_id = obj.get("customer")
+    user = None
+    if customer_id:
+        user = User.objects.filter(stripe_customer_id=customer_id).first()
+    # Fallback: try by email if present on the object
+    if not user:
+        email = (obj.get("customer_details") or {}).get("email") or obj.get("customer_email") or obj.get("email")
+        if email:
+            user = User.objects.filter(email__iexact=email).first()
+
+    if not user:
+        logger.warning("Webhook: no mapped user for customer=%s (evt=%s)", customer_id, evt_type)
+        return
+    # Flip to paid (rotate key to avoid keeping the trial token alive)
+    activate_paid_plan_for_user(user=user, customer_id=customer_id, rotate_key=True)
+    logger.info("Upgraded to paid: user_id=%s customer=%s evt=%s", user.id, customer_id, evt_type)
+
+
+def _claim(evt, now) -> bool:
+    return bool(
+        WebhookEvent.objects
+        .filter(pk=evt.pk)
+        .filter(Q(status="pending") | Q(status="processing", locked_at__lt=now - CLAIM_TIMEOUT))
+        .update(status="processing", locked_at=now)
+    )
+
+
+def _process(evt) -> bool:
+    try:
+        handle_event(evt.payload)
+    except Exception as e:
+        attempts = evt.attempts + 1
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+        status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+        WebhookEvent.objects.filter(pk=evt.pk).update(
+            status=status, attempts=attempts, locked_at=None, last_error=repr(e)[:2000],
+            next_attempt_at=timezone.now() + timedelta(seconds=delay),
+        )
+        metrics.incr(f"webhook.{'dead' if status == 'failed' else 'retry'}")
+        logger.warning("webhook: %s %s failed (attempt %d/%d): %s",
+                       evt.kind, evt.event_id, attempts, MAX_ATTEMPTS, e)
+        return status == "failed"   # a dead-lettered event no longer blocks the customer
+    WebhookEvent.objects.filter(pk=evt.pk).update(
+        status="done", attempts=evt.attempts + 1, locked_at=None, processed_at=timezone.now(), last_error="",
+    )
+    metrics.incr("webhook.processed")
+    return True
+
+
+def _claimable(now):
+    return Q(status="pending") | Q(status="processing", locked_at__lt=now - CLAIM_TIMEOUT)
+
+
+def _blockers(customers, now) -> dict:
+    """customer -> (created, id) of its earliest open event that is backing off or in flight."""
+    rows = (WebhookEvent.objects
+            .filter(customer_id__in=customers, status__in=("pending", "processing"))
+            .filter(Q(next_attempt_at__gt=now) | Q(status="processing", locked_at__gte=now - CLAIM_TIMEOUT))
+            .values_list("customer_id", "created", "id"))
+    first = {}
+    for cust, created, pk in rows:
+        if cust not in first or (created, pk) < first[cust]:
+            first[cust] = (created, pk)
+    return first
+
+
+def drain(batch_size: int = BATCH_SIZE) -> int:
+    """Process due events; returns how many were handled (done or dead-lettered)."""
+    now = timezone.now()
+    oldest = (WebhookEvent.objects.filter(status__in=("pending", "processing"))
+              .aggregate(m=Min("received_at"))["m"]) or now
+    metrics.gauge("webhook.lag_ms", int((now - oldest).total_seconds() * 1000))
+
+    # Only due, claimable events are read (keyset pages in `created` order), so events
+    # backing off for hours can't crowd newer ones for other customers out of the window.
+    blocked, handled, after = set(), 0, None
+    for _ in range(MAX_PAGES):
+        if handled >= batch_size:
+            break
+        page = WebhookEvent.objects.filter(_claimable(now), next_attempt_at__lte=now)
+        if after:
+            page = page.filter(Q(created__gt=after[0]) | Q(created=after[0], id__gt=after[1]))
+        page = list(page.order_by("created", "id")
+                    .only("id", "event_id", "kind", "customer_id", "created", "payload", "status",
+                          "attempts", "next_attempt_at", "locked_at")[:batch_size])
+        if not page:
+            break
+        after = (page[-1].created, page[-1].id)
+        first_blocker = _blockers({e.customer_id for e in page if e.customer_id}, now)
+        for evt in page:
+            if handled >= batch_size:
+                break
+            chain = evt.customer_id or f"evt:{evt.event_id}"   # no customer -> no ordering constraint
+            if chain in blocked:
+                continue
+            earlier = first_blocker.get(evt.customer_id)
+            if (earlier and earlier < (evt.created, evt.id)) or not _claim(evt, now):
+                blocked.add(chain)      # earlier event still in flight / backing off: keep order
+                continue
+            if _process(evt):
+                handled += 1
+            else:
+                blocked.add(chain)
+    return handled
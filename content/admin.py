@@ -1,3 +1,13 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ProviderKey
+
+
+@admin.register(ProviderKey)
+class ProviderKeyAdmin(admin.ModelAdmin):
+    """Tenant provider keys. The encrypted secret is never shown."""
+    list_display = ("id", "tenant_id", "site", "provider", "fingerprint", "created_at")
+    list_filter = ("provider",)
+    search_fields = ("tenant_id", "site", "fingerprint")
+    exclude = ("secret",)
+    readonly_fields = ("tenant_id", "site", "provider", "fingerprint", "created_at")
@@ -0,0 +1,145 @@
+# content/admission.py
+"""
+Admission control for the AI endpoints.
+
+Each worker publishes its load (in-flight AI requests, queued/running provider calls,
+smoothed call duration) to the shared cache under its own key with a TTL, plus a small
+registry of live workers. The middleware sums the fleet's load (re-read at most every
+FLEET_REFRESH seconds) and rejects new AI requests with 503 + Retry-After once past the
+thresholds, before auth or body parsing, so gunicorn workers stay free for /billing/*,
+the dashboard and everything else.
+"""
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID      = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+REGISTRY_KEY   = "admission:workers"
+FLEET_REFRESH  = 0.5     # seconds between fleet-load reads per worker
+PUBLISH_EVERY  = 0.5
+
+def _worker_key(wid): return f"admission:w:{wid}"
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class _LocalLoad:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.published = 0.0
+        self.fleet = None
+        self.fleet_at = 0.0
+
+local = _LocalLoad()
+
+
+def _ttl() -> int:
+    # long enough to outlive the slowest request, short enough that a dead worker's load expires
+    return int(_setting("GEN_MAX_DEADLINE_MS", 120000) / 1000) + 30
+
+
+def _executor_load():
+    from .services import LLM_POOL
+    queued, running = LLM_POOL.load()
+    return queued, running, LLM_POOL.ewma_call_s, LLM_POOL.workers
+
+
+def publish(force=False):
+    now = time.monotonic()
+    if not force and now - local.published < PUBLISH_EVERY:
+        return
+    local.published = now
+    queued, running, ewma, slots = _executor_load()
+    state = {"inflight": local.inflight, "queued": queued, "running": running, "ewma": ewma, "slots": slots}
+    try:
+        cache.set(_worker_key(WORKER_ID), state, _ttl())
+        reg = cache.get(REGISTRY_KEY) or {}
+        wall = time.time()
+        if WORKER_ID not in reg or reg[WORKER_ID] < wall:
+            reg = {w: exp for w, exp in reg.items() if exp > wall}
+            reg[WORKER_ID] = wall + _ttl()
+            cache.set(REGISTRY_KEY, reg, _ttl() * 2)
+    except Exception:
+        logger.debug("admission: publish failed", exc_info=True)
+
+
+def fleet_load() -> dict:
+    now = time.monotonic()
+    if local.fleet is not None and now - local.fleet_at < FLEET_REFRESH:
+        return local.fleet
+    total = {"inflight": 0, "queued": 0, "running": 0, "slots": 0, "ewma": 0.0, "workers": 0}
+    try:
+        reg = cache.get(REGISTRY_KEY) or {}
+        states = cache.get_many([_worker_key(w) for w in reg]).values()
+    except Exception:
+        states = []
+    for st in states:
+        for k in ("inflight", "queued", "running", "slots"):
+            total[k] += int(st.get(k) or 0)
+        total["ewma"] = max(total["ewma"], float(st.get("ewma") or 0))
+        total["workers"] += 1
+    local.fleet, local.fleet_at = total, now
+    return total
+
+
+def retry_after(load) -> int:
+    """Seconds until the current backlog should have drained at the observed call rate."""
+    slots = max(1, load["slots"])
+    backlog = load["queued"] + load["running"]
+    secs = backlog * max(load["ewma"], 0.5) / slots
+    return int(min(max(1, math.ceil(secs)), _setting("ADMISSION_MAX_RETRY_AFTER", 60)))
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = tuple(_setting("ADMISSION_PATHS", ("/v1/generate/content", "/v1/blog/preview")))
+
+    def __call__(self, request):
+        if request.method != "POST" or not request.path.startswith(self.paths):
+            return self.get_response(request)
+
+        reason = self._overloaded()
+        if reason:
+            load = fleet_load()
+            wait = retry_after(load)
+            metrics.incr("admission.rejected")
+            logger.warning("admission: shed path=%s reason=%s fleet=%s retry_after=%s",
+                           request.path, reason, load, wait)
+            resp = JsonResponse({"detail": "AI service is busy. Please retry shortly."}, status=503)
+            resp["Retry-After"] = str(wait)
+            return resp
+
+        with local.lock:
+            local.inflight += 1
+        publish(force=True)
+        metrics.incr("admission.admitted")
+        try:
+            return self.get_response(request)
+        finally:
+            with local.lock:
+                local.inflight -= 1
+            publish(force=True)
+
+    def _overloaded(self):
+        if local.inflight >= _setting("ADMISSION_WORKER_MAX_INFLIGHT", 16):
+            return "worker_inflight"
+        load = fleet_load()
+        if load["inflight"] >= _setting("ADMISSION_MAX_INFLIGHT", 64):
+            return "fleet_inflight"
+        if load["queued"] >= _setting("ADMISSION_MAX_QUEUED_CALLS", 400):
+            return "fleet_queued_calls"
+        return None
@@ -0,0 +1,62 @@
+# content/context.py
+import math
+import threading
+import time
+
+from .scheduler import lane_for_plan
+
+
+class GenContext:
+    """
+    Per-request state shared by every provider call made while serving one API request.
+    services.py adds token usage into it; the views report it when the request ends.
+    """
+
+    def __init__(self, cid: str = "", site: str = "", deadline_ms: int | None = None, cancel_event=None,
+                 plan: str = "", tenant: str = ""):
+        self.cid = cid
+        self.site = site
+        self.plan = plan
+        self.tenant = str(tenant or "")   # fair-queuing key (tenant_id from ApiKeyAuthentication)
+        self.lane = lane_for_plan(plan)   # scheduler lane for this request's provider calls
+        # threading.Event set when the client disconnects (ASGI only; None under WSGI)
+        self.cancel_event = cancel_event
+        # monotonic instant by which every provider call must have returned (None = no deadline)
+        self.deadline = time.monotonic() + deadline_ms / 1000.0 if deadline_ms else None
+        self._lock = threading.Lock()
+        self.usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        self.routes = {}   # route name -> [calls, total_ms]
+
+    def add_usage(self, prompt_tokens=0, cached_tokens=0, completion_tokens=0):
+        with self._lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += int(prompt_tokens or 0)
+            self.usage["cached_tokens"] += int(cached_tokens or 0)
+            self.usage["completion_tokens"] += int(completion_tokens or 0)
+
+    def add_route(self, route, ms):
+        with self._lock:
+            r = self.routes.setdefault(route, [0, 0.0])
+            r[0] += 1
+            r[1] += ms
+
+    @property
+    def cached_ratio(self) -> float:
+        p = self.usage["prompt_tokens"]
+        return round(self.usage["cached_tokens"] / p, 4) if p else 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def remaining(self) -> float:
+        """Seconds left until the deadline (inf when there is none)."""
+        return math.inf if self.deadline is None else self.deadline - time.monotonic()
+
+    def call_timeout(self, cap: float, floor: float = 1.0) -> float:
+        """
+        Timeout for the next provider call: the time left, capped at `cap`.
+        Returns 0 when less than `floor` seconds remain (not worth starting a call).
+        """
+        left = self.remaining()
+        return 0.0 if left < floor else min(cap, left)
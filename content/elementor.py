@@ -0,0 +1,141 @@
+# content/elementor.py
+"""
+Elementor JSON helpers: find the rewritable fields once, then write rewrites back
+into as many copies of the tree as needed (one per locale).
+"""
+import copy
+import re
+from typing import NamedTuple
+
+# ------- Allowed widgets/fields (mirror of the PHP plugin) -------
+ALLOWED = {
+    "heading": [
+        {"key": "title", "html": False, "shape": "string", "purpose": "headline"},
+    ],
+    "text-editor": [
+        {"key": "editor", "html": True, "shape": "string", "purpose": "html"},
+    ],
+    "button": [
+        {"key": "text", "html": False, "shape": "string", "purpose": "label"},
+    ],
+    "icon-box": [
+        {"key": "title_text", "html": False, "shape": "string", "purpose": "headline"},
+        {"key": "description_text", "html": True, "shape": "string", "purpose": "paragraph"},
+    ],
+    "image-box": [
+        {"key": "title_text", "html": False, "shape": "string", "purpose": "headline"},
+        {"key": "description_text", "html": True, "shape": "string", "purpose": "paragraph"},
+    ],
+    "testimonial": [
+        {"key": "testimonial_content", "html": True, "shape": "string", "purpose": "paragraph"},
+        {"key": "testimonial_name", "html": False, "shape": "string", "purpose": "label"},
+        {"key": "testimonial_job", "html": False, "shape": "string", "purpose": "label"},
+    ],
+    "alert": [
+        {"key": "alert_title", "html": False, "shape": "string", "purpose": "headline"},
+        {"key": "alert_description", "html": True, "shape": "string", "purpose": "paragraph"},
+    ],
+    "html": [
+        {"key": "html", "html": True, "shape": "string", "purpose": "html"},
+    ],
+    # Repeaters
+    "accordion": [
+        {"key": "tabs[].tab_title", "html": False, "shape": "string_or_raw", "purpose": "headline"},
+        {"key": "tabs[].tab_content", "html": True, "shape": "string", "purpose": "html"},
+    ],
+    "nested-accordion": [
+        {"key": "items[].item_title", "html": False, "shape": "string_or_raw", "purpose": "headline"},
+    ],
+    "icon-list": [
+        {"key": "icon_list[].text", "html": False, "shape": "string_or_raw", "purpose": "label"},
+    ],
+}
+
+repeater_re = re.compile(r"^([a-z0-9_]+)\[\]\.([a-z0-9_]+)$", re.I)
+
+
+class Field(NamedTuple):
+    path: tuple      # steps from the root list down to the value, e.g. (0, "elements", 2, "settings", "title")
+    el_id: str       # Elementor element id (may be "")
+    widget: str
+    key: str         # rule key, e.g. "tabs[].tab_title"
+    is_html: bool
+    purpose: str
+    raw: bool        # original value was Elementor's {"raw": "..."} shape
+    text: str
+
+    @property
+    def where(self) -> str:
+        return "/".join(str(p) for p in self.path)
+
+
+def _text_of(val, shape):
+    """Preserve Elementor's {'raw': '...'} when present."""
+    if shape == "string_or_raw" and isinstance(val, dict):
+        return str(val.get("raw") or "")
+    return str(val or "")
+
+
+def extract_fields(elements, path=()) -> list:
+    """Walk the tree once and return every non-empty rewritable Field, in document order."""
+    out = []
+    if not isinstance(elements, list):
+        return out
+    for i, el in enumerate(elements):
+        if not isinstance(el, dict):
+            continue
+        here = path + (i,)
+        settings = el.get("settings")
+        if el.get("elType") == "widget" and isinstance(settings, dict):
+            widget = el.get("widgetType") or ""
+            el_id  = str(el.get("id") or "")
+            for rule in ALLOWED.get(widget) or []:
+                key, shape = rule.get("key") or "", rule.get("shape") or "string"
+                is_html, purpose = bool(rule.get("html")), rule.get("purpose") or ""
+                m = repeater_re.match(key)
+                if m:
+                    rep_key, item_key = m.group(1), m.group(2)
+                    rep_list = settings.get(rep_key)
+                    if not isinstance(rep_list, list):
+                        continue
+                    for idx, item in enumerate(rep_list):
+                        if not isinstance(item, dict) or item_key not in item:
+                            continue
+                        val  = item[item_key]
+                        text = _text_of(val, shape)
+                        if text:
+                            out.append(Field(here + ("settings", rep_key, idx, item_key), el_id, widget, key,
+                                             is_html, purpose, shape == "string_or_raw" and isinstance(val, dict), text))
+                    continue
+                if key in settings:
+                    val  = settings[key]
+                    text = _text_of(val, shape)
+                    if text:
+                        out.append(Field(here + ("settings", key), el_id, widget, key,
+                                         is_html, purpose, shape == "string_or_raw" and isinstance(val, dict), text))
+        if isinstance(el.get("elements"), list):
+            out.extend(extract_fields(el["elements"], here + ("elements",)))
+    return out
+
+
+def apply_rewrites(elements, fields, rewrites):
+    """
+    Return a deep copy of `elements` with rewrites[i] written into fields[i]
+    (missing/None entries keep the original value), preserving raw-shape.
+    """
+    tree = copy.deepcopy(elements)
+    for i, f in enumerate(fields):
+        new = rewrites.get(i) if isinstance(rewrites, dict) else rewrites[i]
+        if new is None:
+            continue
+        node = tree
+        for step in f.path[:-1]:
+            node = node[step]
+        last = f.path[-1]
+        if f.raw:
+            if not isinstance(node.get(last), dict):
+                node[last] = {}
+            node[last]["raw"] = new
+        else:
+            node[last] = new
+    return tree
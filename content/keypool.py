@@ -0,0 +1,168 @@
+# content/keypool.py
+"""
+Per-site provider key pools.
+
+Large tenants send several OpenAI/Gemini keys to get past per-key rate limits. Each call
+leases the key with the most headroom: remaining requests/tokens from the provider's
+rate-limit headers (OpenAI sends x-ratelimit-*; Gemini sends none, so in-flight counts
+decide), minus what this worker already has in flight on it. Keys answering 429 cool
+down locally until their reset; keys failing auth are quarantined fleet-wide (shared
+cache) for QUARANTINE_S so no worker keeps burning requests on a revoked key.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_POOL_SIZE     = 16
+QUARANTINE_S      = 300
+DEFAULT_COOLDOWN  = 10.0
+UNKNOWN_HEADROOM  = 1000   # assumed remaining requests for keys we have no headers for yet
+QUARANTINE_CHECK  = 5.0    # seconds a local copy of the quarantine flags is trusted
+
+
+def fingerprint(key: str) -> str:
+    return hashlib.sha256((key or "").encode("utf-8")).hexdigest()[:16]
+
+def _q_key(fp): return f"keypool:quarantine:{fp}"
+
+
+class _KeyState:
+    __slots__ = ("inflight", "remaining", "reset_at", "cooldown_until", "quarantined", "checked_at")
+
+    def __init__(self):
+        self.inflight = 0
+        self.remaining = None       # remaining requests in the current window (None = unknown)
+        self.reset_at = 0.0         # monotonic time the window resets
+        self.cooldown_until = 0.0
+        self.quarantined = False
+        self.checked_at = 0.0
+
+
+_states = {}    # fingerprint -> _KeyState (process-local)
+_lock = threading.Lock()
+
+
+def _state(fp) -> _KeyState:
+    st = _states.get(fp)
+    if st is None:
+        st = _states[fp] = _KeyState()
+    return st
+
+
+def _refresh_quarantine(fps, now):
+    stale = [fp for fp in fps if now - _state(fp).checked_at > QUARANTINE_CHECK]
+    if not stale:
+        return
+    try:
+        flagged = cache.get_many([_q_key(fp) for fp in stale])
+    except Exception:
+        flagged = {}
+    for fp in stale:
+        st = _state(fp)
+        st.quarantined = _q_key(fp) in flagged
+        st.checked_at = now
+
+
+def _headroom(st, now) -> float:
+    remaining = st.remaining
+    if remaining is None or now >= st.reset_at:
+        remaining = UNKNOWN_HEADROOM
+    return remaining - st.inflight
+
+
+def split_keys(value):
+    """Accept a single key, a comma/whitespace separated string, or a list."""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v or "").strip()]
+    return [k for k in re.split(r"[\s,]+", str(value)) if k]
+
+
+@contextmanager
+def lease(keys):
+    """Pick the key with the most headroom and count it as in flight while the block runs."""
+    if not keys:
+        raise ValueError("no provider keys configured")
+    now = time.monotonic()
+    fps = {fingerprint(k): k for k in keys}
+    with _lock:
+        _refresh_quarantine(list(fps), now)
+        usable = [fp for fp in fps if not _state(fp).quarantined and _state(fp).cooldown_until <= now]
+        if not usable:
+            # everything is cooling down/quarantined: fall back to the least-bad key
+            usable = [fp for fp in fps if not _state(fp).quarantined] or list(fps)
+            metrics.incr("keypool.exhausted")
+        fp = max(usable, key=lambda f: (_headroom(_state(f), now), -_state(f).inflight))
+        _state(fp).inflight += 1
+    try:
+        yield fps[fp]
+    finally:
+        with _lock:
+            _state(fp).inflight -= 1
+
+
+def observe_headers(key, headers):
+    """Fold OpenAI-style x-ratelimit-* response headers into the key's headroom."""
+    try:
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is None:
+            return
+        reset = _parse_duration(headers.get("x-ratelimit-reset-requests") or "")
+        with _lock:
+            st = _state(fingerprint(key))
+            st.remaining = int(remaining)
+            st.reset_at = time.monotonic() + reset
+    except Exception:
+        logger.debug("keypool: could not parse rate-limit headers", exc_info=True)
+
+
+def on_error(key, exc) -> bool:
+    """
+    Classify a provider error for the key that produced it.
+    Returns True when the key was taken out of rotation (caller may retry with another).
+    """
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    msg = str(exc)
+    fp = fingerprint(key)
+    if status in (401, 403) or "API key not valid" in msg or "API_KEY_INVALID" in msg:
+        try:
+            cache.set(_q_key(fp), 1, QUARANTINE_S)
+        except Exception:
+            pass
+        with _lock:
+            st = _state(fp)
+            st.quarantined, st.checked_at = True, time.monotonic()
+        metrics.incr("keypool.quarantined")
+        logger.warning("keypool: quarantined key fp=%s for %ss (auth error)", fp, QUARANTINE_S)
+        return True
+    if status == 429:
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        try:
+            wait = float(headers.get("retry-after") or DEFAULT_COOLDOWN)
+        except (TypeError, ValueError):
+            wait = DEFAULT_COOLDOWN
+        with _lock:
+            st = _state(fp)
+            st.cooldown_until = time.monotonic() + wait
+            st.remaining = 0
+        metrics.incr("keypool.rate_limited")
+        return True
+    return False
+
+
+_dur_re = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+
+def _parse_duration(s) -> float:
+    """'1m30s' / '250ms' / '6s' -> seconds."""
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(n) * scale[u] for n, u in _dur_re.findall(s or "")) or 1.0
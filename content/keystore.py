@@ -0,0 +1,150 @@
+# content/keystore.py
+"""
+Durable tenant provider-key store (replaces the per-process TENANT_KEYS dict).
+
+- Keys live in ProviderKey rows, Fernet-encrypted with PROVIDER_KEY_SECRET (falls back
+  to a key derived from SECRET_KEY).
+- Pools are scoped to (tenant_id, site): the tenant comes from the authenticated API key,
+  the site from the request, so one caller can never read, add to or evict another
+  tenant's keys for the same site.
+- Reads go through an in-process copy per scope, validated against a version stamp in the
+  shared cache at most every CHECK_EVERY seconds; a stamp change (any worker/node wrote)
+  or LOCAL_TTL expiry reloads from the DB.
+- The keys a client sends for a provider ARE its pool: when they differ from what is
+  stored, missing keys are inserted and the ones no longer sent are deleted (rotation).
+  Re-sending the same keys on every request costs no DB write and no cache write.
+"""
+import base64
+import hashlib
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .keypool import MAX_POOL_SIZE, fingerprint
+from .models import ProviderKey
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS     = ("openai", "gemini")
+CHECK_EVERY   = 5.0     # seconds a local copy is trusted without looking at the version stamp
+LOCAL_TTL     = 300.0   # reload from DB at least this often, even if the stamp is unchanged
+
+_local = {}             # (tenant, site) -> {"pools", "fps", "version", "checked", "loaded"}
+_lock = threading.Lock()
+_fernet = None
+
+
+def _ver_key(scope): return f"keystore:ver:{scope[0]}:{scope[1]}"
+
+
+def _cipher():
+    global _fernet
+    if _fernet is None:
+        from cryptography.fernet import Fernet
+        secret = getattr(settings, "PROVIDER_KEY_SECRET", "") or settings.SECRET_KEY
+        _fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode("utf-8")).digest()))
+    return _fernet
+
+
+def encrypt(value: str) -> str:
+    return _cipher().encrypt(value.encode("utf-8")).decode("ascii")
+
+
+def decrypt(token: str) -> str:
+    return _cipher().decrypt(token.encode("ascii")).decode("utf-8")
+
+
+def _shared_version(scope):
+    try:
+        ver = cache.get(_ver_key(scope))
+        if ver is None:
+            # cache was flushed/evicted: (re)stamp so every worker converges on one value
+            cache.add(_ver_key(scope), uuid.uuid4().hex, None)
+            ver = cache.get(_ver_key(scope))
+        return ver
+    except Exception:
+        return None
+
+
+def _load(scope, version):
+    tenant, site = scope
+    pools, fps = {p: [] for p in PROVIDERS}, {p: set() for p in PROVIDERS}
+    for row in ProviderKey.objects.filter(tenant_id=tenant, site=site).order_by("id"):
+        try:
+            key = decrypt(row.secret)
+        except Exception:
+            logger.error("keystore: cannot decrypt key id=%s site=%s (secret rotated?)", row.id, site)
+            continue
+        pools[row.provider].append(key)
+        fps[row.provider].add(row.fingerprint)
+    now = time.monotonic()
+    entry = {"pools": pools, "fps": fps, "version": version, "checked": now, "loaded": now}
+    with _lock:
+        _local[scope] = entry
+    return entry
+
+
+def _entry(scope):
+    now = time.monotonic()
+    with _lock:
+        entry = _local.get(scope)
+    if entry and now - entry["checked"] < CHECK_EVERY:
+        return entry
+    version = _shared_version(scope)
+    if entry and version is not None and version == entry["version"] and now - entry["loaded"] < LOCAL_TTL:
+        entry["checked"] = now
+        return entry
+    return _load(scope, version)
+
+
+def get_pools(tenant, site) -> dict:
+    """{"openai": [keys], "gemini": [keys]} for a tenant's normalized site ("" -> empty pools)."""
+    if not tenant or not site:
+        return {p: [] for p in PROVIDERS}
+    return _entry((str(tenant), site))["pools"]
+
+
+def set_keys(tenant, site, keys_by_provider: dict) -> bool:
+    """
+    Make each given provider's pool for (tenant, site) exactly these keys (first
+    MAX_POOL_SIZE); providers with no keys are left alone. Returns True if anything was
+    written. Re-sending the stored keys is a pure in-memory check.
+    """
+    if not tenant or not site:
+        return False
+    scope = (str(tenant), site)
+    entry = _entry(scope)
+    new_rows, stale = [], {}
+    for provider, keys in keys_by_provider.items():
+        wanted = {}
+        for key in keys:
+            if len(wanted) >= MAX_POOL_SIZE:
+                break
+            wanted.setdefault(fingerprint(key), key)
+        if not wanted or set(wanted) == entry["fps"][provider]:
+            continue
+        new_rows += [ProviderKey(tenant_id=scope[0], site=site, provider=provider, fingerprint=fp, secret=encrypt(k))
+                     for fp, k in wanted.items() if fp not in entry["fps"][provider]]
+        stale[provider] = set(wanted)
+    if not stale:
+        return False
+
+    with transaction.atomic():
+        ProviderKey.objects.bulk_create(new_rows, ignore_conflicts=True)
+        removed = sum(
+            ProviderKey.objects.filter(tenant_id=scope[0], site=site, provider=provider)
+            .exclude(fingerprint__in=keep).delete()[0]
+            for provider, keep in stale.items()
+        )
+    try:
+        cache.set(_ver_key(scope), uuid.uuid4().hex, None)
+    except Exception:
+        logger.warning("keystore: could not bump version stamp site=%s", site, exc_info=True)
+    _load(scope, _shared_version(scope))
+    logger.info("keystore: tenant=%s site=%s stored %d new key(s), removed %d", scope[0], site, len(new_rows), removed)
+    return True
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProviderKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('site', models.CharField(max_length=255)),
+                ('provider', models.CharField(choices=[('openai', 'openai'), ('gemini', 'gemini')], max_length=16)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('secret', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['site', 'provider'], name='provider_key_site_idx')],
+                'constraints': [models.UniqueConstraint(fields=('site', 'provider', 'fingerprint'), name='uniq_provider_key_per_site')],
+            },
+        ),
+    ]
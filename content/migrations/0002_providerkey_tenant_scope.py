@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-20 09:00
+
+from django.db import migrations, models
+
+
+def drop_unscoped_keys(apps, schema_editor):
+    # Pre-existing rows can't be attributed to a tenant; clients re-send their keys on
+    # every request, so each tenant's pool is rebuilt on its next call.
+    apps.get_model("content", "ProviderKey").objects.filter(tenant_id="").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='providerkey',
+            name='uniq_provider_key_per_site',
+        ),
+        migrations.RemoveIndex(
+            model_name='providerkey',
+            name='provider_key_site_idx',
+        ),
+        migrations.AddField(
+            model_name='providerkey',
+            name='tenant_id',
+            field=models.CharField(default='', max_length=128),
+        ),
+        migrations.AddConstraint(
+            model_name='providerkey',
+            constraint=models.UniqueConstraint(fields=('tenant_id', 'site', 'provider', 'fingerprint'), name='uniq_provider_key_per_tenant_site'),
+        ),
+        migrations.AddIndex(
+            model_name='providerkey',
+            index=models.Index(fields=['tenant_id', 'site', 'provider'], name='provider_key_scope_idx'),
+        ),
+        migrations.RunPython(drop_unscoped_keys, migrations.RunPython.noop),
+    ]
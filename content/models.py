@@ -1,3 +1,35 @@
 from django.db import models
 
-# Create your models here.
+
+class ProviderKey(models.Model):
+    """
+    A tenant's own OpenAI/Gemini key, one row per key in its (tenant, site) pool.
+
+    - secret is Fernet-encrypted (see content.keystore); never store plaintext.
+    - fingerprint (sha256 prefix of the plaintext) dedupes without decrypting.
+    """
+
+    PROVIDER_CHOICES = (
+        ("openai", "openai"),
+        ("gemini", "gemini"),
+    )
+
+    tenant_id = models.CharField(max_length=128, default="")   # ApiKey.tenant_id of the owner
+    site = models.CharField(max_length=255)
+    provider = models.CharField(max_length=16, choices=PROVIDER_CHOICES)
+    fingerprint = models.CharField(max_length=64)
+    secret = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+        constraints = [
+            models.UniqueConstraint(fields=["tenant_id", "site", "provider", "fingerprint"],
+                                    name="uniq_provider_key_per_tenant_site"),
+        ]
+        indexes = [
+            models.Index(fields=["tenant_id", "site", "provider"], name="provider_key_scope_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.tenant_id}/{self.site} {self.provider} {self.fingerprint[:8]}"
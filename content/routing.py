@@ -0,0 +1,88 @@
+# content/routing.py
+"""
+Opt-in latency-aware model routing (options.routing = "latency").
+
+Short TEXT fields (headline/label purposes from the widget rules) go to the fastest of a
+provider's "fast tier" models; long or HTML fields keep the requested model. "Fastest"
+is decided from EWMA latency and error rate per model, shared across workers through the
+cache (read-modify-write; last writer wins, which is fine for a smoothed average) and
+mirrored locally for STATS_REFRESH seconds so routing itself costs no cache round trip.
+"""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAST_MODELS = {
+    "openai": ["gpt-4o-mini", "gpt-4.1-mini"],
+    "gemini": ["gemini-1.5-flash"],
+}
+SHORT_PURPOSES = {"headline", "label"}
+ALPHA          = 0.2     # EWMA weight of the newest sample
+STATS_TTL      = 24 * 3600
+STATS_REFRESH  = 2.0
+EXPLORE        = 0.05    # share of routed calls sent to a random candidate to keep stats fresh
+ERROR_PENALTY  = 5.0     # score = latency * (1 + penalty * error_rate)
+
+_local = {}              # model -> (stats, fetched_at)
+_lock  = threading.Lock()
+
+def _stats_key(model): return f"route:stats:{model}"
+
+def model_stats(model) -> dict:
+    now = time.monotonic()
+    with _lock:
+        hit = _local.get(model)
+        if hit and now - hit[1] < STATS_REFRESH:
+            return hit[0]
+    try:
+        st = cache.get(_stats_key(model)) or {}
+    except Exception:
+        st = {}
+    with _lock:
+        _local[model] = (st, now)
+    return st
+
+def record(model, ms, ok=True):
+    """Fold one call's latency/outcome into the model's shared EWMA stats."""
+    try:
+        st = dict(cache.get(_stats_key(model)) or {})
+        if st.get("n"):
+            if ok:
+                st["lat"] = (1 - ALPHA) * st["lat"] + ALPHA * ms
+            st["err"] = (1 - ALPHA) * st["err"] + ALPHA * (0.0 if ok else 1.0)
+        else:
+            st = {"lat": float(ms), "err": 0.0 if ok else 1.0, "n": 0}
+        st["n"] += 1
+        cache.set(_stats_key(model), st, STATS_TTL)
+        with _lock:
+            _local[model] = (st, time.monotonic())
+    except Exception:
+        logger.debug("routing.record failed model=%s", model, exc_info=True)
+
+def _score(model):
+    st = model_stats(model)
+    if not st.get("n"):
+        return 0.0   # unknown models get tried first, then compete on real numbers
+    return st["lat"] * (1 + ERROR_PENALTY * st["err"])
+
+def fastest(candidates):
+    if len(candidates) > 1 and random.random() < EXPLORE:
+        return random.choice(candidates)
+    return min(candidates, key=_score)
+
+def route_model(provider, requested_model, field, allowed):
+    """Return (model, route) for one Elementor field."""
+    short = int(getattr(settings, "ROUTE_SHORT_TEXT_CHARS", 200))
+    if field.is_html or field.purpose not in SHORT_PURPOSES or len(field.text) > short:
+        return requested_model, "requested"
+    tiers = getattr(settings, "LLM_FAST_MODELS", DEFAULT_FAST_MODELS)
+    candidates = [m for m in tiers.get(provider, []) if m in allowed]
+    if not candidates:
+        return requested_model, "requested"
+    return fastest(candidates), "fast"
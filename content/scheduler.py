@@ -0,0 +1,210 @@
+# content/scheduler.py
+"""
+Priority-lane executor for outbound LLM calls.
+
+Every provider call of a worker process runs on this executor's fixed set of threads
+(= the per-process concurrency limit). Work waits in one queue per lane (paid, trial).
+A free thread picks the next lane by smooth weighted round-robin among lanes that have
+work, so under contention paid traffic gets weight/total of the slots. A lane's
+`max_share` caps how many slots it may hold at once, so a trial burst can never occupy
+every slot while a paying request is waiting to start.
+
+Inside a lane, work is queued per tenant and served by deficit round-robin (unit cost
+per call, quantum = tenant weight), with a per-tenant in-flight cap. A 300-widget page
+from one agency therefore interleaves with, instead of sitting in front of, a three-call
+request from a small tenant. The cap is work-conserving: it only holds a tenant back
+while another tenant in the lane is waiting below its own cap, so a lone large page still
+gets every free slot.
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from django.db import close_old_connections
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+PAID_LANE  = "paid"
+TRIAL_LANE = "trial"
+
+DEFAULT_LANES = {
+    PAID_LANE:  {"weight": 4, "max_share": 1.0},
+    TRIAL_LANE: {"weight": 1, "max_share": 0.5},
+}
+
+PUBLISH_EVERY = 1.0  # seconds between queue-depth gauge updates
+
+
+def lane_for_plan(plan) -> str:
+    return TRIAL_LANE if (plan or "trial") in ("trial", "demo") else PAID_LANE
+
+
+class _Job:
+    __slots__ = ("fn", "args", "future", "enqueued", "tenant")
+
+    def __init__(self, tenant, fn, args):
+        self.tenant = tenant
+        self.fn, self.args = fn, args
+        self.future = Future()
+        self.enqueued = time.monotonic()
+
+
+class LaneExecutor:
+    def __init__(self, workers: int, lanes: dict, tenant_cap: int = 0, tenant_weights: dict | None = None):
+        self.workers = max(1, int(workers))
+        self.lanes = lanes
+        self.tenant_cap = int(tenant_cap) or max(1, self.workers // 2)
+        self.tenant_weights = tenant_weights or {}
+        self._cv = threading.Condition()
+        self._queues  = {name: {} for name in lanes}      # lane -> tenant -> deque[_Job]
+        self._rings   = {name: deque() for name in lanes} # lane -> tenants with queued work (DRR order)
+        self._depth   = {name: 0 for name in lanes}
+        self._running = {name: 0 for name in lanes}
+        self._current = {name: 0 for name in lanes}       # smooth weighted round-robin state
+        self._deficit = {}                                # (lane, tenant) -> remaining quantum this round
+        self._tenant_running = {}
+        self._capped  = 0                                 # picks skipped because a tenant was at its cap
+        self._threads = []
+        self._published = 0.0
+        self.ewma_call_s = 2.0   # smoothed provider-call duration, used for Retry-After estimates
+
+    def submit(self, lane, tenant, fn, *args) -> Future:
+        if lane not in self._queues:
+            lane = TRIAL_LANE
+        tenant = str(tenant or "anon")
+        job = _Job(tenant, fn, args)
+        with self._cv:
+            if not self._threads:
+                self._start()
+            tq = self._queues[lane]
+            if tenant not in tq:
+                tq[tenant] = deque()
+                self._rings[lane].append(tenant)
+            tq[tenant].append(job)
+            self._depth[lane] += 1
+            self._publish()
+            self._cv.notify()
+        return job.future
+
+    def load(self) -> tuple[int, int]:
+        """(queued, running) calls across all lanes."""
+        with self._cv:
+            return sum(self._depth.values()), sum(self._running.values())
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {n: {"depth": self._depth[n], "running": self._running[n],
+                        "tenants": {t: len(q) for t, q in self._queues[n].items()}}
+                    for n in self._queues}
+
+    # ---- internals (call with self._cv held) ----
+    def _start(self):
+        # started lazily so forked gunicorn workers each get their own threads
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f"llm-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _cap(self, lane) -> int:
+        return max(1, math.ceil(self.workers * float(self.lanes[lane].get("max_share", 1.0))))
+
+    def _runnable(self, lane) -> bool:
+        # some queued tenant is always eligible: the tenant cap only applies while others wait
+        return bool(self._depth[lane]) and self._running[lane] < self._cap(lane)
+
+    def _pick_tenant_job(self, lane):
+        """
+        Deficit round-robin over the lane's tenants. Tenants at their in-flight cap are
+        skipped only when another queued tenant is below its cap (work-conserving).
+        """
+        ring, tq = self._rings[lane], self._queues[lane]
+        enforce = any(self._tenant_running.get(t, 0) < self.tenant_cap for t in ring)
+        for _ in range(len(ring)):
+            t = ring[0]
+            if enforce and self._tenant_running.get(t, 0) >= self.tenant_cap:
+                self._capped += 1
+                ring.rotate(-1)
+                continue
+            d = (lane, t)
+            if self._deficit.get(d, 0) <= 0:
+                self._deficit[d] = self._deficit.get(d, 0) + int(self.tenant_weights.get(t, 1))
+            self._deficit[d] -= 1
+            job = tq[t].popleft()
+            if not tq[t]:
+                ring.popleft()
+                del tq[t]
+                self._deficit.pop(d, None)
+            elif self._deficit[d] <= 0:
+                ring.rotate(-1)
+            return job
+        return None
+
+    def _next(self):
+        ready = [n for n in self._queues if self._runnable(n)]
+        if not ready:
+            return None
+        total = 0
+        for n in ready:
+            w = int(self.lanes[n].get("weight", 1))
+            self._current[n] += w
+            total += w
+        best = max(ready, key=lambda n: self._current[n])
+        self._current[best] -= total
+        job = self._pick_tenant_job(best)
+        self._depth[best] -= 1
+        return best, job
+
+    def _publish(self):
+        now = time.monotonic()
+        if now - self._published < PUBLISH_EVERY:
+            return
+        self._published = now
+        for n in self._queues:
+            metrics.gauge(f"sched.{n}.depth", self._depth[n])
+            metrics.gauge(f"sched.{n}.running", self._running[n])
+            metrics.gauge(f"sched.{n}.tenants", len(self._rings[n]))
+        if self._capped:
+            metrics.incr("sched.tenant_capped", self._capped)
+            self._capped = 0
+
+    def _work(self):
+        while True:
+            with self._cv:
+                picked = self._next()
+                while picked is None:
+                    self._cv.wait()
+                    picked = self._next()
+                lane, job = picked
+                self._running[lane] += 1
+                self._tenant_running[job.tenant] = self._tenant_running.get(job.tenant, 0) + 1
+                self._publish()
+            try:
+                if job.future.set_running_or_notify_cancel():
+                    waited = (time.monotonic() - job.enqueued) * 1000
+                    metrics.observe(f"sched.{lane}.wait", waited)
+                    metrics.observe(f"sched.tenant.{job.tenant}.wait", waited)
+                    started = time.monotonic()
+                    try:
+                        job.future.set_result(job.fn(*job.args))
+                    except BaseException as e:
+                        job.future.set_exception(e)
+                    self.ewma_call_s = 0.8 * self.ewma_call_s + 0.2 * (time.monotonic() - started)
+            except Exception:
+                logger.exception("LaneExecutor job bookkeeping failed lane=%s", lane)
+            finally:
+                # jobs may touch the DB (key store reads); don't leak connections per thread
+                close_old_connections()
+                with self._cv:
+                    self._running[lane] -= 1
+                    left = self._tenant_running.get(job.tenant, 1) - 1
+                    if left > 0:
+                        self._tenant_running[job.tenant] = left
+                    else:
+                        self._tenant_running.pop(job.tenant, None)
+                    # a lane or tenant that was at its cap may be runnable again
+                    self._cv.notify_all()
@@ -1,12 +1,18 @@
-import os, json, html, datetime, logging
+import os, json, html, datetime, logging, hashlib, threading, time
+from collections import OrderedDict
 from django.conf import settings
+from django.core.cache import cache
+from concurrent.futures import wait, FIRST_EXCEPTION, TimeoutError as FutureTimeout
 from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 
+from core import metrics
+from . import keypool, keystore, routing
+from .scheduler import LaneExecutor, DEFAULT_LANES, PAID_LANE
+
 logger = logging.getLogger(__name__)
 
-TENANT_KEYS = {}
-OPENAI_CLIENTS = {}
-GEMINI_READY = {}
+OPENAI_CLIENTS = {}   # key fingerprint -> OpenAI client
+GEMINI_CLIENTS = {}   # key fingerprint -> GenerativeServiceClient
 
 GEMINI_DEFAULT = "gemini-1.5-flash"
 OPENAI_DEFAULT = "gpt-4o-mini"
@@ -27,23 +33,34 @@ def norm_site(site: str|None) -> str:
     u = urlparse(site); host = (u.netloc or u.path).lower()
     return host[4:] if host.startswith("www.") else host
 
-def upsert_keys_for_site(site, openai_key, gemini_key):
-    s = norm_site(site)
-    if not s: return
-    entry = dict(TENANT_KEYS.get(s, {}))
-    if openai_key: entry["openai_key"] = openai_key.strip()
-    if gemini_key: entry["gemini_key"] = gemini_key.strip()
-    TENANT_KEYS[s] = entry
-    logger.info("Upserted keys for site=%s (openai=%s gemini=%s)",
-                s, bool(entry.get("openai_key")), bool(entry.get("gemini_key")))
-
-def get_site_keys(site):
+def _split_sources(values):
+    """Keys from several request sources (body, header); each a key, comma-separated string or list."""
+    return [k for v in values for k in keypool.split_keys(v)]
+
+def upsert_keys_for_site(site, tenant, openai_keys, gemini_keys):
+    """
+    Make the keys sent with this request the tenant's pool for the site, per provider
+    (openai_keys / gemini_keys: lists of request sources, see _split_sources).
+    """
     s = norm_site(site)
-    site_keys = TENANT_KEYS.get(s, {}) if s else {}
-    openai_key = site_keys.get("openai_key") or getattr(settings, "OPENAI_API_KEY", "") or ""
-    gemini_key = site_keys.get("gemini_key") or getattr(settings, "GEMINI_API_KEY", "") or ""
-    logger.debug("get_site_keys site=%s openai=%s gemini=%s", s, bool(openai_key), bool(gemini_key))
-    return {"openai_key": openai_key, "gemini_key": gemini_key}
+    if not s or not tenant: return
+    sent = {"openai": _split_sources(openai_keys), "gemini": _split_sources(gemini_keys)}
+    if not sent["openai"] and not sent["gemini"]: return
+    keystore.set_keys(tenant, s, sent)
+
+def get_key_pool(site, provider, tenant=""):
+    """All keys usable for this tenant's site+provider; falls back to the server-wide key."""
+    pool = keystore.get_pools(tenant, norm_site(site)).get(provider) or []
+    if pool:
+        return list(pool)
+    default = getattr(settings, "OPENAI_API_KEY" if provider == "openai" else "GEMINI_API_KEY", "") or ""
+    return [default] if default else []
+
+def get_site_keys(site, tenant=""):
+    openai_keys = get_key_pool(site, "openai", tenant)
+    gemini_keys = get_key_pool(site, "gemini", tenant)
+    logger.debug("get_site_keys site=%s openai=%d gemini=%d", norm_site(site), len(openai_keys), len(gemini_keys))
+    return {"openai_key": openai_keys[0] if openai_keys else "", "gemini_key": gemini_keys[0] if gemini_keys else ""}
 
 def normalize_provider(p):
     p = (p or "").strip().lower()
@@ -63,13 +80,13 @@ def validate_model(provider, m):
     if provider=="openai": return m if m in ALLOWED_MODELS["openai"] else OPENAI_DEFAULT
     raise ValueError("unknown provider")
 
-def resolve_provider_and_model(opts, site):
+def resolve_provider_and_model(opts, site, tenant=""):
     try:
         req_p = normalize_provider((opts or {}).get("provider"))
         req_m = (opts or {}).get("model") or ""
         provider = req_p or model_belongs_to(req_m)
         if not provider:
-            keys = get_site_keys(site)
+            keys = get_site_keys(site, tenant)
             provider = "openai" if keys["openai_key"] else ("gemini" if keys["gemini_key"] else "openai")
         provider = normalize_provider(provider)
         model = validate_model(provider, req_m)
@@ -89,128 +106,482 @@ def clamp_temperature(x):
     t = max(0.0, min(t, 2.0))
     return t
 
-def get_openai_client_for(site):
+def get_openai_client(api_key):
     from openai import OpenAI
-    api_key = get_site_keys(site)["openai_key"]
-    if not api_key:
-        logger.error("OpenAI key missing for site=%s", norm_site(site))
-        raise ValueError("OpenAI key missing")
-    cache_key = f"{norm_site(site) or 'GLOBAL'}::{api_key[:8]}"
-    if cache_key in OPENAI_CLIENTS:
-        logger.debug("Reusing OpenAI client for %s", cache_key)
-        return OPENAI_CLIENTS[cache_key]
+    fp = keypool.fingerprint(api_key)
+    if fp in OPENAI_CLIENTS:
+        return OPENAI_CLIENTS[fp]
     try:
         client = OpenAI(api_key=api_key)
-        OPENAI_CLIENTS[cache_key] = client
-        logger.info("Created OpenAI client for site=%s key=%s", norm_site(site), _mask(api_key))
+        OPENAI_CLIENTS[fp] = client
+        logger.info("Created OpenAI client key=%s", _mask(api_key))
         return client
     except Exception:
-        logger.exception("Failed to create OpenAI client for site=%s", norm_site(site))
+        logger.exception("Failed to create OpenAI client key=%s", _mask(api_key))
         raise
 
-def ensure_gemini_configured_for(site):
-    import google.generativeai as genai
-    api_key = get_site_keys(site)["gemini_key"]
-    if not api_key:
-        logger.error("Gemini key missing for site=%s", norm_site(site))
-        raise ValueError("Gemini key missing")
-    if not GEMINI_READY.get(api_key):
+def get_gemini_client(api_key):
+    """
+    GenerativeServiceClient bound to one key. genai.configure() is process-global, so with
+    several keys in flight each key gets its own service client instead.
+    """
+    from google.ai import generativelanguage as glm
+    fp = keypool.fingerprint(api_key)
+    client = GEMINI_CLIENTS.get(fp)
+    if client is None:
+        client = GEMINI_CLIENTS[fp] = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        logger.info("Created Gemini client key=%s", _mask(api_key))
+    return client
+
+def gemini_generate_content(api_key, model, contents, generation_config, system="", cached_content=None,
+                            stream=False, timeout=None):
+    """
+    GenerativeModel.generate_content sent through the key's own client: the request is built
+    with the SDK's public converters and the reply wrapped in its GenerateContentResponse.
+    """
+    from google.generativeai import protos
+    from google.generativeai.types import content_types, generation_types
+    if cached_content is not None:
+        model_name, system_instruction = cached_content.model, None   # system lives in the cache
+    else:
+        model_name = model if "/" in model else f"models/{model}"
+        system_instruction = content_types.to_content(system) if system else None
+    request = protos.GenerateContentRequest(
+        model=model_name,
+        contents=content_types.to_contents(contents),
+        generation_config=generation_types.to_generation_config_dict(generation_config),
+        system_instruction=system_instruction,
+        cached_content=cached_content.name if cached_content is not None else None,
+    )
+    if request.contents and not request.contents[-1].role:
+        request.contents[-1].role = "user"
+    client = get_gemini_client(api_key)
+    if stream:
+        return generation_types.GenerateContentResponse.from_iterator(
+            client.stream_generate_content(request, timeout=timeout))
+    return generation_types.GenerateContentResponse.from_response(client.generate_content(request, timeout=timeout))
+
+def _with_key(site, provider, call, tenant=""):
+    """
+    Run call(api_key) with the pooled key that has the most headroom. If that key is
+    taken out of rotation (auth error / 429) and the pool has another, retry once.
+    """
+    pool = get_key_pool(site, provider, tenant)
+    if not pool:
+        logger.error("%s key missing for site=%s", provider, norm_site(site))
+        raise ValueError(f"{provider} key missing")
+    attempts = min(2, len(pool))
+    for attempt in range(attempts):
+        with keypool.lease(pool) as key:
+            try:
+                return call(key)
+            except (Cancelled, DeadlineExceeded):
+                raise
+            except Exception as e:
+                if keypool.on_error(key, e) and attempt + 1 < attempts:
+                    logger.warning("%s call failed on key=%s (%s); retrying with another pooled key",
+                                   provider, _mask(key), type(e).__name__)
+                    continue
+                raise
+
+# ---------- Prompt layout ----------
+# Provider prompt caches (OpenAI automatic prefix caching, Gemini cached content) only
+# help when the long, stable part of a prompt is a byte-identical PREFIX. So every
+# prompt is built as: system rules -> shared prefix (instructions/reference) -> the
+# small per-call part last.
+REWRITE_SYSTEM = (
+    "You are a professional website copywriter. You rewrite one block of website content at a time. "
+    "Return ONLY the rewritten block in the same format as the original: HTML stays HTML with the same "
+    "tag structure, TEXT stays plain text. Do not add explanations, labels, code fences or surrounding quotes."
+)
+
+BLOG_SYSTEM = (
+    "Write a complete, SEO-friendly blog article with H2/H3 subheadings, short paragraphs, and bullet/numbered lists where helpful.\n"
+    "Return ONLY a single valid JSON object with keys: title, sections[{heading,text}], faq[{q,a}]."
+)
+
+def make_rewrite_prefix(instructions):
+    """Shared by every field of a request (and by repeat requests with the same instructions)."""
+    return "Rewrite instructions (apply to every block):\n" + (instructions or "")
+
+def make_rewrite_prompt(original, is_html, locale=""):
+    block = "HTML" if is_html else "TEXT"
+    lang  = f" Write it in the language/locale '{locale}'." if locale else ""
+    return (
+        f"BEGIN_ORIGINAL_{block}\n{original}\nEND_ORIGINAL_{block}\n"
+        f"Return ONLY the rewritten {block}.{lang}"
+    )
+
+# One executor per process for all outbound provider calls, so total in-flight calls per
+# worker stay bounded no matter how many fields/locales a request fans out into.
+# Work is queued per plan lane (paid ahead of trial), see content/scheduler.py.
+LLM_MAX_CONCURRENCY = int(getattr(settings, "LLM_MAX_CONCURRENCY", 8))
+LLM_POOL = LaneExecutor(
+    LLM_MAX_CONCURRENCY, getattr(settings, "LLM_LANES", DEFAULT_LANES),
+    tenant_cap=int(getattr(settings, "LLM_TENANT_MAX_INFLIGHT", 0)),
+    tenant_weights=getattr(settings, "LLM_TENANT_WEIGHTS", None),
+)
+
+# Per-call ceiling even without a request deadline, so one stuck call cannot pin a worker
+LLM_CALL_TIMEOUT = float(getattr(settings, "LLM_CALL_TIMEOUT", 60))
+
+class DeadlineExceeded(Exception):
+    """A provider call was skipped or timed out because the request deadline ran out."""
+
+def _is_timeout(exc):
+    return isinstance(exc, (TimeoutError, DeadlineExceeded)) or \
+        type(exc).__name__ in {"APITimeoutError", "DeadlineExceeded", "ReadTimeout", "Timeout"}
+
+def _deadline_spent(ctx, exc):
+    """True when a timeout came from this request (skipped/queued past its deadline, or cut at it)."""
+    if isinstance(exc, DeadlineExceeded):
+        return True
+    return ctx is not None and (ctx.cancelled or ctx.call_timeout(LLM_CALL_TIMEOUT) <= 0)
+
+def _call_timeout(ctx):
+    t = LLM_CALL_TIMEOUT if ctx is None else ctx.call_timeout(LLM_CALL_TIMEOUT)
+    if t <= 0:
+        raise DeadlineExceeded("request deadline reached")
+    return t
+
+class Cancelled(Exception):
+    """The client disconnected; remaining provider calls for its request are abandoned."""
+
+def _check_cancelled(ctx):
+    if ctx is not None and ctx.cancelled:
+        raise Cancelled("client disconnected")
+
+def run_parallel(fn, items, ctx=None):
+    """
+    Run fn(item) for every item on the shared LLM pool and return results in input order.
+    Items that hit the request deadline (not started in time, or timed out) or that were
+    abandoned because the client disconnected yield None.
+    Any other failure cancels whatever has not started yet and is re-raised.
+    """
+    def guarded(it):
         try:
+            _check_cancelled(ctx)
+            return fn(it)
+        except DeadlineExceeded:
+            return None
+        except Cancelled:
+            return None
+
+    lane, tenant = (ctx.lane, ctx.tenant) if ctx is not None else (PAID_LANE, "")
+    order = [LLM_POOL.submit(lane, tenant, guarded, it) for it in items]
+    pending = set(order)
+    # with a disconnect signal, poll in short slices so it is noticed promptly
+    poll = 0.25 if ctx is not None and ctx.cancel_event is not None else None
+    while pending and not (ctx is not None and ctx.cancelled):
+        left = None if ctx is None or ctx.deadline is None else ctx.remaining()
+        if left is not None and left <= 0:
+            break
+        timeout = poll if left is None else (left if poll is None else min(poll, left))
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_EXCEPTION)
+        if any(not f.cancelled() and f.exception() for f in done):
+            break
+    for f in pending:
+        f.cancel()
+    try:
+        return [f.result() if f.done() and not f.cancelled() else None for f in order]
+    except Exception:
+        for f in order:
+            f.cancel()
+        raise
+
+def run_call(ctx, fn, *args):
+    """Run a single provider call on the lane executor and wait for it (deadline-bounded)."""
+    fut = LLM_POOL.submit(ctx.lane, ctx.tenant, fn, *args)
+    try:
+        return fut.result(timeout=None if ctx.deadline is None else max(0.0, ctx.remaining()))
+    except FutureTimeout:
+        fut.cancel()
+        raise DeadlineExceeded("request deadline reached while queued")
+
+# Explicit Gemini context caching is only worth it (and only allowed) for big prefixes.
+GEMINI_CACHE_MIN_CHARS = int(getattr(settings, "GEMINI_CACHE_MIN_CHARS", 120_000))  # ~32k tokens
+GEMINI_CACHE_TTL       = int(getattr(settings, "GEMINI_CACHE_TTL", 600))
+GEMINI_CACHED_MAX      = 256
+GEMINI_CACHED = OrderedDict()   # digest -> (CachedContent, expires_at); LRU local copy of the shared handle
+_gemini_cache_lock = threading.Lock()
+_gemini_configure_lock = threading.Lock()
+
+def _gemini_cached_content(api_key, model, system, prefix):
+    """
+    Return a CachedContent holding system+prefix, shared by name across workers via the
+    Django cache. None when the prefix is too small or caching is unavailable.
+    """
+    if len(prefix or "") < GEMINI_CACHE_MIN_CHARS:
+        return None
+    import google.generativeai as genai
+    from google.generativeai import caching
+    digest = hashlib.sha256(f"{keypool.fingerprint(api_key)}\0{model}\0{system}\0{prefix}".encode()).hexdigest()[:32]
+    now = time.time()
+    with _gemini_cache_lock:
+        hit = GEMINI_CACHED.get(digest)
+        if hit and hit[1] > now:
+            GEMINI_CACHED.move_to_end(digest)
+            return hit[0]
+    ck = f"gemini:cc:{digest}"
+    try:
+        # the caching API only talks through the process-global client: configure + call under a lock
+        with _gemini_configure_lock:
             genai.configure(api_key=api_key)
-            GEMINI_READY[api_key] = True
-            logger.info("Configured Gemini for site=%s key=%s", norm_site(site), _mask(api_key))
-        except Exception:
-            logger.exception("Failed to configure Gemini for site=%s", norm_site(site))
-            raise
+            name = cache.get(ck)
+            cc = None
+            if name:
+                try:
+                    cc = caching.CachedContent.get(name)
+                except Exception:
+                    cache.delete(ck)
+            if cc is None:
+                cc = caching.CachedContent.create(
+                    model=f"models/{model}", system_instruction=system, contents=[prefix],
+                    ttl=datetime.timedelta(seconds=GEMINI_CACHE_TTL),
+                )
+                cache.set(ck, cc.name, GEMINI_CACHE_TTL - 30)
+                logger.info("Gemini cached content created key=%s model=%s chars=%d", _mask(api_key), model, len(prefix))
+        with _gemini_cache_lock:
+            for d in [d for d, (_, exp) in GEMINI_CACHED.items() if exp <= now]:
+                del GEMINI_CACHED[d]
+            GEMINI_CACHED[digest] = (cc, now + GEMINI_CACHE_TTL - 30)
+            GEMINI_CACHED.move_to_end(digest)
+            while len(GEMINI_CACHED) > GEMINI_CACHED_MAX:
+                GEMINI_CACHED.popitem(last=False)
+        return cc
+    except Exception:
+        logger.warning("Gemini context caching unavailable key=%s model=%s; sending full prompt",
+                       _mask(api_key), model, exc_info=True)
+        return None
+
+def _gemini_generate(prompt, model, site, generation_config, system="", prefix="", ctx=None):
+    return _with_key(site, "gemini", lambda key: _gemini_generate_with(
+        key, prompt, model, generation_config, system, prefix, ctx), tenant=ctx.tenant if ctx else "")
 
-def ai_text(prompt, model, provider, site, temperature=0.7):
+def _gemini_generate_with(api_key, prompt, model, generation_config, system, prefix, ctx):
+    cc = _gemini_cached_content(api_key, model, system, prefix)
+    contents = [prompt] if cc is not None else ([prefix, prompt] if prefix else [prompt])
+    _check_cancelled(ctx)
+    stream = ctx is not None and ctx.cancel_event is not None
+    out = gemini_generate_content(api_key, model, contents, generation_config, system, cc,
+                                  stream=stream, timeout=_call_timeout(ctx))
+    if stream:
+        # Streaming lets us stop mid-generation (and stop paying) if the client goes away
+        parts = []
+        for chunk in out:
+            if ctx.cancelled:
+                metrics.incr("llm.cancelled.aborted")
+                raise Cancelled("client disconnected")
+            try:
+                parts.append(chunk.text or "")
+            except ValueError:  # chunk without text parts (e.g. finish/safety metadata)
+                pass
+        text = "".join(parts)
+    else:
+        text = getattr(out, "text", None) or ""
+    um = getattr(out, "usage_metadata", None)
+    if ctx is not None and um is not None:
+        ctx.add_usage(getattr(um, "prompt_token_count", 0), getattr(um, "cached_content_token_count", 0),
+                      getattr(um, "candidates_token_count", 0))
+    return text.strip()
+
+def _openai_chat(prompt, model, site, temperature, system="", prefix="", ctx=None, **extra):
+    return _with_key(site, "openai", lambda key: _openai_chat_with(
+        key, prompt, model, temperature, system, prefix, ctx, **extra), tenant=ctx.tenant if ctx else "")
+
+def _openai_chat_with(api_key, prompt, model, temperature, system, prefix, ctx, **extra):
+    # no SDK retries: a retry must not silently run past the request deadline
+    client = get_openai_client(api_key).with_options(timeout=_call_timeout(ctx), max_retries=0)
+    completions = client.chat.completions.with_raw_response   # raw: we need the rate-limit headers
+    # system rules + shared prefix form one identical leading message across calls
+    head = system + ("\n\n" + prefix if prefix else "")
+    messages = [{"role":"system","content":head}, {"role":"user","content":prompt}]
+    _check_cancelled(ctx)
+    if ctx is not None and ctx.cancel_event is not None:
+        # Streaming lets us close the connection mid-generation if the client goes away,
+        # which stops generation (and billing) on OpenAI's side too.
+        text, u = [], None
+        raw = completions.create(
+            model=model, temperature=temperature, messages=messages,
+            stream=True, stream_options={"include_usage": True}, **extra
+        )
+        keypool.observe_headers(api_key, raw.headers)
+        stream = raw.parse()
+        try:
+            for chunk in stream:
+                if ctx.cancelled:
+                    metrics.incr("llm.cancelled.aborted")
+                    raise Cancelled("client disconnected")
+                if chunk.choices:
+                    text.append(chunk.choices[0].delta.content or "")
+                u = chunk.usage or u
+        finally:
+            stream.close()
+        text = "".join(text)
+    else:
+        raw = completions.create(model=model, temperature=temperature, messages=messages, **extra)
+        keypool.observe_headers(api_key, raw.headers)
+        resp = raw.parse()
+        text, u = resp.choices[0].message.content or "", getattr(resp, "usage", None)
+    if ctx is not None and u is not None:
+        details = getattr(u, "prompt_tokens_details", None)
+        ctx.add_usage(u.prompt_tokens, getattr(details, "cached_tokens", 0), u.completion_tokens)
+    return text.strip()
+
+def report_usage(ctx, tag):
+    """Log + count one request's token usage and prompt-cache hit ratio."""
+    u = ctx.usage
+    metrics.incr("llm.calls", u["calls"])
+    metrics.incr("llm.prompt_tokens", u["prompt_tokens"])
+    metrics.incr("llm.cached_tokens", u["cached_tokens"])
+    metrics.incr("llm.completion_tokens", u["completion_tokens"])
+    logger.info("%s: usage cid=%s calls=%d prompt_tokens=%d cached_tokens=%d cached_ratio=%.2f",
+                tag, ctx.cid, u["calls"], u["prompt_tokens"], u["cached_tokens"], ctx.cached_ratio)
+    for route, (n, total_ms) in ctx.routes.items():
+        logger.info("%s: route cid=%s route=%s calls=%d avg_ms=%.0f", tag, ctx.cid, route, n, total_ms / n)
+
+def ai_text(prompt, model, provider, site, temperature=0.7, prefix="", ctx=None, system=REWRITE_SYSTEM,
+            route="requested"):
+    """
+    One rewrite call. Only latency-routed short fields (route="fast") feed content.routing's
+    per-model stats: comparable calls, so long HTML rewrites don't distort the EWMA.
+    Exits caused by the request itself (its deadline ran out, the client left) are not
+    counted; a provider timeout with request time left is a failure at its latency.
+    """
     temp = clamp_temperature(temperature)
+    routed = route == "fast"
+    t0 = time.monotonic()
     try:
         if provider=="gemini":
-            import google.generativeai as genai
-            ensure_gemini_configured_for(site)
-            mdl = genai.GenerativeModel(model)
             logger.info("Gemini.generate_content start site=%s model=%s", norm_site(site), model)
-            out = mdl.generate_content(prompt, generation_config={"temperature": temp})
-            text = (getattr(out, "text", None) or "").strip()
+            text = _gemini_generate(prompt, model, site, {"temperature": temp}, system, prefix, ctx)
             logger.info("Gemini.generate_content ok site=%s len=%d", norm_site(site), len(text))
-            return text
-
-        client = get_openai_client_for(site)
-        logger.info("OpenAI.chat.completions.create start site=%s model=%s", norm_site(site), model)
-        resp = client.chat.completions.create(
-            model=model, temperature=temp,
-            messages=[{"role":"system","content":"You are a helpful writing assistant."},
-                      {"role":"user","content":prompt}]
-        )
-        text = (resp.choices[0].message.content or "").strip()
-        logger.info("OpenAI.chat ok site=%s len=%d", norm_site(site), len(text))
+        else:
+            logger.info("OpenAI.chat.completions.create start site=%s model=%s", norm_site(site), model)
+            text = _openai_chat(prompt, model, site, temp, system, prefix, ctx)
+            logger.info("OpenAI.chat ok site=%s len=%d", norm_site(site), len(text))
+        if routed:
+            routing.record(model, (time.monotonic() - t0) * 1000, ok=True)
         return text
-    except Exception:
+    except Cancelled:
+        raise
+    except Exception as e:
+        if _is_timeout(e):
+            if routed and not _deadline_spent(ctx, e):
+                # the provider hung with request time left: that is the model's failure
+                routing.record(model, (time.monotonic() - t0) * 1000, ok=False)
+            logger.warning("ai_text deadline site=%s provider=%s model=%s", norm_site(site), provider, model)
+            raise DeadlineExceeded(str(e)) from e
+        if routed:
+            routing.record(model, (time.monotonic() - t0) * 1000, ok=False)
         logger.exception("ai_text failed site=%s provider=%s model=%s", norm_site(site), provider, model)
         raise
 
 def make_blog_prompt(user_prompt, reference_text="", sitemap_url=""):
-    parts = [
-        "Write a complete, SEO-friendly blog article with H2/H3 subheadings, short paragraphs, and bullet/numbered lists where helpful.",
-        "Return ONLY a single valid JSON object with keys: title, sections[{heading,text}], faq[{q,a}].",
-    ]
+    """
+    Returns (prefix, prompt): the per-tenant stable part (reference text, link rules)
+    and the variable topic, which always goes last.
+    """
+    parts = []
     if reference_text:
         parts.append("Match the tone/structure:\n---REFERENCE START---\n"+reference_text+"\n---REFERENCE END---")
     if sitemap_url:
         parts.append(f"Only create INTERNAL links under {sitemap_url}. Do not invent URLs.")
-    parts.append("Topic/Prompt:\n"+(user_prompt or ""))
-    return "\n\n".join(parts)
+    return "\n\n".join(parts), "Topic/Prompt:\n"+(user_prompt or "")
+
+# Structured-output contract for blog docs. OpenAI enforces it via json_schema (strict),
+# Gemini via response_schema (an OpenAPI subset without additionalProperties).
+BLOG_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "sections": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"heading": {"type": "string"}, "text": {"type": "string"}},
+            "required": ["heading", "text"], "additionalProperties": False,
+        }},
+        "faq": {"type": "array", "items": {
+            "type": "object",
+            "properties": {"q": {"type": "string"}, "a": {"type": "string"}},
+            "required": ["q", "a"], "additionalProperties": False,
+        }},
+    },
+    "required": ["title", "sections", "faq"],
+    "additionalProperties": False,
+}
+
+def _gemini_schema(schema):
+    """Strip keys Gemini's response_schema does not understand."""
+    if isinstance(schema, dict):
+        return {k: _gemini_schema(v) for k, v in schema.items() if k != "additionalProperties"}
+    return schema
+
+GEMINI_BLOG_SCHEMA = _gemini_schema(BLOG_SCHEMA)
 
-def ai_blog_json(prompt, model, provider, site, temperature=0.7):
+def normalize_blog_doc(data):
+    """
+    Validate and normalize a parsed blog doc in one pass.
+    Raises ValueError when the shape is unusable (caller decides on a fallback).
+    """
+    if not isinstance(data, dict):
+        raise ValueError("blog doc is not an object")
+    secs, faq = data.get("sections"), data.get("faq") or []
+    if not isinstance(secs, list) or not isinstance(faq, list):
+        raise ValueError("sections/faq must be arrays")
+    out_secs = []
+    for s in secs:
+        if isinstance(s, dict):
+            out_secs.append({"heading": str(s.get("heading") or "Section"), "text": str(s.get("text") or "")})
+        else:
+            out_secs.append({"heading": "Section", "text": str(s)})
+    if not out_secs:
+        raise ValueError("no sections")
+    out_faq = []
+    for f in faq:
+        if isinstance(f, dict):
+            q, a = str(f.get("q") or ""), str(f.get("a") or "")
+        else:
+            q, a = str(f), ""
+        if q or a: out_faq.append({"q": q, "a": a})
+    return {"title": str(data.get("title") or "Draft"), "sections": out_secs, "faq": out_faq}
+
+def ai_blog_json(prompt, model, provider, site, temperature=0.7, prefix="", ctx=None):
     temp = clamp_temperature(temperature)
     txt = ""
     try:
         if provider=="gemini":
-            import google.generativeai as genai
-            ensure_gemini_configured_for(site)
-            mdl = genai.GenerativeModel(model)
             logger.info("Gemini.generate_content (blog) start site=%s model=%s", norm_site(site), model)
-            out = mdl.generate_content(prompt, generation_config={"temperature": temp})
-            txt = (getattr(out, "text", None) or "").strip()
+            txt = _gemini_generate(prompt, model, site, {
+                "temperature": temp,
+                "response_mime_type": "application/json",
+                "response_schema": GEMINI_BLOG_SCHEMA,
+            }, BLOG_SYSTEM, prefix, ctx)
         else:
-            client = get_openai_client_for(site)
             logger.info("OpenAI.chat (blog) start site=%s model=%s", norm_site(site), model)
-            resp = client.chat.completions.create(
-                model=model, temperature=temp, response_format={"type":"json_object"},
-                messages=[{"role":"system","content":"Reply with ONLY one valid JSON object."},
-                          {"role":"user","content":prompt}]
+            txt = _openai_chat(
+                prompt, model, site, temp, BLOG_SYSTEM, prefix, ctx,
+                response_format={"type": "json_schema",
+                                 "json_schema": {"name": "blog_doc", "strict": True, "schema": BLOG_SCHEMA}},
             )
-            txt = (resp.choices[0].message.content or "").strip()
 
-        # Parse JSON
+        # Parse + validate once; anything unusable is a tracked fallback
         try:
-            data = json.loads(txt)
+            doc = normalize_blog_doc(json.loads(txt))
+            metrics.incr(f"blog_json.{provider}.ok")
             logger.info("Parsed blog JSON ok site=%s sections=%d faq=%d",
-                        norm_site(site), len(data.get("sections") or []), len(data.get("faq") or []))
-        except Exception:
-            logger.warning("Blog JSON parse failed; returning fallback. site=%s text_len=%d",
-                           norm_site(site), len(txt))
-            data = {"title":"Draft","sections":[{"heading":"Body","text":txt}],"faq":[]}
-
-        # normalize
-        secs = data.get("sections") or []
-        faq = data.get("faq") or []
-        out_secs = []
-        for s in secs:
-            if isinstance(s, dict):
-                out_secs.append({"heading": s.get("heading") or "Section", "text": s.get("text") or ""})
-            else:
-                out_secs.append({"heading": "Section", "text": str(s)})
-        out_faq = []
-        for f in faq:
-            if isinstance(f, dict):
-                q, a = f.get("q") or "", f.get("a") or ""
-            else:
-                q, a = str(f), ""
-            if q or a: out_faq.append({"q": q, "a": a})
-        return {"title": data.get("title") or "Draft", "sections": out_secs, "faq": out_faq}
-    except Exception:
+                        norm_site(site), len(doc["sections"]), len(doc["faq"]))
+            return doc
+        except ValueError as e:  # json.JSONDecodeError is a ValueError
+            metrics.incr(f"blog_json.{provider}.fallback")
+            logger.warning("Blog JSON invalid (%s); returning fallback. site=%s text_len=%d",
+                           e, norm_site(site), len(txt))
+            return {"title": "Draft", "sections": [{"heading": "Body", "text": txt}], "faq": []}
+    except Cancelled:
+        raise
+    except Exception as e:
+        if _is_timeout(e):
+            logger.warning("ai_blog_json deadline site=%s provider=%s model=%s", norm_site(site), provider, model)
+            raise DeadlineExceeded(str(e)) from e
         logger.exception("ai_blog_json failed site=%s provider=%s model=%s", norm_site(site), provider, model)
         raise
 
@@ -1,3 +1,51 @@
-from django.test import TestCase
+import threading
+import time
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .scheduler import DEFAULT_LANES, PAID_LANE, LaneExecutor
+
+
+class TenantCapTests(SimpleTestCase):
+    def _blocking(self, pool, tenant, n, release):
+        started = threading.Semaphore(0)
+
+        def job():
+            started.release()
+            release.wait(5)
+        futures = [pool.submit(PAID_LANE, tenant, job) for _ in range(n)]
+        return started, futures
+
+    def _running(self, pool, tenant):
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            with pool._cv:
+                n = pool._tenant_running.get(tenant, 0)
+            if n:
+                time.sleep(0.05)
+                with pool._cv:
+                    return pool._tenant_running.get(tenant, 0)
+            time.sleep(0.01)
+        return 0
+
+    def test_lone_tenant_gets_every_slot(self):
+        pool, release = LaneExecutor(4, DEFAULT_LANES, tenant_cap=2), threading.Event()
+        _, futures = self._blocking(pool, "big", 6, release)
+        self.assertEqual(self._running(pool, "big"), 4)
+        release.set()
+        for f in futures:
+            f.result(5)
+
+    def test_cap_holds_while_another_tenant_waits(self):
+        pool, release = LaneExecutor(4, DEFAULT_LANES, tenant_cap=2), threading.Event()
+        hold = threading.Event()
+        _, filler = self._blocking(pool, "filler", 4, hold)   # every slot busy while the rest queues
+        self.assertEqual(self._running(pool, "filler"), 4)
+        _, big = self._blocking(pool, "big", 4, release)
+        _, small = self._blocking(pool, "small", 2, release)
+        hold.set()
+        self.assertEqual(self._running(pool, "small"), 2)
+        self.assertEqual(self._running(pool, "big"), 2)
+        release.set()
+        for f in filler + big + small:
+            f.result(5)
@@ -1,35 +1,33 @@
-import logging, time, uuid
+import logging, re, time, uuid
 from pprint import pprint
-import time
 
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
 
+from django.conf import settings as dj_settings
+
+from core import metrics
+from core.disconnect import disconnect_event
 from billing.auth import ApiKeyAuthentication
 from billing.permissions import IsSubscriber
+from .context import GenContext
 from .serializers import GenPayload, BlogPreviewPayload
 from .services import (
     norm_site, upsert_keys_for_site, get_site_keys, resolve_provider_and_model,
-    clamp_temperature, ai_text, ai_blog_json, make_blog_prompt, render_preview_html
-)
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
-from rest_framework.response import Response
-from rest_framework.exceptions import ValidationError
-from rest_framework import status
-import logging, re, time
-from billing.auth import ApiKeyAuthentication
-from billing.permissions import IsSubscriber
-from .serializers import GenPayload, BlogPreviewPayload
-from .services import (
-    norm_site, upsert_keys_for_site, get_site_keys, resolve_provider_and_model,
-    clamp_temperature, ai_text, ai_blog_json, make_blog_prompt, render_preview_html
+    clamp_temperature, ai_text, ai_blog_json, make_blog_prompt, render_preview_html,
+    make_rewrite_prefix, make_rewrite_prompt, report_usage, run_parallel, run_call,
+    DeadlineExceeded, Cancelled, ALLOWED_MODELS
 )
+from .elementor import extract_fields, apply_rewrites
+from .routing import route_model
 
 
 logger = logging.getLogger(__name__)
 
+MAX_LOCALES = 20
+
 def _safe_bool(v):  # show True/False only
     return bool(v) and True or False
 
@@ -66,6 +64,22 @@ def _safe_opts(opts: dict):
 logger = logging.getLogger(__name__)
 
 def _safe_bool(x): return bool(x)
+
+def _auth_ctx(request):
+    """Plan + tenant from ApiKeyAuthentication, used for lane and fair-queue scheduling."""
+    auth = request.auth if isinstance(request.auth, dict) else {}
+    return {"plan": auth.get("plan", ""), "tenant": auth.get("tenant_id", "")}
+
+def _deadline_ms(request, default_setting="GEN_DEFAULT_DEADLINE_MS", fallback=25000):
+    """Request budget: X-Deadline-Ms header (clamped) or the endpoint's server default."""
+    default = int(getattr(dj_settings, default_setting, fallback))
+    ceiling = int(getattr(dj_settings, "GEN_MAX_DEADLINE_MS", 120000))
+    try:
+        ms = int(request.headers.get("X-Deadline-Ms") or default)
+    except (TypeError, ValueError):
+        ms = default
+    # keep a little back for building the response
+    return max(1000, min(ms, ceiling)) - int(getattr(dj_settings, "GEN_DEADLINE_RESERVE_MS", 500))
 def _safe_opts(opts):
     try:
         # Don’t dump whole payload; show only small summary
@@ -177,17 +191,27 @@ def generate(request):
         if not isinstance(elementor, list):
             raise ValidationError({"elementor": "Must be an array matching Elementor JSON structure."})
 
+        # Optional multi-locale fan-out: one Elementor tree per locale in a single request
+        locales = data.get("locales") or []
+        if not isinstance(locales, list) or not all(isinstance(l, str) and l.strip() for l in locales):
+            raise ValidationError({"locales": "Must be an array of locale strings."})
+        locales = list(dict.fromkeys(l.strip() for l in locales))
+        if len(locales) > MAX_LOCALES:
+            raise ValidationError({"locales": f"At most {MAX_LOCALES} locales per request."})
+
         # Optional: site + provider/model/temperature (kept, but minimal)
         site         = norm_site(str(data.get("site") or "")) if "site" in data else ""
+        tenant       = _auth_ctx(request)["tenant"]
         opts         = data.get("options") or {}
-        provider, model = resolve_provider_and_model(opts, site)
+        provider, model = resolve_provider_and_model(opts, site, tenant)
         temperature  = clamp_temperature(opts.get("temperature") or 0.7)
 
         # Upsert keys from headers/body (same idea as your PHP `provider_headers`)
-        upsert_keys_for_site(site, data.get("openai_key"), data.get("gemini_key"))
-        upsert_keys_for_site(site, request.headers.get("X-OpenAI-Key"), request.headers.get("X-Gemini-Key"))
+        upsert_keys_for_site(site, tenant,
+                             [data.get("openai_key"), request.headers.get("X-OpenAI-Key")],
+                             [data.get("gemini_key"), request.headers.get("X-Gemini-Key")])
 
-        keys = get_site_keys(site) if site else {"openai_key": request.headers.get("X-OpenAI-Key"), "gemini_key": request.headers.get("X-Gemini-Key")}
+        keys = get_site_keys(site, tenant) if site else {"openai_key": request.headers.get("X-OpenAI-Key"), "gemini_key": request.headers.get("X-Gemini-Key")}
         if provider == "openai" and not keys.get("openai_key"):
             logger.warning("gen: missing_openai_key cid=%s site=%s", cid, site)
             return Response({"detail": "OpenAI key missing."}, status=400)
@@ -197,174 +221,83 @@ def generate(request):
 
         logger.info("gen: elementor start cid=%s site=%s provider=%s model=%s", cid, site, provider, model)
 
-        # ------- Allowed widgets/fields (mirror of your PHP) -------
-        ALLOWED = {
-            "heading": [
-                {"key": "title", "html": False, "shape": "string", "purpose": "headline"},
-            ],
-            "text-editor": [
-                {"key": "editor", "html": True, "shape": "string", "purpose": "html"},
-            ],
-            "button": [
-                {"key": "text", "html": False, "shape": "string", "purpose": "label"},
-            ],
-            "icon-box": [
-                {"key": "title_text", "html": False, "shape": "string", "purpose": "headline"},
-                {"key": "description_text", "html": True, "shape": "string", "purpose": "paragraph"},
-            ],
-            "image-box": [
-                {"key": "title_text", "html": False, "shape": "string", "purpose": "headline"},
-                {"key": "description_text", "html": True, "shape": "string", "purpose": "paragraph"},
-            ],
-            "testimonial": [
-                {"key": "testimonial_content", "html": True, "shape": "string", "purpose": "paragraph"},
-                {"key": "testimonial_name", "html": False, "shape": "string", "purpose": "label"},
-                {"key": "testimonial_job", "html": False, "shape": "string", "purpose": "label"},
-            ],
-            "alert": [
-                {"key": "alert_title", "html": False, "shape": "string", "purpose": "headline"},
-                {"key": "alert_description", "html": True, "shape": "string", "purpose": "paragraph"},
-            ],
-            "html": [
-                {"key": "html", "html": True, "shape": "string", "purpose": "html"},
-            ],
-            # Repeaters
-            "accordion": [
-                {"key": "tabs[].tab_title", "html": False, "shape": "string_or_raw", "purpose": "headline"},
-                {"key": "tabs[].tab_content", "html": True, "shape": "string", "purpose": "html"},
-            ],
-            # NEW: nested-accordion & icon-list
-            "nested-accordion": [
-                {"key": "items[].item_title", "html": False, "shape": "string_or_raw", "purpose": "headline"},
-            ],
-            "icon-list": [
-                {"key": "icon_list[].text", "html": False, "shape": "string_or_raw", "purpose": "label"},
-            ],
-        }
-
-        repeater_re = re.compile(r"^([a-z0-9_]+)\[\]\.([a-z0-9_]+)$", re.I)
-
-        def _get_raw_or_string(val):
-            """Preserve Elementor's {'raw': '...'} when present."""
-            if isinstance(val, dict):
-                return str(val.get("raw") or "")
-            return str(val or "")
-
-        def _put_back_raw_or_string(settings, key, original_value, new_value):
-            """Write back to settings preserving raw-shape if the original was a dict."""
-            if isinstance(original_value, dict):
-                if key not in settings or not isinstance(settings[key], dict):
-                    settings[key] = {}
-                settings[key]["raw"] = new_value
-            else:
-                settings[key] = new_value
-
-        def build_prompt(widget_type, field_key, original, is_html):
-            block = "HTML" if is_html else "TEXT"
-            instructions = prompt
-            return (
-                f"Rewrite the following {block} according to these instructions:\n"
-                f"Instructions: {instructions}\n\n\n"
-                f"BEGIN_ORIGINAL_{block}\n\n\n\n{original}\n\n\n\nEND_ORIGINAL_{block}\n"
-                f"Return ONLY the rewritten {block} in the same format as the original and do not include any additional text or any additional signs [like html or text or any additional quotes, just give me the plain and professional {block}."
-            )
-
-        def traverse(elements):
-            if not isinstance(elements, list):
-                return elements
-            out = []
-            for el in elements:
-                if not isinstance(el, dict):
-                    out.append(el)
-                    continue
-
-                # Process widgets
-                if el.get("elType") == "widget" and isinstance(el.get("settings"), dict):
-                    widget_type = el.get("widgetType") or ""
-                    settings    = dict(el["settings"])  # copy
-
-                    rules = ALLOWED.get(widget_type) or []
-                    for rule in rules:
-                        key     = rule.get("key")
-                        is_html = bool(rule.get("html"))
-                        shape   = (rule.get("shape") or "string")
-
-                        # Repeater pattern: e.g., tabs[].tab_title
-                        m = repeater_re.match(key or "")
-                        if m:
-                            rep_key, item_key = m.group(1), m.group(2)
-                            rep_list = settings.get(rep_key)
-                            if isinstance(rep_list, list):
-                                for idx in range(len(rep_list)):
-                                    item = rep_list[idx]
-                                    if not isinstance(item, dict) or item_key not in item:
-                                        continue
-                                    orig_val = item[item_key]
-                                    current  = _get_raw_or_string(orig_val) if shape == "string_or_raw" else str(orig_val or "")
-                                    if not current:
-                                        continue
-
-                                    try:
-                                        ptxt      = build_prompt(widget_type, key, current, is_html)
-                                        rewritten = ai_text(ptxt, model, provider, site, temperature)
-                                    except Exception:
-                                        logger.exception("ai_text failed (repeater) cid=%s site=%s widget=%s key=%s", cid, site, widget_type, key)
-                                        raise
-
-                                    # Put back preserving shape
-                                    if shape == "string_or_raw":
-                                        if isinstance(orig_val, dict):
-                                            if not isinstance(item.get(item_key), dict):
-                                                item[item_key] = {}
-                                            item[item_key]["raw"] = rewritten
-                                        else:
-                                            item[item_key] = rewritten
-                                    else:
-                                        item[item_key] = rewritten
-                            # proceed to next rule
-                            continue
-
-                        # Flat key
-                        if key in settings:
-                            orig_val = settings[key]
-                            current  = _get_raw_or_string(orig_val) if shape == "string_or_raw" else str(orig_val or "")
-                            if current:
-                                try:
-                                    ptxt      = build_prompt(widget_type, key, current, is_html)
-                                    rewritten = ai_text(ptxt, model, provider, site, temperature)
-                                except Exception:
-                                    logger.exception("ai_text failed (flat) cid=%s site=%s widget=%s key=%s", cid, site, widget_type, key)
-                                    raise
-
-                                if shape == "string_or_raw":
-                                    _put_back_raw_or_string(settings, key, orig_val, rewritten)
-                                else:
-                                    settings[key] = rewritten
-
-                    # write back settings
-                    el["settings"] = settings
-
-                # Recurse into children
-                if isinstance(el.get("elements"), list):
-                    el["elements"] = traverse(el["elements"])
-
-                out.append(el)
-            return out
+        # Identical for every field in this request -> provider prompt-cache hits
+        prefix = make_rewrite_prefix(prompt)
+        ctx    = GenContext(cid, site, _deadline_ms(request), disconnect_event(request),
+                            **_auth_ctx(request))
+        request._request.llm_usage = ctx.usage   # billing.requestlog picks it up after the response
+
+        # ------- Extract once, then fan out (field x locale) on the shared pool -------
+        fields = extract_fields(elementor)
+        # Opt-in: short headline/label TEXT goes to the fastest equivalent model
+        latency_routing = str(opts.get("routing") or "").lower() == "latency"
+        routes = [route_model(provider, model, f, ALLOWED_MODELS[provider]) if latency_routing
+                  else (model, "requested") for f in fields]
+        jobs   = {}   # (text, is_html, locale, model, route) -> job index; identical fields share one call
+        for f, (m, route) in zip(fields, routes):
+            for loc in (locales or [""]):
+                jobs.setdefault((f.text, f.is_html, loc, m, route), len(jobs))
+        logger.info("gen: extracted cid=%s fields=%d locales=%d calls=%d",
+                    cid, len(fields), len(locales or [""]), len(jobs))
+
+        def rewrite(job):
+            text, is_html, loc, m, route = job
+            started = time.monotonic()
+            try:
+                return ai_text(make_rewrite_prompt(text, is_html, loc), m, provider, site, temperature, prefix, ctx,
+                               route=route)
+            finally:
+                ms = (time.monotonic() - started) * 1000
+                ctx.add_route(route, ms)
+                metrics.observe(f"route.{route}.latency", ms)
 
         t1 = time.time()
         try:
-            updated = traverse(elementor)
+            results = run_parallel(rewrite, list(jobs), ctx)
         except Exception as e:
-            logger.error("gen: traverse failed cid=%s site=%s err=%s", cid, site, str(e), exc_info=True)
+            logger.error("gen: rewrite failed cid=%s site=%s err=%s", cid, site, str(e), exc_info=True)
             return Response({"detail": "AI processing failed while rewriting Elementor content."}, status=400)
 
+        if ctx.cancelled:
+            # Nobody is listening; skip rebuilding trees and record the calls we did not pay for
+            metrics.incr("gen.disconnected")
+            metrics.incr("llm.cancelled.saved_calls", len(jobs) - ctx.usage["calls"])
+            logger.info("gen: client_disconnected cid=%s site=%s calls_made=%d of %d",
+                        cid, site, ctx.usage["calls"], len(jobs))
+            report_usage(ctx, "gen")
+            return Response(status=499)
+
+        # Fields whose call did not finish before the deadline keep their original text
+        untouched = []
+
+        def tree_for(loc):
+            rewrites = [results[jobs[(f.text, f.is_html, loc, m, route)]] for f, (m, route) in zip(fields, routes)]
+            for f, r in zip(fields, rewrites):
+                if r is None:
+                    untouched.append({"id": f.el_id, "path": f.where, "key": f.key, **({"locale": loc} if loc else {})})
+            return apply_rewrites(elementor, fields, rewrites)
+
         elapsed = time.time() - t1
         logger.info("gen: elementor_ok cid=%s site=%s elapsed=%.2fs", cid, site, elapsed)
         logger.info("gen: done cid=%s total=%.2fs", cid, time.time() - t0)
+        report_usage(ctx, "gen")
 
         # Exactly what your PHP client expects:
         # process_elementor() -> do_post() expects {"elementor": [...]}
-        return Response({"elementor": updated}, status=200)
+        if locales:
+            body = {"locales": {loc: tree_for(loc) for loc in locales}}
+        else:
+            body = {"elementor": tree_for("")}
+        if untouched:
+            metrics.incr("gen.partial")
+            metrics.incr("gen.untouched_fields", len(untouched))
+            logger.warning("gen: partial cid=%s site=%s untouched=%d of %d", cid, site, len(untouched),
+                           len(fields) * len(locales or [""]))
+            body.update(partial=True, untouched=untouched)
+        resp = Response(body, status=200)
+        resp["X-LLM-Calls"] = str(ctx.usage["calls"])
+        resp["X-LLM-Cached-Ratio"] = f"{ctx.cached_ratio:.4f}"
+        return resp
 
     except ValidationError as e:
         logger.warning("gen: validation cid=%s detail=%s", cid, e.detail)
@@ -423,14 +356,16 @@ def blog_preview(request):
         data = s.validated_data
 
         site = norm_site(data.get("site") or "")
-        upsert_keys_for_site(site, data.get("openai_key"), data.get("gemini_key"))
-        upsert_keys_for_site(site, request.headers.get("X-Openai-Key"), request.headers.get("X-Gemini-Key"))
+        tenant = _auth_ctx(request)["tenant"]
+        upsert_keys_for_site(site, tenant,
+                             [data.get("openai_key"), request.headers.get("X-Openai-Key")],
+                             [data.get("gemini_key"), request.headers.get("X-Gemini-Key")])
 
         opts = data.get("options") or {}
-        provider, model = resolve_provider_and_model(opts, site)
+        provider, model = resolve_provider_and_model(opts, site, tenant)
         temperature = clamp_temperature(opts.get("temperature") or 0.7)
 
-        keys = get_site_keys(site)
+        keys = get_site_keys(site, tenant)
         logger.info(
             "bp: start cid=%s site=%s provider=%s model=%s keys(openai=%s,gemini=%s) opts=%s",
             cid, site, provider, model, _safe_bool(keys.get("openai_key")), _safe_bool(keys.get("gemini_key")),
@@ -445,19 +380,35 @@ def blog_preview(request):
             return Response({"detail": "Gemini key missing for this site."}, status=400)
 
         t1 = time.time()
-        composite = make_blog_prompt(
+        prefix, topic = make_blog_prompt(
             data.get("prompt") or "",
             (opts.get("reference_text") or "").strip(),
             (opts.get("sitemap_url") or "").strip()
         )
-        doc = ai_blog_json(composite, model, provider, site, temperature)
+        # a whole article takes far longer than a page of field rewrites
+        ctx = GenContext(cid, site, _deadline_ms(request, "BLOG_DEFAULT_DEADLINE_MS", 90000),
+                         disconnect_event(request), **_auth_ctx(request))
+        request._request.llm_usage = ctx.usage
+        try:
+            doc = run_call(ctx, ai_blog_json, topic, model, provider, site, temperature, prefix, ctx)
+        except DeadlineExceeded:
+            logger.warning("bp: deadline cid=%s site=%s", cid, site)
+            return Response({"detail": "AI provider timed out. Please retry."}, status=504)
+        except Cancelled:
+            metrics.incr("bp.disconnected")
+            logger.info("bp: client_disconnected cid=%s site=%s", cid, site)
+            return Response(status=499)
         html = render_preview_html(doc)
         elapsed = time.time() - t1
 
         logger.info("bp: ok cid=%s site=%s elapsed=%.2fs title_len=%d html_len=%d",
                     cid, site, elapsed, len(doc.get("title") or ""), len(html or ""))
         logger.info("bp: done cid=%s total=%.2fs", cid, time.time() - t0)
-        return Response({"html": html, "title": doc.get("title")})
+        report_usage(ctx, "bp")
+        resp = Response({"html": html, "title": doc.get("title")})
+        resp["X-LLM-Calls"] = str(ctx.usage["calls"])
+        resp["X-LLM-Cached-Ratio"] = f"{ctx.cached_ratio:.4f}"
+        return resp
 
     except ValidationError as e:
         logger.warning("bp: validation cid=%s site=%s detail=%s", cid, locals().get("site", ""), e.detail)
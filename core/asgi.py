@@ -11,6 +11,9 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from core.disconnect import DisconnectSignal
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+# DisconnectSignal lets AI views stop paying for LLM output nobody will read
+application = DisconnectSignal(get_asgi_application())
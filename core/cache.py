@@ -0,0 +1,176 @@
+# core/cache.py
+"""
+Two-tier cache for read-heavy entries: per-process L1 in front of the shared Django cache.
+
+    tier = TieredCache("auth:key", l1_ttl=30, l2_ttl=300)
+    value = tier.get(key, loader)      # L1 -> L2 -> loader(key) (result written to both)
+    tier.set(key, value)               # write-through
+    tier.delete(key, ...)              # drop from L2 + this L1, bump the namespace version
+
+Every namespace has a version number in the shared cache (cachever:<namespace>). L1 entries
+are stamped with the version they were read under, and each process re-reads the version
+at most every `version_check` seconds, so a delete()/bump() anywhere evicts the namespace
+from every worker's L1 within that bound. `version_check=0` checks on every get.
+
+Hit/miss counts per namespace are aggregated in-process and flushed to core.metrics every
+METRICS_FLUSH seconds as cache.<namespace>.l1_hit / l2_hit / miss.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+METRICS_FLUSH = 10.0
+
+
+def _ver_key(namespace): return f"cachever:{namespace}"
+
+
+class TieredCache:
+    def __init__(self, namespace: str, l1_ttl: float = 30, l1_size: int = 10_000, l2_ttl: int = 300,
+                 version_check: float = 1.0):
+        self.namespace = namespace
+        self.l1_ttl, self.l1_size, self.l2_ttl = l1_ttl, l1_size, l2_ttl
+        self.version_check = version_check
+        self._l1 = OrderedDict()       # key -> (value, version, expires_at)
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_read = 0.0
+        self._stats = {"l1_hit": 0, "l2_hit": 0, "miss": 0}
+        self._stats_flushed = time.monotonic()
+
+    def l2_key(self, key) -> str:
+        return f"{self.namespace}:{key}"
+
+    # ---- version ----
+    def _read_version(self):
+        try:
+            ver = cache.get_or_set(_ver_key(self.namespace), 1, None)
+        except Exception:
+            ver = None
+        with self._lock:
+            self._version, self._version_read = ver, time.monotonic()
+        return ver
+
+    def version(self):
+        if time.monotonic() - self._version_read >= self.version_check:
+            return self._read_version()
+        return self._version
+
+    def bump(self):
+        """Invalidate every worker's L1 for this namespace."""
+        try:
+            try:
+                cache.incr(_ver_key(self.namespace))
+            except ValueError:
+                cache.set(_ver_key(self.namespace), 2, None)
+        except Exception:
+            logger.warning("cache: version bump failed namespace=%s", self.namespace, exc_info=True)
+        self._read_version()
+
+    # ---- L1 ----
+    def _l1_get(self, key, version):
+        with self._lock:
+            hit = self._l1.get(key)
+            if hit is None:
+                return None
+            value, ver, expires = hit
+            if ver != version or expires < time.monotonic():
+                del self._l1[key]
+                return None
+            self._l1.move_to_end(key)
+            return value
+
+    def _l1_put(self, key, value, version):
+        with self._lock:
+            self._l1[key] = (value, version, time.monotonic() + self.l1_ttl)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    # ---- public ----
+    def get(self, key, loader=None):
+        version = self.version()
+        if version is not None:
+            value = self._l1_get(key, version)
+            if value is not None:
+                self._count("l1_hit")
+                return value
+            try:
+                value = cache.get(self.l2_key(key))
+            except Exception:
+                value = None
+            if value is not None:
+                self._count("l2_hit")
+                self._l1_put(key, value, version)
+                return value
+        self._count("miss")
+        if loader is None:
+            return None
+        value = loader(key)
+        if value is None:
+            return None
+        # don't publish a value loaded before a concurrent delete()/bump()
+        if version is not None and self._read_version() == version:
+            self.set(key, value, version=version)
+        return value
+
+    def set(self, key, value, version=None):
+        try:
+            cache.set(self.l2_key(key), value, self.l2_ttl)
+        except Exception:
+            logger.debug("cache: L2 set failed namespace=%s", self.namespace, exc_info=True)
+        version = version if version is not None else self.version()
+        if version is not None:
+            self._l1_put(key, value, version)
+
+    def set_many(self, mapping: dict):
+        """Write-through for many keys with one L2 round trip."""
+        if not mapping:
+            return
+        try:
+            cache.set_many({self.l2_key(k): v for k, v in mapping.items()}, self.l2_ttl)
+        except Exception:
+            logger.debug("cache: L2 set_many failed namespace=%s", self.namespace, exc_info=True)
+        version = self.version()
+        if version is not None:
+            for k, v in mapping.items():
+                self._l1_put(k, v, version)
+
+    def delete(self, *keys, bump=True):
+        keys = [k for k in keys if k]
+        if not keys:
+            return
+        try:
+            cache.delete_many([self.l2_key(k) for k in keys])
+        except Exception:
+            logger.warning("cache: L2 delete failed namespace=%s", self.namespace, exc_info=True)
+        with self._lock:
+            for k in keys:
+                self._l1.pop(k, None)
+        if bump:
+            self.bump()
+
+    # ---- metrics ----
+    def _count(self, what):
+        with self._lock:
+            self._stats[what] += 1
+            if time.monotonic() - self._stats_flushed < METRICS_FLUSH:
+                return
+            stats, self._stats = self._stats, {"l1_hit": 0, "l2_hit": 0, "miss": 0}
+            self._stats_flushed = time.monotonic()
+        for name, n in stats.items():
+            metrics.incr(f"cache.{self.namespace}.{name}", n)
+
+    def hit_ratio(self) -> float:
+        """Fleet-wide (L1+L2) hit ratio from the flushed counters."""
+        names = [f"cache.{self.namespace}.{n}" for n in ("l1_hit", "l2_hit", "miss")]
+        got = metrics.read(*names)
+        hits = got[names[0]] + got[names[1]]
+        return metrics.ratio(hits, hits + got[names[2]])
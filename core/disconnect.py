@@ -0,0 +1,34 @@
+# core/disconnect.py
+import threading
+
+
+class DisconnectSignal:
+    """
+    ASGI wrapper exposing scope["disconnected"]: a threading.Event set as soon as the
+    server delivers http.disconnect. Sync views run in worker threads, so they cannot be
+    cancelled directly; they poll this event to stop issuing (and abort in-flight)
+    provider calls for a client that has gone away.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope.get("type") != "http":
+            return await self.app(scope, receive, send)
+
+        gone = threading.Event()
+
+        async def _receive():
+            message = await receive()
+            if message.get("type") == "http.disconnect":
+                gone.set()
+            return message
+
+        return await self.app(dict(scope, disconnected=gone), _receive, send)
+
+
+def disconnect_event(request):
+    """The request's disconnect Event under ASGI, else None (WSGI has no such signal)."""
+    scope = getattr(request, "scope", None)
+    return scope.get("disconnected") if isinstance(scope, dict) else None
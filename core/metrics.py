@@ -0,0 +1,52 @@
+# core/metrics.py
+"""
+Tiny counters kept in the Django cache.
+
+With a shared cache (Redis) every worker adds into the same keys, so numbers are
+fleet-wide; with the default LocMem cache they are per-process (fine for dev).
+Metrics must never break a request, so every helper swallows cache errors.
+"""
+import logging
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "metrics:"
+TTL    = 7 * 24 * 3600
+
+def _k(name: str) -> str:
+    return PREFIX + name
+
+def incr(name: str, n: int = 1) -> None:
+    """Add n to counter `name`."""
+    if not n:
+        return
+    k = _k(name)
+    try:
+        cache.add(k, 0, TTL)
+        cache.incr(k, int(n))
+    except Exception:
+        logger.debug("metrics.incr failed name=%s", name, exc_info=True)
+
+def observe(name: str, ms: float) -> None:
+    """Record one timing sample as <name>.count / <name>.sum_ms."""
+    incr(name + ".count")
+    incr(name + ".sum_ms", int(ms))
+
+def gauge(name: str, value) -> None:
+    """Overwrite a point-in-time value (queue depth, lag, ...)."""
+    try:
+        cache.set(_k(name), value, TTL)
+    except Exception:
+        logger.debug("metrics.gauge failed name=%s", name, exc_info=True)
+
+def read(*names: str) -> dict:
+    """Current values for the given metric names (missing -> 0)."""
+    try:
+        got = cache.get_many([_k(n) for n in names])
+    except Exception:
+        got = {}
+    return {n: got.get(_k(n), 0) for n in names}
+
+def ratio(num, den) -> float:
+    return round(float(num) / den, 4) if den else 0.0
@@ -0,0 +1,24 @@
+# core/redis_conn.py
+"""
+Shared raw Redis client for features that need more than the Django cache API
+(Lua scripts, hashes, RENAME). Returns None when REDIS_URL is not configured.
+"""
+import threading
+
+from django.conf import settings
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    url = getattr(settings, "REDIS_URL", "")
+    if not url:
+        return None
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import redis
+                _client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _client
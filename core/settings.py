@@ -30,6 +30,41 @@ STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
 # API keys
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+# Encrypts tenant provider keys at rest (content.ProviderKey); defaults to a SECRET_KEY-derived key
+PROVIDER_KEY_SECRET = os.getenv("PROVIDER_KEY_SECRET", "")
+
+# Max concurrent outbound LLM calls per worker process (shared by all requests)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Priority lanes in front of provider calls: weighted dispatch between lanes, and a cap
+# on the share of slots a lane may hold (keeps capacity free for paying customers).
+LLM_LANES = {
+    "paid":  {"weight": int(os.getenv("LLM_PAID_WEIGHT", "4")), "max_share": 1.0},
+    "trial": {"weight": int(os.getenv("LLM_TRIAL_WEIGHT", "1")),
+              "max_share": float(os.getenv("LLM_TRIAL_MAX_SHARE", "0.5"))},
+}
+# Fair queuing across tenants inside a lane: per-tenant in-flight cap per worker (0 = half
+# the slots; only enforced while another tenant is waiting) and optional DRR weights {tenant_id: weight}.
+LLM_TENANT_MAX_INFLIGHT = int(os.getenv("LLM_TENANT_MAX_INFLIGHT", "0"))
+LLM_TENANT_WEIGHTS = {}
+# Opt-in latency routing (options.routing="latency"): short headline/label TEXT fields
+# go to the fastest of these per-provider models, by shared EWMA latency/error stats.
+LLM_FAST_MODELS = {
+    "openai": ["gpt-4o-mini", "gpt-4.1-mini"],
+    "gemini": ["gemini-1.5-flash"],
+}
+ROUTE_SHORT_TEXT_CHARS = int(os.getenv("ROUTE_SHORT_TEXT_CHARS", "200"))
+# Admission control for AI endpoints (fleet-wide, summed across workers via the cache)
+ADMISSION_PATHS = ("/v1/generate/content", "/v1/blog/preview")
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "64"))
+ADMISSION_MAX_QUEUED_CALLS = int(os.getenv("ADMISSION_MAX_QUEUED_CALLS", "400"))
+ADMISSION_WORKER_MAX_INFLIGHT = int(os.getenv("ADMISSION_WORKER_MAX_INFLIGHT", "16"))
+ADMISSION_MAX_RETRY_AFTER = 60
+# Request deadline for AI endpoints (clients may send X-Deadline-Ms, clamped to the max)
+# and the per-call ceiling. Keep the default below the gunicorn worker timeout.
+GEN_DEFAULT_DEADLINE_MS = int(os.getenv("GEN_DEFAULT_DEADLINE_MS", "25000"))
+BLOG_DEFAULT_DEADLINE_MS = int(os.getenv("BLOG_DEFAULT_DEADLINE_MS", "90000"))   # blog_preview: a full article
+GEN_MAX_DEADLINE_MS = int(os.getenv("GEN_MAX_DEADLINE_MS", "120000"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))
 
 # Detect Azure App Service
 IS_AZURE = bool(os.environ.get("WEBSITE_SITE_NAME"))
@@ -87,6 +122,8 @@ else:
 # Allow any origin for API *without* credentials. Forms on your own site still use CSRF.
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = False  # critical to avoid cross-site cookies/CSRF
+# let browser clients read rate-limit / backoff headers
+CORS_EXPOSE_HEADERS = ["Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset"]
 
 # If you ever *must* send credentials from a specific frontend origin,
 # switch to:
@@ -107,11 +144,14 @@ MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    "billing.requestlog.RequestLogMiddleware",  # per-call event log (buffered); above admission so shed 503s are logged
+    "content.admission.AdmissionControlMiddleware",  # sheds AI requests (503) before auth/parsing
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",  # keep: protects your Django forms
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "billing.throttling.RateLimitHeadersMiddleware",  # X-RateLimit-* for API-key calls
 ]
 
 # ---------------- Templates ----------------
@@ -148,9 +188,36 @@ DATABASES = {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": SQLITE_PATH,
         "OPTIONS": {"timeout": 20},
+        # a file rather than shared-cache memory, so concurrent tests wait on the busy timeout like production
+        "TEST": {"NAME": os.path.join(os.path.dirname(SQLITE_PATH), "test_db.sqlite3")},
     }
 }
 
+# ---------------- Cache ----------------
+# Shared Redis in any multi-worker deployment: auth key records, quota/throttle counters,
+# metrics and admission load must be fleet-wide. Without REDIS_URL (local dev) each
+# process gets its own LocMem cache. Read-heavy entries add a per-process L1 on top
+# (core.cache.TieredCache).
+REDIS_URL = os.getenv("REDIS_URL", "")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": os.getenv("CACHE_KEY_PREFIX", "cg"),
+            "TIMEOUT": 300,
+            "OPTIONS": {"socket_timeout": 0.5, "socket_connect_timeout": 0.5},
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "cg-local",
+            "OPTIONS": {"MAX_ENTRIES": 50_000},
+        }
+    }
+
 # ---------------- Auth ----------------
 AUTH_USER_MODEL = "accounts.User"
 AUTH_PASSWORD_VALIDATORS = [
@@ -191,15 +258,59 @@ REST_FRAMEWORK = {
         "billing.auth.ApiKeyAuthentication",
     ],
     "DEFAULT_THROTTLE_CLASSES": [
-        "rest_framework.throttling.UserRateThrottle",
-        "rest_framework.throttling.AnonRateThrottle",
+        # per-key sliding window for API-key calls; the stock per-user/IP ones skip those
+        "billing.throttling.ApiKeyRateThrottle",
+        "billing.throttling.UserRateThrottle",
+        "billing.throttling.AnonRateThrottle",
     ],
     "DEFAULT_THROTTLE_RATES": {"user": "60/min", "anon": "10/min"},
 }
 
+# Per-plan limits for ApiKeyRateThrottle ("default" covers any other paid plan)
+API_KEY_RATE_LIMITS = {
+    "trial": os.getenv("RATE_LIMIT_TRIAL", "30/min"),
+    "demo": os.getenv("RATE_LIMIT_DEMO", "30/min"),
+    "default": os.getenv("RATE_LIMIT_PAID", "600/min"),
+}
+
+# Stateless signed API tokens (billing.signed); empty secret = derived from SECRET_KEY
+API_TOKEN_SECRET = os.getenv("API_TOKEN_SECRET", "")
+API_TOKEN_MAX_AGE = int(os.getenv("API_TOKEN_MAX_AGE", str(30 * 24 * 3600)))
+API_TOKEN_REVOCATION_SYNC = int(os.getenv("API_TOKEN_REVOCATION_SYNC", "30"))
+
+# ---------------- Trial quota engine (billing.quota) ----------------
+# Atomic counters use REDIS_URL (see Cache); without it they live in the DB (ApiKey.used_requests)
+# "redis" | "db" | "memory" (single process only); empty = redis if REDIS_URL else db
+QUOTA_BACKEND = os.getenv("QUOTA_BACKEND", "")
+
+# ---------------- Dashboard (billing.dashboard / accounts.views.dashboard) ----------------
+DASHBOARD_KPI_TTL = int(os.getenv("DASHBOARD_KPI_TTL", "120"))       # upper bound on KPI staleness
+DASHBOARD_JWT_MIN_TTL = int(os.getenv("DASHBOARD_JWT_MIN_TTL", "60"))  # re-mint when less is left
+
+# ---------------- API request log (billing.requestlog) ----------------
+REQUEST_LOG_PREFIXES = ("/v1/", "/api/")
+REQUEST_LOG_RETENTION_DAYS = int(os.getenv("REQUEST_LOG_RETENTION_DAYS", "7"))
+
 # ---------------- Celery (note: needs a worker/Redis to actually run) ----------------
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+CELERY_BEAT_SCHEDULE = {
+    # write-behind ApiKey usage (billing.usage); the interval bounds dashboard staleness
+    "billing-flush-usage": {
+        "task": "billing.tasks.flush_usage",
+        "schedule": float(os.getenv("USAGE_FLUSH_SECONDS", "30")),
+    },
+    # Stripe webhook inbox (billing.webhooks): due retries and anything the view couldn't enqueue
+    "billing-drain-webhooks": {
+        "task": "billing.tasks.drain_webhooks",
+        "schedule": 60.0,
+    },
+    # hourly per-key request rollups + raw event retention (billing.requestlog)
+    "billing-rollup-request-log": {
+        "task": "billing.tasks.rollup_request_log",
+        "schedule": 600.0,
+    },
+}
 
 LOGIN_REDIRECT_URL = "/dashboard/"
 LOGIN_URL = "login"
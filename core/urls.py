@@ -35,6 +35,7 @@ urlpatterns = [
     path("auth/refresh", TokenRefreshView.as_view(), name="token_refresh"),
     path("auth/register", acc_views.register, name="auth_register"),
     path("users/me", acc_views.me, name="users_me"),
+    path("users/bulk", acc_views.bulk_onboard, name="users_bulk_onboard"),   # staff: batch accounts + trial keys
 
     # Billing: include all billing routes (start, webhook, key, verify, test)
     path("billing/", include("billing.urls")),   # -> /billing/start/, /billing/webhook/, /billing/key/, /billing/verify/